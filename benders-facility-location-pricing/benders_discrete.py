@@ -20,6 +20,7 @@ import prints
 import functions
 import scenario_clustering
 import model_discrete_assortment
+import timing
 
 # Data
 #import data_N80_I14 as data_file
@@ -235,6 +236,7 @@ class WorkerLP():
         data['delta2_dual'] = np.zeros([data['I_tot_exp'], data['N'], data['R']])
         data['delta3_dual'] = np.zeros([data['I_tot_exp'], data['N'], data['R']])
 
+    @timing.timed('subproblem')
     def separateDual(self, y_sol, y, z):
         '''
         This method separates Benders' cuts violated by the current y - z solution.
@@ -382,6 +384,7 @@ class Callback():
         # Create workerLP for Benders' cuts separation
         self.workers = [None] * data['num_threads']
         
+    @timing.timed('callback', parent='solve')
     def separate_lazy_constraints(self, context, worker):
         '''Separate Benders cuts at integer solutions as lazy constraints.'''
 
@@ -622,6 +625,7 @@ class Callback():
             raise
 
 
+@timing.timed('build')
 def create_master_ilp(model, data, y, z):
     '''
     This function creates the master ILP
@@ -854,7 +858,10 @@ def create_master_ilp(model, data, y, z):
     print('N variables in Master problem   : {:4d}'.format(model.variables.get_num()))
     print('N constraints in Master problem : {:4d}'.format(model.linear_constraints.get_num()))
 
+    timing.modelSize(model)
 
+
+@timing.timed('solve')
 def branch_and_Benders_cut(master, data, y, z):
 
     print('\nBenders\' cuts separated to cut off: ', end=' ')
@@ -882,6 +889,7 @@ def branch_and_Benders_cut(master, data, y, z):
 
     # Solve the model
     master.solve()
+    timing.solverStatus(master)
 
 
 def singleCustomers(data):
@@ -1041,6 +1049,7 @@ def MIPWarmStart(master, data, y):
         master.MIP_starts.add(cplex.SparsePair(ind = y, val = data['all_y'][s]), 2)
 
 
+@timing.timed('preprocess')
 def preprocessing(data):
 
     data_file.printCustomers(data)
@@ -1245,6 +1254,7 @@ def main():
             data['y'][i] = 1.0
 
         parameters.BendersParameters(data)
+        timing.configure(data)
 
         #################################### 
         # Main algorithm
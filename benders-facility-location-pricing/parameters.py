@@ -99,4 +99,8 @@ def BendersParameters(data):
     data['minRClustering'] = 10
     data['nClustersN'] = int(math.floor(data['N']/4.0)) #number of clusters to generate (R<25 -> 5, R>50 -> 10)
     data['minNClustering'] = 10
-    
\ No newline at end of file
+    
+
+    ################ Phase timing: JSON-lines file of the events (None: summary printed at exit only)
+    
+    data['timing_file'] = None
@@ -16,6 +16,7 @@ import numpy as np
 import math
 
 import nested_logit
+import draw_store
 
 # Data
 import data_HSR_nested_logit
@@ -29,6 +30,18 @@ def setAlgorithmParameters(dict):
 
     dict['nEquilibria'] = 5
 
+    #### Checkpoints of the run (continue an interrupted run with: python main.py --resume)
+
+    # Checkpoint file (None: no checkpoints)
+    dict['checkpoint_file'] = None
+    # Minimum time between two checkpoints during the column generation method (sec)
+    dict['checkpoint_interval'] = 60
+
+    #### Phase timing (wall time, CPU time, model size and solver status of each phase, summary printed at exit)
+
+    # JSON-lines file of the timing events (None: summary only)
+    dict['timing_file'] = None
+
     #### Parameters of the fixed-point iteration algorithm
 
     # Initial optimizer
@@ -39,6 +52,12 @@ def setAlgorithmParameters(dict):
     dict['tolerance_equilibrium'] = 0.10
     # Tolerance for cycle convergence
     dict['tolerance_cyclic_equilibrium'] = 0.10
+    # Best responses of the suppliers one at a time ('GaussSeidel') or simultaneously to the same prices ('Jacobi')
+    dict['best_response_mode'] = 'GaussSeidel'
+    # Weight of the previous prices in the update of the Jacobi mode (0: no damping)
+    dict['best_response_damping'] = 0.0
+    # Number of processes solving the best-response problems of the Jacobi mode in parallel
+    dict['n_workers_best_response'] = 1
     # Counter of how many times the fixed-point iteration algorithm is used
     dict['countFixedPointIter'] = 1     #Initialized to 1
 
@@ -83,6 +102,12 @@ def getData():
     # Number of draws
     dict['R'] = 50
 
+    # Directory of the draw store (random tensors generated once and shared as read-only memory maps, None: no store)
+    dict['draw_store'] = None
+    # Seed of the draws of the store (None: drawn from the state of np.random for each instance)
+    dict['draw_store_seed'] = None
+    draw_store.setSeed(dict)
+
     # 1) Read discrete choice model parameters
     # 2) Read supply data
     # 3) Read demand data
@@ -92,7 +117,7 @@ def getData():
     data_HSR_nested_logit.data_instance(dict)
 
     # Random term (Gumbel distributed 0,1)
-    dict['xi'] = np.random.gumbel(size=(dict['I_tot'], dict['N'], dict['R']))
+    dict['xi'] = draw_store.draws(dict, 'xi', (dict['I_tot'], dict['N'], dict['R']), lambda rng: rng.gumbel(size=(dict['I_tot'], dict['N'], dict['R'])))
 
     # Define parameters of the algorithm
     setAlgorithmParameters(dict)
@@ -21,11 +21,13 @@ import generate_strategies
 import update_bounds
 import choice_preprocess
 import nested_logit
+import timing
 
 # Data
 import data_HSR as data_file
 
 
+@timing.timed('build')
 def getModel(data):
     '''
     CPLEX model for the fixed-point MIP model
@@ -875,21 +877,44 @@ def getModel(data):
     print('CPLEX model: all constraints added. N constraints: %r. Time: %r\n'\
           %(model.linear_constraints.get_num(), round(time.time()-t_in,2)))
 
-    return model, nameToIndex
+    timing.modelSize(model)
+
+    return model, solutionIndices(data, model.variables.get_num())
 
 
 #######################################################
 ######### SOLVE MODEL, SAVE RESULTS AND PRINT #########
 #######################################################
 
-def solveModel(model, nameToIndex, data):
+def solutionIndices(data, nVar):
+    '''
+    Indices of the variables read by solveModel, from the order in which they are added in getModel:
+    supply choices (strategies in the order of list_strategies_opt) and revenues first,
+    the demands of the initial and final iterations of each alternative last
+    '''
+
+    I, K, L = data['I_tot'], data['K'], data['tot_strategies']
+
+    # Supply choices of each strategy l
+    order = np.argsort(np.concatenate([data['list_strategies_opt'][k] for k in range(1, K + 1)]).astype(int))
+    demand = (nVar - I*(3 + L) + np.arange(I*(3 + L))).reshape(I, 3 + L)
+
+    return {'x_In': order, 'x_Fin': L + order,
+            'revenueMax_Fin': 2*L + np.arange(K), 'revenue_In': 2*L + K + np.arange(K),
+            'demand': demand[:, 0], 'demand_urban': demand[:, 1], 'demand_rural': demand[:, 2]}
+
+
+@timing.timed('extract')
+def solveModel(model, index, data):
 
     t_in = time.time()
 
     #model.set_results_stream(None)
     model.set_warning_stream(None)
     
-    model.solve()
+    with timing.phase('solve', __name__):
+        model.solve()
+        timing.solverStatus(model)
 
     print('Constraints: {:8.0f}\nVariables  : {:8.0f}'.format(model.linear_constraints.get_num(), model.variables.get_num()))
 
@@ -914,11 +939,14 @@ def solveModel(model, nameToIndex, data):
     # Obj value
     results['obj'] = model.solution.get_objective_value()
 
+    # Solution vector, extracted once
+    solution = np.array(model.solution.get_values())
+
     # Supply choices
     for k in range(1, data['K'] + 1):
+        results['supply_choice_in'][k][data['list_strategies_opt'][k]] = solution[index['x_In'][data['list_strategies_opt'][k]]]
+        results['supply_choice_fin'][k][data['list_strategies_opt'][k]] = solution[index['x_Fin'][data['list_strategies_opt'][k]]]
         for l in data['list_strategies_opt'][k]:
-            results['supply_choice_in'][k][l] = model.solution.get_values(nameToIndex['x_In[' + str(k) + ']' + '[' + str(l) + ']'])
-            results['supply_choice_fin'][k][l] = model.solution.get_values(nameToIndex['x_Fin[' + str(k) + ']' + '[' + str(l) + ']'])
             # Prices
             if results['supply_choice_in'][k][l] == 1:
                 for i in data['list_alt_supplier'][k]:
@@ -929,21 +957,20 @@ def solveModel(model, nameToIndex, data):
                     results['prices_urban_fin'][i] = data['scenarios']['prices_urban'][i][l]
                     results['prices_rural_fin'][i] = data['scenarios']['prices_rural'][i][l]
     
+    # Market shares
+    results['demand'][:] = solution[index['demand']]
+    results['demand_urban'][:] = solution[index['demand_urban']]
+    results['demand_rural'][:] = solution[index['demand_rural']]
+
     for i in range(data['I_tot']):
-        # Market shares
-        results['demand'][i] = model.solution.get_values(nameToIndex['demand[' + str(i) + ']'])
-        results['demand_urban'][i] = model.solution.get_values(nameToIndex['demand_urban[' + str(i) + ']'])
-        results['demand_rural'][i] = model.solution.get_values(nameToIndex['demand_rural[' + str(i) + ']'])
-        
         if data['DCM'] == 'NestedLogit':
             # Modal shares
             if data['alternatives'][i]['Mode'] == 'Train':
                 results['modeshare'][0] += results['demand'][i] / data['Pop']
     
     # Profits
-    for k in range(1, data['K'] + 1):
-        results['max_profit_in'][k] = model.solution.get_values(nameToIndex['revenue_In[' + str(k) + ']'])
-        results['max_profit_fin'][k] = model.solution.get_values(nameToIndex['revenueMax_Fin[' + str(k) + ']'])
+    results['max_profit_in'][1:] = solution[index['revenue_In']]
+    results['max_profit_fin'][1:] = solution[index['revenueMax_Fin']]
 
 
     ### PRINT THE RESULTS OBTAINED FROM THE MODEL
@@ -975,6 +1002,7 @@ if __name__ == '__main__':
     # Get the data and compute exogenous terms
     data = data_file.getData()
     data_file.preprocessUtilities(data)
+    timing.configure(data)
 
     generate_strategies.generateStrategySets(data)
 
@@ -991,11 +1019,11 @@ if __name__ == '__main__':
     t_1 = time.time()
 
     # Build the model
-    model, nameToIndex = getModel(data)
+    model, index = getModel(data)
     t_2 = time.time()
 
     # Solve the model
-    results = solveModel(model, nameToIndex, data)
+    results = solveModel(model, index, data)
     t_3 = time.time()
 
     print('\n ---- TIMING ---- ')
@@ -2,12 +2,15 @@
 # (simultaneous game solved in a sequential manner)
 
 # General
+import io
 import sys
 import time
 import copy
+import contextlib
+import concurrent.futures
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
-from itertools import cycle
+from itertools import cycle, product
 import numpy as np
 
 # Models
@@ -15,21 +18,155 @@ import supply_opt
 import update_bounds
 import choice_preprocess
 import nested_logit
+import postprocessing
+import timing
 
 # Data
 import data_HSR as data_file
 
 
+# Width of the cells of the grid used to hash the price vectors, in units of tolerance_cyclic_equilibrium
+GRID_WIDTH = 4.0
+# Initial number of iterations in the history arrays (doubled each time they are full)
+HISTORY_SIZE = 64
+
+
+def gridCell(data, prices):
+    '''Cell of the grid containing the price vector (key of the hash of the visited price vectors)'''
+
+    width = GRID_WIDTH * data['tolerance_cyclic_equilibrium']
+    return tuple(np.floor(prices / width).astype(int).tolist())
+
+
+def neighbourCells(data, prices):
+    '''
+    Cells of the grid that can contain a price vector within tolerance_cyclic_equilibrium of prices
+    (maximum deviation): two cells for the coordinates close to a border of their cell, one otherwise
+    '''
+
+    width = GRID_WIDTH * data['tolerance_cyclic_equilibrium']
+    margin = data['tolerance_cyclic_equilibrium'] * (1 + 1e-6)
+    low = np.floor((prices - margin) / width).astype(int).tolist()
+    high = np.floor((prices + margin) / width).astype(int).tolist()
+    return product(*[range(l, h + 1) for l, h in zip(low, high)])
+
+
+def growHistory(output, names):
+    '''Double the number of iterations of the history arrays, with the new rows set to -1'''
+
+    for name in names:
+        output[name] = np.concatenate((output[name], np.full(output[name].shape, -1.0)))
+
+
+def bestResponse(data, models=None):
+    '''
+    Best response of the current optimizer, with the prices of the other suppliers fixed at
+    p_urban_fixed and p_rural_fixed and its own prices within the initial bounds
+    '''
+
+    # Update price bounds
+    for i in range(data['I_opt_out'], data['I_tot']):
+        if data['operator'][i] != data['optimizer']:
+            data['lb_p_urban'][i] = data['p_urban_fixed'][i]
+            data['ub_p_urban'][i] = data['p_urban_fixed'][i]
+            data['lb_p_rural'][i] = data['p_rural_fixed'][i]
+            data['ub_p_rural'][i] = data['p_rural_fixed'][i]
+        else:
+            data['lb_p_urban'][i] = copy.deepcopy(data['initial_data']['lb_p_urban'][i])
+            data['ub_p_urban'][i] = copy.deepcopy(data['initial_data']['ub_p_urban'][i])
+            data['lb_p_rural'][i] = copy.deepcopy(data['initial_data']['lb_p_rural'][i])
+            data['ub_p_rural'][i] = copy.deepcopy(data['initial_data']['ub_p_rural'][i])
+
+    # Update utility bounds and preprocess choices
+    update_bounds.updateUtilityBounds(data, incremental=True)
+    choice_preprocess.choicePreprocess(data)
+
+    # Print fixed prices of non-optimizing suppliers
+    print('\nAlt  Supplier   Fixed price urban   Fixed price rural')
+    for i in range(data['I_opt_out'], data['I_tot']):
+        if data['operator'][i] != data['optimizer']:
+            print(' {:2d}    {:6d}     {:15.2f}     {:15.2f}'.format(i, data['operator'][i], data['p_urban_fixed'][i], data['p_rural_fixed'][i]))
+
+    ### Run the best response (BR) problem for the current optimizer
+    return supply_opt.nestedFixedPoint(data, models)
+
+
+def bestResponseWorker(snapshot, k, lb_profit):
+    '''
+    Best response of supplier k on a worker's own copy of data, with its profit lb_profit
+    at the current prices (None if unknown), capturing its output and timing
+    '''
+
+    snapshot['optimizer'] = k
+    snapshot['lb_profit'] = lb_profit
+    timing.resetSummary()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        results = bestResponse(snapshot)
+
+    return results, log.getvalue(), timing.workerSummary()
+
+
+def simultaneousBestResponses(data, models, profits):
+    '''
+    Best responses of all the suppliers to the same prices p_urban_fixed and p_rural_fixed (Jacobi mode),
+    with profits the profits at these prices (None if unknown). The K problems are independent: with
+    n_workers_best_response > 1 they are solved in a process pool, each worker on its own copy of data
+    (pickled by the executor, the models are then rebuilt), and the output is printed in the order of the suppliers.
+    Returns the new (urban, rural) prices, in which the prices of each supplier move to its best response,
+    damped by best_response_damping, and the best-response prices themselves (undamped), as arrays (2, I_tot).
+    '''
+
+    p_urban = np.array(data['p_urban_fixed'], dtype=float)
+    p_rural = np.array(data['p_rural_fixed'], dtype=float)
+
+    BR_list = []
+
+    if data['n_workers_best_response'] <= 1:
+        for k in range(1, data['K'] + 1):
+            # The nested logit fixed point of the previous supplier may have moved the fixed prices
+            if not (np.array_equal(data['p_urban_fixed'], p_urban) and np.array_equal(data['p_rural_fixed'], p_rural)):
+                data['p_urban_fixed'] = p_urban.copy()
+                data['p_rural_fixed'] = p_rural.copy()
+                if data['DCM'] == 'NestedLogit':
+                    nested_logit.logsumNestedLogit(data)
+            data['optimizer'] = k
+            data['lb_profit'] = None if profits is None else profits[k]
+            BR_list.append((k, bestResponse(data, models)))
+
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(data['n_workers_best_response'], data['K'])) as pool:
+            futures = {}
+            for k in range(1, data['K'] + 1):
+                futures[k] = pool.submit(bestResponseWorker, data, k, None if profits is None else profits[k])
+
+            for k in range(1, data['K'] + 1):
+                results, log, timings = futures[k].result()
+                print(log, end='')
+                timing.mergeSummary(timings)
+                BR_list.append((k, results))
+
+    prices = np.array([p_urban, p_rural])
+    bestResponses = np.array([p_urban, p_rural])
+    for k, results in BR_list:
+        alts = data['list_alt_supplier'][k]
+        bestResponses[0, alts] = np.asarray(results['prices_urban'])[alts]
+        bestResponses[1, alts] = np.asarray(results['prices_rural'])[alts]
+        prices[:, alts] = data['best_response_damping'] * prices[:, alts] + (1 - data['best_response_damping']) * bestResponses[:, alts]
+
+    return prices, bestResponses
+
+
 def fixedPointIterationAlg(data):
 
     output = {}
 
     # Price, profit, market share and demand at each iteration
-    output['p_urban_history'] = np.full((data['max_iter']+1, data['I_tot']), -1.0)
-    output['p_rural_history'] = np.full((data['max_iter']+1, data['I_tot']), -1.0)
-    output['profit'] = np.full((data['max_iter']+1, data['K'] + 1), -1.0)
-    output['market_share'] = np.full((data['max_iter']+1, data['I_tot']), -1.0)
-    output['demand_history'] = np.full((data['max_iter']+1, data['I_tot']), -1.0)
+    output['p_urban_history'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['I_tot']), -1.0)
+    output['p_rural_history'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['I_tot']), -1.0)
+    output['profit'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['K'] + 1), -1.0)
+    output['market_share'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['I_tot']), -1.0)
+    output['demand_history'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['I_tot']), -1.0)
     # Information about equilibrium: iteration number of cycle start and end, type of equilibrium
     output['cycle_start'] = None
     output['cycle_end'] = None
@@ -38,48 +175,49 @@ def fixedPointIterationAlg(data):
     # Initialize variables of the sequential game
     iter = 0
     cycle = False
+    # Price vectors visited at each iteration, hashed by optimizer and cell of the grid
+    visited = {}
     data['lb_profit'] = None
 
+    # Best-response models of each optimizer, reused across iterations
+    models = {}
+
+    # Iterations between two best responses of the same supplier
+    stride = 1 if data['best_response_mode'] == 'Jacobi' else data['K']
+    # Share of the distance to the best responses covered by an iteration: in Jacobi mode, consecutive prices
+    # differ by (1 - best_response_damping) times this distance, so the cycle test is scaled accordingly
+    step = 1 - data['best_response_damping'] if data['best_response_mode'] == 'Jacobi' else 1.0
+
     # Main loop
     while (iter < data['max_iter']) and cycle is False:
         
         iter += 1
         print('\n\nITERATION %r' %iter)
 
-        #########################
-        # PREPROCESS
-        #########################
-        
-        # Update price bounds
-        for i in range(data['I_opt_out'], data['I_tot']):
-            if data['operator'][i] != data['optimizer']:
-                data['lb_p_urban'][i] = data['p_urban_fixed'][i]
-                data['ub_p_urban'][i] = data['p_urban_fixed'][i]
-                data['lb_p_rural'][i] = data['p_rural_fixed'][i]
-                data['ub_p_rural'][i] = data['p_rural_fixed'][i]
-            else:
-                data['lb_p_urban'][i] = copy.deepcopy(data['initial_data']['lb_p_urban'][i])
-                data['ub_p_urban'][i] = copy.deepcopy(data['initial_data']['ub_p_urban'][i])
-                data['lb_p_rural'][i] = copy.deepcopy(data['initial_data']['lb_p_rural'][i])
-                data['ub_p_rural'][i] = copy.deepcopy(data['initial_data']['ub_p_rural'][i])
-        
-        # Update utility bounds and preprocess choices
-        update_bounds.updateUtilityBounds(data)
-        choice_preprocess.choicePreprocess(data)
-
-        # Print fixed prices of non-optimizing suppliers
-        print('\nAlt  Supplier   Fixed price urban   Fixed price rural')
-        for i in range(data['I_opt_out'], data['I_tot']):
-            if data['operator'][i] != data['optimizer']:
-                print(' {:2d}    {:6d}     {:15.2f}     {:15.2f}'.format(i, data['operator'][i], data['p_urban_fixed'][i], data['p_rural_fixed'][i]))
-
+        # Grow the history arrays if they are full
+        if iter >= len(output['profit']):
+            growHistory(output, ['p_urban_history', 'p_rural_history', 'profit', 'market_share', 'demand_history'])
 
         #########################
-        # BEST RESPONSE PROBLEM
+        # BEST RESPONSE PROBLEMS
         #########################
 
-        ### Run the best response (BR) problem for the current optimizer
-        BR_results = supply_opt.nestedFixedPoint(data)
+        if data['best_response_mode'] == 'Jacobi':
+            ### Best responses of all the suppliers to the same prices, then choices of the customers at the new prices
+            p_previous = np.array([data['p_urban_fixed'], data['p_rural_fixed']], dtype=float)
+            prices, bestResponses = simultaneousBestResponses(data, models, None if iter == 1 else output['profit'][iter-1])
+            # Maximum deviation of the best responses from the prices they respond to
+            gapBestResponse = np.amax(abs(bestResponses - p_previous))
+
+            data['p_urban_fixed'], data['p_rural_fixed'] = prices[0], prices[1]
+            if data['DCM'] == 'NestedLogit':
+                nested_logit.logsumNestedLogit(data)
+            postprocessing.calculation(data)
+            BR_results = {'prices_urban': prices[0], 'prices_rural': prices[1],
+                          'demand': data['output']['demand'], 'profits': data['output']['profit']}
+        else:
+            ### Best response of the current optimizer
+            BR_results = bestResponse(data, models)
         
         #########################
         # POSTPROCESS
@@ -103,8 +241,11 @@ def fixedPointIterationAlg(data):
         # UPDATE INDICATORS
         #########################
 
-        ### Cycle detection: all iterations in which the current optimizer previously optimized
-        iterations_to_check = range(iter - data['K'], 0, -data['K'])
+        ### Cycle detection: iterations in which the current optimizer previously optimized (all iterations
+        ### in Jacobi mode) and visited a price vector in a neighbouring cell of the grid (most recent first)
+        prices = np.concatenate((output['p_urban_history'][iter,:], output['p_rural_history'][iter,:]))
+        iterations_to_check = sorted([j for cell in neighbourCells(data, prices)
+                                      for j in visited.get((iter % stride, cell), [])], reverse=True)
         print('\nIterations to check: %r' % list(iterations_to_check))
         print('\nIter     MaxDevPriceUrban   MaxDevPriceRural')
         for j in iterations_to_check:
@@ -116,7 +257,7 @@ def fixedPointIterationAlg(data):
 
             print(' {:3d}      {:15.2f}    {:15.2f}'.format(j, devUrban, devRural))
 
-            if max(deviations) > data['tolerance_cyclic_equilibrium']:
+            if max(deviations) > data['tolerance_cyclic_equilibrium'] * step:
                 cycle = False
                     
             else:
@@ -129,8 +270,11 @@ def fixedPointIterationAlg(data):
                 output['market_share'] = output['market_share'][:iter+1,:]
                 output['demand_history'] = output['demand_history'][:iter+1,:]
 
-                # Define the type of cycle
-                if iter - output['cycle_start'] == data['K'] and max(deviations) < data['tolerance_equilibrium'] and data['DCM'] != 'NestedLogit':
+                # Define the type of cycle (in Jacobi mode, a Nash equilibrium if the undamped best responses
+                # are within tolerance_equilibrium of the prices they respond to)
+                if data['best_response_mode'] == 'Jacobi':
+                    deviations = [gapBestResponse]
+                if iter - output['cycle_start'] == stride and max(deviations) < data['tolerance_equilibrium'] and data['DCM'] != 'NestedLogit':
                     print('\nNash equilibrium detected\n')
                     output['cycle_type'] = 'NashEquilibrium'
                 else:
@@ -141,6 +285,8 @@ def fixedPointIterationAlg(data):
         ### Update the data for the next iteration
         if cycle is False:
 
+            visited.setdefault((iter % stride, gridCell(data, prices)), []).append(iter)
+
             data['optimizer'] = ((data['optimizer']) % data['K']) + 1
             data['lb_profit'] = output['profit'][iter][data['optimizer']]   #To be checked
             
@@ -152,10 +298,10 @@ def fixedPointIterationAlg(data):
             if data['DCM'] == 'NestedLogit':
                 nested_logit.logsumNestedLogit(data)
             
-            # If no convergence before max iter is reached, then just save last 5*K iterations
+            # If no convergence before max iter is reached, then just save last 5 rounds of best responses
             if iter == data['max_iter']:
                 # Save all useful information
-                output['cycle_start'] = max(iter - 5 * data['K'], data['K'])
+                output['cycle_start'] = max(iter - 5 * stride, stride)
                 output['cycle_end'] = iter
                 output['p_urban_history'] = output['p_urban_history'][:iter+1,:]
                 output['p_rural_history'] = output['p_rural_history'][:iter+1, :]
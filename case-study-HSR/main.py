@@ -14,6 +14,7 @@ rail (HSR) systems. EURO J. Transportation Logist. 1(1-2):3-27.
 '''
 
 # General
+import sys
 import time
 import copy
 import random
@@ -29,6 +30,8 @@ import update_bounds
 import choice_preprocess
 import nested_logit
 import postprocessing
+import checkpoint
+import timing
 
 # Data
 import data_HSR as data_file
@@ -140,12 +143,13 @@ def newInitialSolution(data):
               data['initial_data']['lb_p_rural'][i], data['initial_data']['ub_p_rural'][i], data['p_rural_fixed'][i]))
 
 
-def columnGenerationMethod(data):
+def columnGenerationMethod(data, state=None):
     ''' 
         Use the fixed-point MIP model to find a subgame equilibrium.
         Check the solution on the original game by solving best-response problems.
         If not all eps-equilibrium conditions are satisfied,
         best-response strategies are added to the strategy sets.
+        With the state of a run, the iterations are checkpointed and resumed.
     '''
 
     ### INITIALIZE VARIABLES FOR THE METHOD
@@ -154,6 +158,11 @@ def columnGenerationMethod(data):
     hist_best_response = []
     hist_fixed_point = []
 
+    # Resume the iterations of an interrupted run
+    if state is not None and state['column_generation'] is not None:
+        iter = state['column_generation']['iter']
+        hist_best_response = state['column_generation']['hist_best_response']
+        hist_fixed_point = state['column_generation']['hist_fixed_point']
 
     ### MAIN LOOP
     while game_equilibrium is False:
@@ -168,8 +177,8 @@ def columnGenerationMethod(data):
         choice_preprocess.choicePreprocessStrategies(data)
 
         ### Solve the fixed-point MIP model to find a subgame equilibrium
-        model, nameToIndex = fixed_point_MIP.getModel(data)
-        FP_results = fixed_point_MIP.solveModel(model, nameToIndex, data)
+        model, index = fixed_point_MIP.getModel(data)
+        FP_results = fixed_point_MIP.solveModel(model, index, data)
 
         ### Save results of fixed-point MIP
         data['p_urban_fixed'] = copy.deepcopy(FP_results['prices_urban_in'])
@@ -319,6 +328,11 @@ def columnGenerationMethod(data):
 
             iter += 1
 
+            # Periodic checkpoint of the iterations
+            if state is not None:
+                state['column_generation'] = {'iter': iter, 'hist_best_response': hist_best_response, 'hist_fixed_point': hist_fixed_point}
+                checkpoint.saveCheckpoint(data, state, periodic=True)
+
 
 def main():
         
@@ -331,6 +345,7 @@ def main():
     #Read instance and precompute exogenous terms
     data = data_file.getData()
     data_file.preprocessUtilities(data)
+    timing.configure(data)
 
     if data['DCM'] == 'NestedLogit':
         #Calculate initial values of logsum terms
@@ -338,50 +353,67 @@ def main():
 
     data_file.printCustomers(data)
 
-    #Initialize the list of eps-equilibrium solutions (line 1 of Algorithm 1)
-    data['equilibrium'] = {'prices_urban': [], 'prices_rural': [
-                        ], 'profits': [], 'demand': [], 'eps_price': [], 'eps_profit': []}
-    
-    #Initial bounds to use when restarting exploration from different region (loop lines 2-18 of Algorithm 1)
-    data['initialLb'] = copy.deepcopy(data['initial_data']['lb_p_urban'])
-    data['initialUb'] = copy.deepcopy(data['initial_data']['ub_p_urban'])
+    if '--resume' in sys.argv[1:]:
+        #Continue an interrupted run from its last checkpoint
+        data, state = checkpoint.loadCheckpoint(data['checkpoint_file'])
+        seed = state['seed']
 
-    while True:
-        
-        ### PRE-COMPUTATIONS
-        nested_logit.logsumNestedLogit(data)
+    else:
+        #Initialize the list of eps-equilibrium solutions (line 1 of Algorithm 1)
+        data['equilibrium'] = {'prices_urban': [], 'prices_rural': [
+                            ], 'profits': [], 'demand': [], 'eps_price': [], 'eps_profit': []}
 
-        #Calculate utility bounds
-        update_bounds.updateUtilityBounds(data)
-        #Preprocess captive choices
-        choice_preprocess.choicePreprocess(data)
+        #Initial bounds to use when restarting exploration from different region (loop lines 2-18 of Algorithm 1)
+        data['initialLb'] = copy.deepcopy(data['initial_data']['lb_p_urban'])
+        data['initialUb'] = copy.deepcopy(data['initial_data']['ub_p_urban'])
+
+        state = {'seed': seed, 'phase': 'FixedPointIteration'}
+        checkpoint.saveCheckpoint(data, state)
+
+    while state['phase'] != 'Finished':
 
-        ### FIRST PHASE: Fixed-point iteration algorithm (lines 4-8 of Algorithm 1)
-        print('\n\nFIXED-POINT ITERATION ALGORITHM:')
+        if state['phase'] == 'FixedPointIteration':
 
-        fixed_point_it_results = fixed_point_iteration_algorithm.fixedPointIterationAlg(data)
-        fixed_point_iteration_algorithm.plotGraphs('FixedPoint_Iteration_Algorithm', data, fixed_point_it_results)
+            ### PRE-COMPUTATIONS
+            nested_logit.logsumNestedLogit(data)
 
-        t_1 = time.time()
+            #Calculate utility bounds
+            update_bounds.updateUtilityBounds(data)
+            #Preprocess captive choices
+            choice_preprocess.choicePreprocess(data)
 
-        '''
-        # If a Nash equilibrium is found, save the solution and restart from another initial solution
-        if fixed_point_it_results['cycle_type'] == 'NashEquilibrium':
-            updateListEquilibriumFixedPointIteration(data, fixed_point_it_results)
+            ### FIRST PHASE: Fixed-point iteration algorithm (lines 4-8 of Algorithm 1)
+            print('\n\nFIXED-POINT ITERATION ALGORITHM:')
 
-        # SECOND PHASE: Fixed-point MIP + best response problem (lines 9-17 of Algorithm 1)
-        elif fixed_point_it_results['cycle_type'] == 'CyclicEquilibrium':
+            fixed_point_it_results = fixed_point_iteration_algorithm.fixedPointIterationAlg(data)
+            fixed_point_iteration_algorithm.plotGraphs('FixedPoint_Iteration_Algorithm', data, fixed_point_it_results)
+
+            t_1 = time.time()
+
+            '''
+            # If a Nash equilibrium is found, save the solution and restart from another initial solution
+            if fixed_point_it_results['cycle_type'] == 'NashEquilibrium':
+                updateListEquilibriumFixedPointIteration(data, fixed_point_it_results)
+
+            # SECOND PHASE: Fixed-point MIP + best response problem (lines 9-17 of Algorithm 1)
+            elif fixed_point_it_results['cycle_type'] == 'CyclicEquilibrium':
     
+                restrictedStrategySets(data, fixed_point_it_results)        
+                columnGenerationMethod(data)
+            '''
             restrictedStrategySets(data, fixed_point_it_results)        
-            columnGenerationMethod(data)
-        '''
-        restrictedStrategySets(data, fixed_point_it_results)        
-        columnGenerationMethod(data)
+
+            # Checkpoint at the end of the first phase
+            state['phase'] = 'ColumnGeneration'
+            state['column_generation'] = None
+            checkpoint.saveCheckpoint(data, state)
+
+        columnGenerationMethod(data, state)
 
         # Stopping criterion (line 18 of Algorithm 1)
         if len(data['equilibrium']['prices_urban']) >= data['nEquilibria']:
-            break
-        
+            state = {'seed': seed, 'phase': 'Finished'}
+
         else:
             seed += 1
             np.random.seed(seed)
@@ -392,6 +424,11 @@ def main():
             # Restart the algorithm with random fixed prices and optimizer (line 3 of Algorithm 1)
             newInitialSolution(data)
 
+            state = {'seed': seed, 'phase': 'FixedPointIteration'}
+
+        # Checkpoint at the end of each restart
+        checkpoint.saveCheckpoint(data, state)
+
     ##################################################
     # POST-PROCESS: PRINT ALL FOUND EPSILON-EQUILIBRIA
     ##################################################
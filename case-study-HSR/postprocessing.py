@@ -3,7 +3,6 @@
 # General
 import sys
 import time
-import copy
 import numpy as np
 
 # Functions
@@ -74,61 +73,58 @@ def printOutputAnalysis(data):
     print()
 
 
+def simulateChoices(U, drawShare):
+    '''
+    Choices of the customers for the utilities U[i,n,r], for all the customers and draws at once:
+    choice indicators w[i,n,r], expected maximum utilities EMU[n] (averaged over the draws) and
+    choice probabilities P[i,n], where drawShare[n,r] is the share of draw r in the probabilities of customer n
+    '''
+
+    choice = np.argmax(U, axis=0)
+
+    w = np.zeros(U.shape)
+    np.put_along_axis(w, choice[None], 1.0, axis=0)
+
+    EMU = np.sum(np.take_along_axis(U, choice[None], axis=0)[0], axis=1) / U.shape[2]
+    P = np.einsum('inr,nr->in', w, drawShare)
+
+    return w, EMU, P
+
+
 def calculation(data):
 
-    price_U = copy.deepcopy(data['p_urban_fixed'])
-    price_R = copy.deepcopy(data['p_rural_fixed'])
+    price_U = np.array(data['p_urban_fixed'], dtype=float)
+    price_R = np.array(data['p_rural_fixed'], dtype=float)
+    popN = np.asarray(data['popN'], dtype=float)
+    urban = np.asarray(data['ORIGIN']) == 1
+    rural = np.asarray(data['ORIGIN']) == 0
 
     data['output'] = {}
-    data['output']['U'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['EMU'] = np.zeros([data['N']])
-    data['output']['w'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['P'] = np.zeros([data['I_tot'], data['N']])
-    data['output']['profit'] = np.zeros([data['K']+1])
-    data['output']['demand'] = np.zeros([data['I_tot']])
-    data['output']['demand_urban'] = np.zeros([data['I_tot']])
-    data['output']['demand_rural'] = np.zeros([data['I_tot']])
-    data['output']['market_share'] = np.zeros([data['I_tot']])
-    data['output']['market_share_urban'] = np.zeros([data['I_tot']])
-    data['output']['market_share_rural'] = np.zeros([data['I_tot']])
-
 
     # Calculate utilities and choices
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-                if data['ORIGIN'][n] == 1:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n] * price_U[i] +\
-                                                 data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i,n,r]
-                elif data['ORIGIN'][n] == 0:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n] * price_R[i] +\
-                                                 data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i,n,r]
-            i_UMax = np.argmax(data['output']['U'][:,n,r])
-            data['output']['EMU'][n] += data['output']['U'][i_UMax, n, r]/data['R']
-            data['output']['w'][i_UMax,n,r] = 1
-            data['output']['P'][i_UMax, n] += 1/data['R']
-    
+    price = np.where(urban[None, :], price_U[:, None], price_R[:, None])
+    U = (data['endo_coef'] * price)[:, :, None] + data['exo_utility'] + data['Logsum'] + data['xi']
+    data['output']['U'] = U
+    data['output']['w'], data['output']['EMU'], data['output']['P'] =\
+        simulateChoices(U, np.full([data['N'], data['R']], 1/data['R']))
+
     # Calculate demand
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            data['output']['demand'][i] += data['output']['P'][i,n] * data['popN'][n]
-            if data['ORIGIN'][n] == 1:
-                data['output']['demand_urban'][i] += data['output']['P'][i,n] * data['popN'][n]
-            elif data['ORIGIN'][n] == 0:
-                data['output']['demand_rural'][i] += data['output']['P'][i,n] * data['popN'][n]
-    
+    data['output']['demand'] = data['output']['P'] @ popN
+    data['output']['demand_urban'] = data['output']['P'][:, urban] @ popN[urban]
+    data['output']['demand_rural'] = data['output']['P'][:, rural] @ popN[rural]
+
     # Calculate market shares
-    popU = int(sum([data['popN'][n] for n in range(data['N']) if data['ORIGIN'][n] == 1]))
-    popR = int(sum([data['popN'][n] for n in range(data['N']) if data['ORIGIN'][n] == 0]))
+    popU = int(np.sum(popN[urban]))
+    popR = int(np.sum(popN[rural]))
 
     data['output']['market_share'] = data['output']['demand'] / data['Pop']
     data['output']['market_share_urban'] = data['output']['demand_urban'] / popU
     data['output']['market_share_rural'] = data['output']['demand_rural'] / popR
-    
+
     # Calculate profits
-    for k in range(data['K'] + 1):
-        for i in data['list_alt_supplier'][k]:
-            data['output']['profit'][k] += (data['output']['demand_urban'][i] * price_U[i] + data['output']['demand_rural'][i] * price_R[i])
+    data['output']['profit'] = np.zeros([data['K']+1])
+    np.add.at(data['output']['profit'], data['operator'],
+              data['output']['demand_urban'] * price_U + data['output']['demand_rural'] * price_R)
 
 
 def segments(data):
@@ -152,7 +148,6 @@ def segments(data):
 
     # Initialize population in each segment
     data['SEGMENT'] = np.zeros((data['N'],data['nSegments']))
-    data['popSegments'] = np.zeros((data['nSegments']))
 
     # Assign people to segments
     for n in range(data['N']):
@@ -184,8 +179,7 @@ def segments(data):
         if data['INCOME'][n] == 1 and data['ORIGIN'][n] == 1:
             data['SEGMENT'][n,11] = 1
 
-        for s in range(data['nSegments']):
-            data['popSegments'][s] += data['SEGMENT'][n][s] * data['popN'][n]
+    data['popSegments'] = data['SEGMENT'].T @ np.asarray(data['popN'], dtype=float)
 
     # Create list of people for each segment
     data['list_customer_segment'] = {}
@@ -193,12 +187,7 @@ def segments(data):
         data['list_customer_segment'][s] = [i for i, segment in enumerate(data['SEGMENT'][:,s]) if segment == s]
 
     # Calculate market shares for segments
-    data['SEGMENT_DEMAND'] = np.zeros((data['nSegments'], data['I_tot']))
-    for s in range(data['nSegments']):
-        for n in range(data['N']):
-            if data['SEGMENT'][n,s] == 1:
-                for i in range(data['I_tot']):
-                    data['SEGMENT_DEMAND'][s,i] += data['output']['P'][i,n] * data['popN'][n]
+    data['SEGMENT_DEMAND'] = data['SEGMENT'].T @ (data['output']['P'] * np.asarray(data['popN'], dtype=float)).T
 
     # Print market shares for segments
     print('\nMARKET SHARES PER SEGMENT  ', end=' ')
@@ -5,7 +5,6 @@
 
 # General
 import time
-import copy
 import numpy as np
 
 # CPLEX
@@ -16,20 +15,156 @@ from cplex.exceptions import CplexSolverError
 import update_bounds
 import choice_preprocess
 import nested_logit
+import timing
 
 # Data
 import data_HSR as data_file
 
 
-def getModel(data):
+def getIndices(data, fixedStructure=False):
+    '''
+    Indices of the decision variables, computed from the (i, n, r) layout.
+    Prices and demands come first, so their indices depend only on I_tot.
+    Utilities are only defined for the choices that are not precomputed (index -1 otherwise),
+    unless fixedStructure is True.
+    '''
+
+    I, N, R = data['I_tot'], data['N'], data['R']
+
+    index = {}
+
+    # Alternatives managed by the optimizer (linearized choice-price variables)
+    index['alts_opt'] = np.array([i for i in range(data['I_opt_out'], data['I_tot'])
+                                  if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer'])], dtype=int)
+    # Alternatives with a fixed price (managed by the other suppliers)
+    index['alts_fixed'] = np.array([i for i in range(data['I_opt_out'], data['I_tot'])
+                                    if data['operator'][i] != data['optimizer']], dtype=int)
+
+    # Choices that are not precomputed, and customers that are not captive
+    if fixedStructure:
+        free = np.full((I, N, R), True)
+        notCaptive = np.full((N, R), True)
+    else:
+        free = np.full((I, N, R), False)
+        free[data['w_free']] = True
+        notCaptive = np.max(data['w_pre'], axis=0) < 0.5
+
+    index['p_urban'] = np.arange(I)
+    index['p_rural'] = I + np.arange(I)
+    index['d'] = 2*I + np.arange(I)
+    index['d_urban'] = 3*I + np.arange(I)
+    index['d_rural'] = 4*I + np.arange(I)
+    start = 5*I
+    index['w'] = start + np.arange(I*N*R).reshape(I, N, R)
+    start += I*N*R
+    index['U'] = np.full((I, N, R), -1)
+    index['U'][free] = start + np.arange(np.count_nonzero(free))
+    start += np.count_nonzero(free)
+    index['Umax'] = np.full((N, R), -1)
+    index['Umax'][notCaptive] = start + np.arange(np.count_nonzero(notCaptive))
+    start += np.count_nonzero(notCaptive)
+    index['alpha'] = start + np.arange(len(index['alts_opt'])*N*R).reshape(len(index['alts_opt']), N, R)
+    start += len(index['alts_opt'])*N*R
+    index['nVar'] = start
+
+    return index
+
+
+def variableNames(name, indices):
+    '''Names of a block of variables, e.g. w[i][n][r], skipping the undefined ones (index -1)'''
+    return [name + ''.join('[' + str(j) + ']' for j in position)
+            for position in np.ndindex(*np.shape(indices)) if indices[position] >= 0]
+
+
+def addConstraints(model, blocks):
+    '''
+    Add a list of constraint blocks to the model with a single bulk call.
+    Each block is a tuple (name, cols, vals, sense, rhs): cols and vals have one row per constraint
+    (vals is broadcast to the shape of cols) and rhs one value per constraint.
+    Returns the indices of the rows of each block.
+    '''
+
+    rows, cols, vals, senses, rhs = [], [], [], [], []
+    rowsBlock = {}
+    nRows = 0
+    first = model.linear_constraints.get_num()
+
+    for name, c, v, s, b in blocks:
+        b = np.ravel(b).astype(float)
+        rowsBlock[name] = first + np.arange(nRows, nRows + len(b))
+        if len(b) == 0:
+            continue
+        c = np.asarray(c).reshape(len(b), -1)
+        v = np.broadcast_to(np.asarray(v, dtype=float), c.shape)
+        rows.append(np.repeat(np.arange(nRows, nRows + len(b)), c.shape[1]))
+        cols.append(c.ravel())
+        vals.append(v.ravel())
+        senses.append(s * len(b))
+        rhs.append(b)
+        nRows += len(b)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    vals = np.concatenate(vals)
+    nonzero = vals != 0
+
+    model.linear_constraints.add(senses = ''.join(senses),
+                                 rhs = np.concatenate(rhs).tolist())
+    model.linear_constraints.set_coefficients(list(zip((first + rows[nonzero]).tolist(),
+                                                       cols[nonzero].tolist(),
+                                                       vals[nonzero].tolist())))
+
+    return rowsBlock
+
+
+def getModel(data, names=False):
     '''
     CPLEX model for the choice-based optimization problem
     (1 supplier optimizing, all the rest fixed)
+    Variable names are only added if names is True.
+    '''
+
+    model, index = buildModel(data, names)
+
+    return model
+
+
+def priceBounds(data, index):
+    '''Price bounds and price variables faced by each customer, depending on the origin'''
+
+    I, N, R = data['I_tot'], data['N'], data['R']
+
+    urban = (np.asarray(data['ORIGIN']) == 1)[None, :, None]
+    lb_p = np.where(urban, np.asarray(data['lb_p_urban'], dtype=float)[:, None, None],
+                           np.asarray(data['lb_p_rural'], dtype=float)[:, None, None])
+    ub_p = np.where(urban, np.asarray(data['ub_p_urban'], dtype=float)[:, None, None],
+                           np.asarray(data['ub_p_rural'], dtype=float)[:, None, None])
+    p = np.where(urban, index['p_urban'][:, None, None], index['p_rural'][:, None, None])
+
+    return np.broadcast_to(lb_p, (I, N, R)), np.broadcast_to(ub_p, (I, N, R)), np.broadcast_to(p, (I, N, R))
+
+
+@timing.timed('build')
+def buildModel(data, names=False, fixedStructure=False):
+    '''
+    Build the model of getModel, and return it together with the
+    indices of its variables and of its blocks of constraints.
+    If fixedStructure is True, the precomputed choices are imposed through the
+    bounds of w instead of removing variables and constraints, so that the model
+    can be updated when the preprocessing changes.
     '''
 
     print('\nOPTIMIZER {:2d}'.format(data['optimizer']))
 
     t_in = time.time()
+
+    I, N, R = data['I_tot'], data['N'], data['R']
+    popN = np.asarray(data['popN'], dtype=float)
+    index = getIndices(data, fixedStructure)
+    alts_opt = index['alts_opt']
+
+    # Price bounds and price variables faced by each customer, depending on the origin
+    lb_p, ub_p, p = priceBounds(data, index)
     
     # Initialize the model
     model = cplex.Cplex()
@@ -42,11 +177,8 @@ def getModel(data):
     model.objective.set_sense(model.objective.sense.maximize)
 
     # Add the fixed cost to the objective function
-    initial_cost = 0.0
-    for i in range(data['I_opt_out'], data['I_tot']):
-        if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-            # Alternative i is managed by the optimizer
-            initial_cost += data['fixed_cost'][i]
+    # (alternatives managed by the optimizer)
+    initial_cost = np.sum(np.asarray(data['fixed_cost'], dtype=float)[alts_opt])
     model.objective.set_offset(-initial_cost)
 
 
@@ -54,133 +186,74 @@ def getModel(data):
     ##### ----- DECISION VARIABLES ----- #####
     ##########################################
 
-    # BATCH OF CHOICE VARIABLES
-    typeVar = []
-    nameVar = []
+    obj = np.zeros(index['nVar'])
+    lb = np.zeros(index['nVar'])
+    ub = np.zeros(index['nVar'])
+    types = np.full(index['nVar'], model.variables.type.continuous)
 
-    # Customer choice variables
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                typeVar.append(model.variables.type.binary)
-                nameVar.append('w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
+    free = index['U'] >= 0
+    notCaptive = index['Umax'] >= 0
 
-    model.variables.add(types = [typeVar[i] for i in range(len(typeVar))],
-                        names = [nameVar[i] for i in range(len(nameVar))])
+    # Price variables (urban and rural customers)
+    lb[index['p_urban']] = data['lb_p_urban']
+    ub[index['p_urban']] = data['ub_p_urban']
+    lb[index['p_rural']] = data['lb_p_rural']
+    ub[index['p_rural']] = data['ub_p_rural']
 
+    # Auxiliary variables to calculate the demand (total, urban and rural)
+    # Add customer cost in the objective function
+    obj[index['d'][alts_opt]] = -np.asarray(data['customer_cost'], dtype=float)[alts_opt]
+    ub[index['d']] = data['Pop']
+    ub[index['d_urban']] = data['Pop']
+    ub[index['d_rural']] = data['Pop']
 
-    # BATCH OF UTILITY AND PRICE VARIABLES
-    typeVar = []
-    nameVar = []
-    lbVar = []
-    ubVar = []
+    # Customer choice variables
+    ub[index['w']] = 1.0
+    types[index['w']] = model.variables.type.binary
+    if fixedStructure:
+        # Precomputed choices are fixed through the bounds
+        lb[index['w'][data['w_pre'] == 1]] = 1.0
+        ub[index['w'][data['w_pre'] == 0]] = 0.0
 
     # Utility variables
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-                    typeVar.append(model.variables.type.continuous)
-                    nameVar.append('U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
-                    lbVar.append(data['lb_U'][i,n,r])
-                    ubVar.append(data['ub_U'][i,n,r])
+    lb[index['U'][free]] = data['lb_U'][free]
+    ub[index['U'][free]] = data['ub_U'][free]
 
     # Maximum utility for each customer and draw
-    for n in range(data['N']):
-        for r in range(data['R']):
-            if np.max(data['w_pre'][:,n,r]) < 0.5:
-                typeVar.append(model.variables.type.continuous)
-                nameVar.append('Umax[' + str(n) + ']' + '[' + str(r) + ']')
-                lbVar.append(-cplex.infinity)
-                ubVar.append(cplex.infinity)
-
-    # Price variables (urban customers)
-    for i in range(data['I_tot']):
-        typeVar.append(model.variables.type.continuous)
-        nameVar.append('p_urban[' + str(i) + ']')
-        lbVar.append(data['lb_p_urban'][i])
-        ubVar.append(data['ub_p_urban'][i])
-
-    # Price variables (rural customers)
-    for i in range(data['I_tot']):
-        typeVar.append(model.variables.type.continuous)
-        nameVar.append('p_rural[' + str(i) + ']')
-        lbVar.append(data['lb_p_rural'][i])
-        ubVar.append(data['ub_p_rural'][i])
-
-
-    model.variables.add(types = [typeVar[i] for i in range(len(typeVar))],
-                        lb = [lbVar[i] for i in range(len(typeVar))],
-                        ub = [ubVar[i] for i in range(len(typeVar))],
-                        names = [nameVar[i] for i in range(len(nameVar))])
-
-    # BATCH OF CHOICE-PRICE AND DEMAND VARIABLES
-    objVar = []
-    typeVar = []
-    nameVar = []
-    lbVar = []
-    ubVar = []
+    lb[index['Umax'][notCaptive]] = -cplex.infinity
+    ub[index['Umax'][notCaptive]] = cplex.infinity
 
     # Linearized choice-price variables
-    for i in range(data['I_opt_out'], data['I_tot']):
-        if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-            for n in range(data['N']):
-                for r in range(data['R']):
-                    objVar.append(data['popN'][n]/data['R'])
-                    typeVar.append(model.variables.type.continuous)
-                    nameVar.append('alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
-                    lbVar.append(0.0)
-                    if data['ORIGIN'][n] == 1:
-                        ubVar.append(data['ub_p_urban'][i])
-                    elif data['ORIGIN'][n] == 0:
-                        ubVar.append(data['ub_p_rural'][i])
-
-    # Auxiliary variables to calculate the demand
-    for i in range(data['I_tot']):
-        # Add customer cost in the objective function
-        if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-            objVar.append(-data['customer_cost'][i])
-        else:
-            objVar.append(0.0)
-        typeVar.append(model.variables.type.continuous)
-        nameVar.append('d[' + str(i) + ']')
-        lbVar.append(0.0)
-        ubVar.append(data['Pop'])
-        # Urban demand
-        objVar.append(0.0)
-        typeVar.append(model.variables.type.continuous)
-        nameVar.append('d_urban[' + str(i) + ']')
-        lbVar.append(0.0)
-        ubVar.append(data['Pop'])
-        # Rural demand
-        objVar.append(0.0)
-        typeVar.append(model.variables.type.continuous)
-        nameVar.append('d_rural[' + str(i) + ']')
-        lbVar.append(0.0)
-        ubVar.append(data['Pop'])
-
-    model.variables.add(obj = [objVar[i] for i in range(len(objVar))],
-                        types = [typeVar[i] for i in range(len(typeVar))],
-                        lb = [lbVar[i] for i in range(len(typeVar))],
-                        ub = [ubVar[i] for i in range(len(typeVar))],
-                        names = [nameVar[i] for i in range(len(nameVar))])
+    obj[index['alpha']] = (popN/R)[None, :, None]
+    ub[index['alpha']] = ub_p[alts_opt]
+
+    if names:
+        nameVar = ([variableNames('p_urban', index['p_urban']), variableNames('p_rural', index['p_rural']),
+                    variableNames('d', index['d']), variableNames('d_urban', index['d_urban']),
+                    variableNames('d_rural', index['d_rural']), variableNames('w', index['w']),
+                    variableNames('U', index['U']), variableNames('Umax', index['Umax'])])
+        nameVar.append(['alpha[' + str(i) + '][' + str(n) + '][' + str(r) + ']'
+                        for i in alts_opt for n in range(N) for r in range(R)])
+        nameVar = [name for block in nameVar for name in block]
+    else:
+        nameVar = None
+
+    model.variables.add(obj = obj.tolist(),
+                        lb = lb.tolist(),
+                        ub = ub.tolist(),
+                        types = ''.join(types),
+                        names = nameVar)
 
     print('CPLEX model: all decision variables added. N variables: %r. Time: %r'\
           %(model.variables.get_num(), round(time.time()-t_in,2)))
 
-    # Creating a dictionary that maps variable names to indices, to speed up constraints creation
-    # https://www.ibm.com/developerworks/community/forums/html/topic?id=2349f613-26b1-4c29-aa4d-b52c9505bf96
-    nameToIndex = { n : j for j, n in enumerate(model.variables.get_names()) }
-
 
     #########################################
     ##### -------- CONSTRAINTS -------- #####
     #########################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
+    # Each block: (name, indices, coefficients, sense, rhs), one row per constraint
+    constraints = []
 
 
     ###################################################
@@ -196,273 +269,107 @@ def getModel(data):
 
     # The price of the alternatives not managed by the current optimizer are fixed
     if data['p_fixed'] is not None:
-        for i in range(data['I_tot']):
-            if (i >= data['I_opt_out']) and (data['operator'][i] != data['optimizer']):
-                indicesConstr.append([nameToIndex['p_urban[' + str(i) + ']']])
-                coefsConstr.append([1.0])
-                sensesConstr.append('E')
-                rhsConstr.append(data['p_urban_fixed'][i])
-                indicesConstr.append([nameToIndex['p_rural[' + str(i) + ']']])
-                coefsConstr.append([1.0])
-                sensesConstr.append('E')
-                rhsConstr.append(data['p_rural_fixed'][i])
+        fixed = index['alts_fixed']
+        constraints.append(('price_fixed', np.stack([index['p_urban'][fixed], index['p_rural'][fixed]], axis=1).reshape(-1, 1), 1.0, 'E',
+                            np.stack([np.asarray(data['p_urban_fixed'], dtype=float)[fixed],
+                                      np.asarray(data['p_rural_fixed'], dtype=float)[fixed]], axis=1)))
 
     # Price for urban and rural customers is the same for opt-out alternatives and supplier 2
     '''Modify here to activate/deactivate price differentiation'''
-    for i in range(data['I_tot']):
-        if data['operator'][i] != 2:
-            indicesConstr.append([nameToIndex['p_rural[' + str(i) + ']'],
-                                  nameToIndex['p_urban[' + str(i) + ']']])
-            coefsConstr.append([1.0, -1.0])
-            sensesConstr.append('E')
-            rhsConstr.append(0.0)
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    same = np.flatnonzero(np.asarray(data['operator']) != 2)
+    constraints.append(('price_same', np.stack([index['p_rural'][same], index['p_urban'][same]], axis=1), [1.0, -1.0], 'E',
+                        np.zeros(len(same))))
 
     ###################################################
     ### ------------ Choice constraints ----------- ###
     ###################################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
-
     # Each customer chooses one alternative
-    for n in range(data['N']):
-        for r in range(data['R']):
-            ind = []
-            co = []
-            for i in range(data['I_tot']):
-                ind.append(nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                co.append(1.0)
-            indicesConstr.append(ind)
-            coefsConstr.append(co)
-            sensesConstr.append('E')
-            rhsConstr.append(1.0)
+    constraints.append(('choice', index['w'].reshape(I, N*R).T, 1.0, 'E', np.ones(N*R)))
 
     # All captive customers are assigned
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] == 0 or data['w_pre'][i,n,r] == 1:
-                    indicesConstr.append([nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                    coefsConstr.append([1.0])
-                    sensesConstr.append('E')
-                    rhsConstr.append(data['w_pre'][i,n,r])
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    constraints.append(('choice_pre', index['w'][~free], 1.0, 'E', data['w_pre'][~free]))
 
     #######################################
     ##### ----- Price constraints ---- ####
     #######################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
-
     # Linearized price
-    for i in range(data['I_opt_out'], data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-                    if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-
-                        # Alpha is equal to 0 if alternative is not chosen
-        
-                        # Lower bound constraint
-                        indicesConstr.append([nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        if data['ORIGIN'][n] == 1:
-                            coefsConstr.append([data['lb_p_urban'][i], -1.0])
-                        elif data['ORIGIN'][n] == 0:
-                            coefsConstr.append([data['lb_p_rural'][i], -1.0])
-                        sensesConstr.append('L')
-                        rhsConstr.append(0.0)
-        
-                        # Upper bound constraint
-                        indicesConstr.append([nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        if data['ORIGIN'][n] == 1:                       
-                            coefsConstr.append([data['ub_p_urban'][i], -1.0])
-                        elif data['ORIGIN'][n] == 0:                       
-                            coefsConstr.append([data['ub_p_rural'][i], -1.0])
-                        sensesConstr.append('G')
-                        rhsConstr.append(0.0)
-        
-                        # URBAN: Alpha is equal to the price if alternative is chosen
-                        if data['ORIGIN'][n] == 1:
-        
-                            # Alpha is greater than the price for the chosen alternative
-                            indicesConstr.append([nameToIndex['p_urban[' + str(i) + ']'],
-                                                  nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                                  nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                            coefsConstr.append([1.0, data['ub_p_urban'][i], -1.0])
-                            sensesConstr.append('L')
-                            rhsConstr.append(data['ub_p_urban'][i])
-        
-                            # Alpha is smaller than the price
-                            indicesConstr.append([nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                                  nameToIndex['p_urban[' + str(i) + ']']])
-                            coefsConstr.append([1.0, -1.0])
-                            sensesConstr.append('L')
-                            rhsConstr.append(0.0)
-                        
-                        # RURAL: Alpha is equal to the price if alternative is chosen
-                        elif data['ORIGIN'][n] == 0:
-
-                            # Alpha is greater than the price for the chosen alternative
-                            indicesConstr.append([nameToIndex['p_rural[' + str(i) + ']'],
-                                                  nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                                  nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                            coefsConstr.append([1.0, data['ub_p_rural'][i], -1.0])
-                            sensesConstr.append('L')
-                            rhsConstr.append(data['ub_p_rural'][i])
-        
-                            # Alpha is smaller than the price
-                            indicesConstr.append([nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                                  nameToIndex['p_rural[' + str(i) + ']']])
-                            coefsConstr.append([1.0, -1.0])
-                            sensesConstr.append('L')
-                            rhsConstr.append(0.0)
-
-                    else:
-                        if data['ORIGIN'][n] == 1:
-                            indicesConstr.append([nameToIndex['p_urban[' + str(i) + ']'],
-                                                  nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        elif data['ORIGIN'][n] == 0:
-                            indicesConstr.append([nameToIndex['p_rural[' + str(i) + ']'],
-                                                  nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        coefsConstr.append([data['w_pre'][i,n,r], -1.0])
-                        sensesConstr.append('E')
-                        rhsConstr.append(0.0)
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    free_opt = free[alts_opt]
+    w = index['w'][alts_opt][free_opt]
+    alpha = index['alpha'][free_opt]
+    p_alpha = p[alts_opt][free_opt]
+    lb_p_alpha = lb_p[alts_opt][free_opt]
+    ub_p_alpha = ub_p[alts_opt][free_opt]
+    ones = np.ones(len(w))
+
+    # Alpha is equal to 0 if alternative is not chosen
+    constraints.append(('alpha_lb', np.stack([w, alpha], axis=1), np.stack([lb_p_alpha, -ones], axis=1), 'L', np.zeros(len(w))))
+    constraints.append(('alpha_ub', np.stack([w, alpha], axis=1), np.stack([ub_p_alpha, -ones], axis=1), 'G', np.zeros(len(w))))
+
+    # Alpha is greater than the price for the chosen alternative (urban or rural price)
+    constraints.append(('alpha_price', np.stack([p_alpha, w, alpha], axis=1),
+                        np.stack([ones, ub_p_alpha, -ones], axis=1), 'L', ub_p_alpha))
+
+    # Alpha is smaller than the price
+    constraints.append(('alpha_max', np.stack([alpha, p_alpha], axis=1), [1.0, -1.0], 'L', np.zeros(len(w))))
+
+    # Alpha is equal to the price times the precomputed choice
+    constraints.append(('alpha_pre', np.stack([p[alts_opt][~free_opt], index['alpha'][~free_opt]], axis=1),
+                        np.stack([data['w_pre'][alts_opt][~free_opt], -np.ones(np.count_nonzero(~free_opt))], axis=1),
+                        'E', np.zeros(np.count_nonzero(~free_opt))))
 
     #######################################
     #### ----- Utility constraints ---- ###
     #######################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
+    U = index['U'][free]
+    Umax = np.broadcast_to(index['Umax'], (I, N, R))[free]
+    w = index['w'][free]
+    M = np.broadcast_to(data['M_U'], (I, N, R))[free]
+    endo_coef = np.broadcast_to(data['endo_coef'][:, :, None], (I, N, R))[free]
+    ones = np.ones(len(U))
 
-    for i in range(data['I_tot']):
-        
-        #### Utility constraints
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-                    if data['ORIGIN'][n] == 1:
-                        indicesConstr.append([nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['p_urban[' + str(i) + ']']])
-                    elif data['ORIGIN'][n] == 0:
-                        indicesConstr.append([nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['p_rural[' + str(i) + ']']])
-                    coefsConstr.append([1.0, -data['endo_coef'][i, n]])
-                    rhsConstr.append(data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i,n,r])
-                    sensesConstr.append('E')
-        
-        #### Utility maximization: the selected alternative is the one with the highest utility
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-
-                    indicesConstr.append([nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                          nameToIndex['Umax[' + str(n) + ']' + '[' + str(r) + ']']])
-                    coefsConstr.append([1.0, -1.0])
-                    sensesConstr.append('L')
-                    rhsConstr.append(0.0)
-
-                    indicesConstr.append([nameToIndex['Umax[' + str(n) + ']' + '[' + str(r) + ']'],
-                                          nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                          nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                    coefsConstr.append([1.0, -1.0, data['M_U'][n, r]])
-                    sensesConstr.append('L')
-                    rhsConstr.append(data['M_U'][n, r])
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    #### Utility constraints
+    constraints.append(('utility', np.stack([U, p[free]], axis=1), np.stack([ones, -endo_coef], axis=1), 'E',
+                        (data['exo_utility'] + data['Logsum'] + data['xi'])[free]))
+
+    #### Utility maximization: the selected alternative is the one with the highest utility
+    constraints.append(('utility_max', np.stack([U, Umax], axis=1), [1.0, -1.0], 'L', np.zeros(len(U))))
+    constraints.append(('utility_choice', np.stack([Umax, U, w], axis=1), np.stack([ones, -ones, M], axis=1), 'L', M))
 
     #######################################
     #### ---- Auxiliary constraints --- ###
     #######################################
         
     ### Calculating demands (not part of the model)
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
-
-    for i in range(data['I_tot']):
-        # Total demand
-        ind = []
-        co = []
-        for n in range(data['N']):
-            for r in range(data['R']):
-                ind.append(nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                co.append(-data['popN'][n]/data['R'])
-        ind.append(nameToIndex['d[' + str(i) + ']'])
-        co.append(1.0)
-        indicesConstr.append(ind)
-        coefsConstr.append(co)
-        sensesConstr.append('E')
-        rhsConstr.append(0.0)
-        # Urban demand
-        ind = []
-        co = []
-        for n in range(data['N']):
-            if data['ORIGIN'][n] == 1:    
-                for r in range(data['R']):
-                    ind.append(nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                    co.append(-data['popN'][n]/data['R'])
-        ind.append(nameToIndex['d_urban[' + str(i) + ']'])
-        co.append(1.0)
-        indicesConstr.append(ind)
-        coefsConstr.append(co)
-        sensesConstr.append('E')
-        rhsConstr.append(0.0)
-        # Rural demand
-        ind = []
-        co = []
-        for n in range(data['N']):
-            if data['ORIGIN'][n] == 0:    
-                for r in range(data['R']):
-                    ind.append(nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                    co.append(-data['popN'][n]/data['R'])
-        ind.append(nameToIndex['d_rural[' + str(i) + ']'])
-        co.append(1.0)
-        indicesConstr.append(ind)
-        coefsConstr.append(co)
-        sensesConstr.append('E')
-        rhsConstr.append(0.0)
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    for key, customers in [('d', np.full(N, True)),
+                           ('d_urban', np.asarray(data['ORIGIN']) == 1),
+                           ('d_rural', np.asarray(data['ORIGIN']) == 0)]:
+        nCustomers = np.count_nonzero(customers)
+        constraints.append((key, np.concatenate([index['w'][:, customers, :].reshape(I, nCustomers*R), index[key][:, None]], axis=1),
+                            np.append(np.repeat(-popN[customers]/R, R), 1.0)[None, :], 'E', np.zeros(I)))
+
+    index['rows'] = addConstraints(model, constraints)
 
     print('CPLEX model: all constraints added. N constraints: %r. Time: %r\n'\
           %(model.linear_constraints.get_num(), round(time.time()-t_in,2)))
 
-    return model
+    timing.modelSize(model)
+
+    return model, index
 
 
+@timing.timed('extract')
 def solveModel(data, model):
 
     try:
         model.set_results_stream(None)
         #model.set_warning_stream(None)
 
-        model.solve()
+        with timing.phase('solve', __name__):
+            model.solve()
+            timing.solverStatus(model)
 
         ### PRINT OBJ FUNCTION
         if data['lb_profit'] is not None:
@@ -471,22 +378,19 @@ def solveModel(data, model):
 
         ### INITIALIZE DICTIONARY OF RESULTS
         results = {}
-        results['prices_urban'] = copy.deepcopy(data['p_urban_fixed'])
-        results['prices_rural'] = copy.deepcopy(data['p_rural_fixed'])
-        results['demand'] = np.empty(data['I_tot'])
-        results['demand_urban'] = np.empty(data['I_tot'])
-        results['demand_rural'] = np.empty(data['I_tot'])
         results['profits'] = np.full([data['K']+1], 0.0)
 
         ### SAVE RESULTS
-        for i in range(data['I_tot']):
-            results['prices_urban'][i] = model.solution.get_values('p_urban[' + str(i) + ']')
-            results['prices_rural'][i] = model.solution.get_values('p_rural[' + str(i) + ']')
-            results['demand'][i] = model.solution.get_values('d[' + str(i) + ']')
-            results['demand_urban'][i] = model.solution.get_values('d_urban[' + str(i) + ']')
-            results['demand_rural'][i] = model.solution.get_values('d_rural[' + str(i) + ']')
-            results['profits'][data['operator'][i]] +=\
-                (results['demand_urban'][i]*results['prices_urban'][i] + results['demand_rural'][i]*results['prices_rural'][i])
+        # Solution vector, extracted once and read by index
+        solution = np.array(model.solution.get_values())
+        index = getIndices(data)
+        results['prices_urban'] = solution[index['p_urban']]
+        results['prices_rural'] = solution[index['p_rural']]
+        results['demand'] = solution[index['d']]
+        results['demand_urban'] = solution[index['d_urban']]
+        results['demand_rural'] = solution[index['d_rural']]
+        np.add.at(results['profits'], data['operator'],
+                  results['demand_urban']*results['prices_urban'] + results['demand_rural']*results['prices_rural'])
 
         ### PRINT PRICES, DEMANDS, PROFITS
         print('\nAlt Operator    Urban price  Rural price    Demand urban  Demand rural     Market share')
@@ -504,11 +408,115 @@ def solveModel(data, model):
         raise Exception('Exception raised during solve')
 
 
-def nestedFixedPoint(data):
+@timing.timed('build')
+def updateModel(data, model, index):
+    '''
+    Update a model built by buildModel with fixedStructure=True for the same optimizer
+    to the current data: bounds of prices and utilities, precomputed choices,
+    fixed prices, logsum terms and big-M values
+    '''
+
+    t_in = time.time()
+
+    I, N, R = data['I_tot'], data['N'], data['R']
+    alts_opt = index['alts_opt']
+    lb_p, ub_p, p = priceBounds(data, index)
+    w_opt = index['w'][alts_opt].ravel()
+    lb_p_alpha = lb_p[alts_opt].ravel()
+    ub_p_alpha = ub_p[alts_opt].ravel()
+
+    # Bounds of prices, utilities, choices and linearized choice-price variables
+    model.variables.set_lower_bounds(list(zip(
+        np.concatenate([index['p_urban'], index['p_rural'], index['U'].ravel(), index['w'].ravel()]).tolist(),
+        np.concatenate([data['lb_p_urban'], data['lb_p_rural'], data['lb_U'].ravel(),
+                        (data['w_pre'] == 1).ravel()]).tolist())))
+    model.variables.set_upper_bounds(list(zip(
+        np.concatenate([index['p_urban'], index['p_rural'], index['U'].ravel(), index['w'].ravel(),
+                        index['alpha'].ravel()]).tolist(),
+        np.concatenate([data['ub_p_urban'], data['ub_p_rural'], data['ub_U'].ravel(),
+                        (data['w_pre'] != 0).ravel(), ub_p_alpha]).tolist())))
+
+    # Fixed prices
+    if 'price_fixed' in index['rows']:
+        fixed = index['alts_fixed']
+        model.linear_constraints.set_rhs(list(zip(index['rows']['price_fixed'].tolist(),
+                                                  np.stack([np.asarray(data['p_urban_fixed'], dtype=float)[fixed],
+                                                            np.asarray(data['p_rural_fixed'], dtype=float)[fixed]], axis=1).ravel().tolist())))
+
+    # Linearized price, exogenous utilities (logsum terms) and big-M values
+    M = np.broadcast_to(data['M_U'], (I, N, R)).ravel()
+    model.linear_constraints.set_rhs(list(zip(
+        np.concatenate([index['rows']['alpha_price'], index['rows']['utility'], index['rows']['utility_choice']]).tolist(),
+        np.concatenate([ub_p_alpha, (data['exo_utility'] + data['Logsum'] + data['xi']).ravel(), M]).tolist())))
+    model.linear_constraints.set_coefficients(list(zip(
+        np.concatenate([index['rows']['alpha_lb'], index['rows']['alpha_ub'], index['rows']['alpha_price'],
+                        index['rows']['utility_choice']]).tolist(),
+        np.concatenate([w_opt, w_opt, w_opt, index['w'].ravel()]).tolist(),
+        np.concatenate([lb_p_alpha, ub_p_alpha, ub_p_alpha, M]).tolist())))
+
+    print('CPLEX model: bounds and constraints updated. N variables: %r. Time: %r\n'\
+          %(model.variables.get_num(), round(time.time()-t_in,2)))
+
+    timing.modelSize(model)
+
+
+def setStartingSolution(data, model, index):
+    '''
+    MIP start at the current prices p_urban_fixed and p_rural_fixed, i.e. the previous
+    best responses, with the choices, utilities and demands simulated at these prices
+    '''
+
+    I, R = data['I_tot'], data['R']
+    popN = np.asarray(data['popN'], dtype=float)
+    urban = np.asarray(data['ORIGIN']) == 1
+    p_urban = np.asarray(data['p_urban_fixed'], dtype=float)
+    p_rural = np.asarray(data['p_rural_fixed'], dtype=float)
+    p = np.where(urban[None, :, None], p_urban[:, None, None], p_rural[:, None, None])
+
+    U = data['endo_coef'][:, :, None] * p + data['exo_utility'] + data['Logsum'] + data['xi']
+    w = (np.argmax(U, axis=0)[None, :, :] == np.arange(I)[:, None, None]).astype(float)
+
+    values = np.zeros(index['nVar'])
+    values[index['p_urban']] = p_urban
+    values[index['p_rural']] = p_rural
+    values[index['d']] = np.sum(w, axis=2) @ popN / R
+    values[index['d_urban']] = np.sum(w[:, urban, :], axis=2) @ popN[urban] / R
+    values[index['d_rural']] = np.sum(w[:, ~urban, :], axis=2) @ popN[~urban] / R
+    values[index['w']] = w
+    values[index['U']] = np.clip(U, data['lb_U'], data['ub_U'])
+    values[index['Umax']] = np.max(values[index['U']], axis=0)
+    values[index['alpha']] = p[index['alts_opt']] * w[index['alts_opt']]
+
+    model.MIP_starts.delete()
+    model.MIP_starts.add(cplex.SparsePair(ind = list(range(index['nVar'])), val = values.tolist()),
+                         model.MIP_starts.effort_level.repair)
+
+
+def solveBestResponse(data, models):
+    '''
+    Best response of the current optimizer, with one model per optimizer kept in
+    models across calls: each model is built once, then updated and warm-started
+    '''
+
+    if data['optimizer'] in models:
+        print('\nOPTIMIZER {:2d}'.format(data['optimizer']))
+        updateModel(data, *models[data['optimizer']])
+    else:
+        models[data['optimizer']] = buildModel(data, fixedStructure=True)
+
+    model, index = models[data['optimizer']]
+    if data['p_fixed'] is not None:
+        setStartingSolution(data, model, index)
+
+    return solveModel(data, model)
+
+
+def nestedFixedPoint(data, models=None):
     '''
     Parameters to tune:
         - smoothing
         - maxIter
+    If models is given, the best-response models are reused (see solveBestResponse).
     '''
 
     if data['max_iter_nested_logit'] >= 2:
@@ -518,8 +526,11 @@ def nestedFixedPoint(data):
     while count < data['max_iter_nested_logit']:   #Max number of nested logit iterations
         count += 1
 
-        model = getModel(data)
-        results = solveModel(data, model)
+        if models is None:
+            model = getModel(data)
+            results = solveModel(data, model)
+        else:
+            results = solveBestResponse(data, models)
 
         # Difference between old prices (used in logsum term) and new prices
         gapLogsum = abs(results['prices_urban'] - data['p_urban_fixed'])
@@ -550,6 +561,7 @@ if __name__ == '__main__':
     
     #Read instance
     data = data_file.getData()
+    timing.configure(data)
 
     #Precompute exogenous terms
     data_file.preprocessUtilities(data)
@@ -570,7 +582,7 @@ if __name__ == '__main__':
     if data['DCM'] == 'NestedLogit':
         results = nestedFixedPoint(data)
     else:
-        model = getModel(data)
+        model = getModel(data, names=True)
         results = solveModel(data, model)
 
     t_2 = time.time()
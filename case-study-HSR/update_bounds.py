@@ -40,42 +40,74 @@ def updateSubgamePriceBounds(data):
     data['subgame_ub_p_rural'] = copy.deepcopy(ub_p_R)
 
 
-def updateUtilityBounds(data):
-    
-    # Utility bounds
-    lb_U = np.empty([data['I_tot'], data['N'], data['R']])
-    ub_U = np.empty([data['I_tot'], data['N'], data['R']])
-    lb_Umin = np.full((data['N'], data['R']), np.inf)
-    ub_Umax = np.full((data['N'], data['R']), -np.inf)
-
-    M = np.empty([data['N'], data['R']])
-
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-
-                if data['endo_coef'][i, n] <= 0:
-                    if data['ORIGIN'][n] == 1: 
-                        lb_U[i, n, r] = data['endo_coef'][i, n] * data['ub_p_urban'][i] + data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r]
-                        ub_U[i, n, r] = data['endo_coef'][i, n] * data['lb_p_urban'][i] + data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r]
-                    elif data['ORIGIN'][n] == 0: 
-                        lb_U[i, n, r] = data['endo_coef'][i, n] * data['ub_p_rural'][i] + data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r]
-                        ub_U[i, n, r] = data['endo_coef'][i, n] * data['lb_p_rural'][i] + data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r]
-                else:
-                    raise Exception('\nERROR! Positive beta_cost coefficient!')
-
-            # Bounds for each customer, for each draw
-            lb_Umin[n, r] = np.min(lb_U[:, n, r])
-            ub_Umax[n, r] = np.max(ub_U[:, n, r])
-
-            # Calcule the big-M values
-            M[n, r] = ub_Umax[n, r] - lb_Umin[n, r]
+def utilityBoundsAlternatives(data, alts):
+    '''Utility bounds of the alternatives in alts for all customers and draws'''
+
+    endo_coef = data['endo_coef'][alts][:, :, None]
+    if np.any(endo_coef > 0):
+        raise Exception('\nERROR! Positive beta_cost coefficient!')
+
+    # Urban or rural price bounds depending on the origin of the customer
+    urban = (np.asarray(data['ORIGIN']) == 1)[None, :, None]
+    lb_p = np.where(urban, np.asarray(data['lb_p_urban'], dtype=float)[alts, None, None],
+                           np.asarray(data['lb_p_rural'], dtype=float)[alts, None, None])
+    ub_p = np.where(urban, np.asarray(data['ub_p_urban'], dtype=float)[alts, None, None],
+                           np.asarray(data['ub_p_rural'], dtype=float)[alts, None, None])
+
+    exo = data['exo_utility'][alts] + data['Logsum'][alts] + data['xi'][alts]
+    lb_U = endo_coef * ub_p + exo
+    ub_U = endo_coef * lb_p + exo
+
+    return lb_U, ub_U
+
+
+def updateUtilityBounds(data, incremental=False):
+    '''
+    Utility bounds for all alternatives, customers and draws.
+    If incremental is True, only the alternatives whose price bounds
+    changed since the previous call are recomputed. The exogenous terms
+    (exo_utility, endo_coef, Logsum, xi) are compared by identity: they must be
+    replaced by new arrays, not modified in place, when they change
+    (logsumNestedLogit allocates a new Logsum array).
+    '''
+
+    shape = (data['I_tot'], data['N'], data['R'])
+    price_bounds = ['lb_p_urban', 'ub_p_urban', 'lb_p_rural', 'ub_p_rural']
+    exo_terms = (data['exo_utility'], data['endo_coef'], data['Logsum'], data['xi'])
+    cache = data.get('utility_bounds_cache')
+
+    # The previous bounds can be reused only if the exogenous terms
+    # (including the logsum terms of the nested logit) are unchanged
+    if (incremental and cache is not None and
+        all(a is b for a, b in zip(cache['exo_terms'], exo_terms)) and
+        data['lb_U'].shape == shape):
+        changed = np.zeros(data['I_tot'], dtype=bool)
+        for key in price_bounds:
+            changed |= (np.asarray(data[key]) != cache[key])
+        alts = np.flatnonzero(changed)
+        lb_U = data['lb_U'].copy()
+        ub_U = data['ub_U'].copy()
+    else:
+        alts = np.arange(data['I_tot'])
+        lb_U = np.empty(shape)
+        ub_U = np.empty(shape)
+
+    if len(alts) > 0:
+        lb_U[alts], ub_U[alts] = utilityBoundsAlternatives(data, alts)
+
+    data['utility_bounds_cache'] = {key: np.array(data[key], dtype=float) for key in price_bounds}
+    data['utility_bounds_cache']['exo_terms'] = exo_terms
+
+    # Bounds for each customer, for each draw
+    lb_Umin = np.min(lb_U, axis=0)
+    ub_Umax = np.max(ub_U, axis=0)
 
     data['lb_U'] = lb_U
     data['ub_U'] = ub_U
     data['lb_Umin'] = lb_Umin
     data['ub_Umax'] = ub_Umax
-    data['M_U'] = M
+    # Calcule the big-M values
+    data['M_U'] = ub_Umax - lb_Umin
 
     # Profit bounds
     data['M_Rev'] = {}
@@ -85,15 +117,13 @@ def updateUtilityBounds(data):
 
 def updateMaxProfit(data):
 
+    # Captive customers of each alternative
+    captive = np.sum(data['w_pre'] == 1, axis=2) @ np.asarray(data['popN'], dtype=float) / data['R']
+    operator = np.asarray(data['operator'])
+
     for k in range(1, data['K'] + 1):
-        unreachableCustomers = 0
-        for i in range(data['I_tot']):
-            if data['operator'][i] != k:
-                for n in range(data['N']):
-                    for r in range(data['R']):
-                        if data['w_pre'][i,n,r] == 1:
-                            unreachableCustomers += data['popN'][n]/data['R']
-        data['M_Rev'][k] = np.amax(np.multiply(data['ub_p'], (data['Pop']-unreachableCustomers)) - data['fixed_cost'])
+        unreachableCustomers = np.sum(captive[operator != k])
+        data['M_Rev'][k] = np.amax(np.multiply(data['ub_p_urban'], (data['Pop']-unreachableCustomers)) - data['fixed_cost'])
 
 
 if __name__ == '__main__':
@@ -109,4 +139,4 @@ if __name__ == '__main__':
         nested_logit.logsumNestedLogit(data)
             
     #Calculate utility bounds
-    updateUtilityBounds(data)
\ No newline at end of file
+    updateUtilityBounds(data)
\ No newline at end of file
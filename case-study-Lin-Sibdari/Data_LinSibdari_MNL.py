@@ -12,6 +12,9 @@ customer choices. Eur. J. Oper. Res. 197(3):969–980.
 import copy
 import numpy as np
 
+# Project
+import draw_store
+
 def discrete_choice_model(dict):
     
     # Define the type of discrete choice model
@@ -104,6 +107,17 @@ def demand(dict):
     dict['popN'] = np.array([1])
 
 
+def simulateDraws(dict, R):
+    '''Random terms of R draws for all the customers (e.g. a chunk of the out-of-sample draws)'''
+
+    draws = {}
+
+    # Random term (Gumbel distributed 0,1)
+    draws['xi'] = np.random.gumbel(size=(dict['I_tot'], dict['N'], R))
+
+    return draws
+
+
 def setAlgorithmParameters(dict):
 
     ##########################################################
@@ -112,6 +126,44 @@ def setAlgorithmParameters(dict):
 
     dict['nEquilibria'] = 5
 
+    #### Parameters of the multi-start driver
+
+    # Number of worker processes running restarts of Algorithm 1 in parallel (1: sequential restarts)
+    dict['n_workers_multi_start'] = 1
+    # Entropy of the seed streams of the workers (one seed per worker and restart)
+    dict['multi_start_seed'] = 1
+    # Log file of each worker (formatted with the index of the worker)
+    dict['multi_start_log'] = 'multi_start_worker_%d.log'
+
+    #### Checkpoints of the run (continue an interrupted run with: python main.py --resume)
+
+    # Checkpoint file (None: no checkpoints)
+    dict['checkpoint_file'] = None
+    # Minimum time between two checkpoints during the column generation method (sec)
+    dict['checkpoint_interval'] = 60
+
+    #### Phase timing (wall time, CPU time, model size and solver status of each phase, summary printed at exit)
+
+    # JSON-lines file of the timing events (None: summary only)
+    dict['timing_file'] = None
+
+    #### Out-of-sample validation of the prices (new draws, simulated in chunks of draws)
+
+    # Number of out-of-sample draws (0: no out-of-sample validation)
+    dict['R_out_of_sample'] = 0
+    # Number of draws per chunk (only one chunk of draws is held in memory)
+    dict['chunk_draws'] = 10000
+
+    #### Sensitivity analysis of the equilibrium results (sensitivity_analysis_equilibrium.py)
+
+    # Number of replications (the seed of each replication is its index)
+    dict['replications'] = 100
+    # Number of worker processes running the replications in parallel
+    # (n_workers_sensitivity x cplex_threads should not exceed the number of cores)
+    dict['n_workers_sensitivity'] = 1
+    # File of the results of the completed replications, to resume an interrupted analysis (None: not saved)
+    dict['sensitivity_results_file'] = None
+
     #### Parameters of the fixed-point iteration algorithm
 
     # Initial optimizer
@@ -122,12 +174,42 @@ def setAlgorithmParameters(dict):
     dict['tolerance_equilibrium'] = 0.001           #0.1%
     # Tolerance for cycle convergence
     dict['tolerance_cyclic_equilibrium'] = 0.05
+    # Best responses of the suppliers one at a time ('GaussSeidel') or simultaneously to the same prices ('Jacobi')
+    dict['best_response_mode'] = 'GaussSeidel'
+    # Weight of the previous prices in the update of the Jacobi mode (0: no damping)
+    dict['best_response_damping'] = 0.0
     # Counter of how many times the fixed-point iteration algorithm is used
     dict['countFixedPointIter'] = 1     #Initialized to 1
 
     #### Parameters of the choice-based optimization model
 
     dict['lb_profit'] = None
+    # Exact best response for suppliers with a single alternative (instead of the MIP).
+    # Every supplier of this instance manages a single alternative: the best responses do not build
+    # the MIP, unless check_breakpoint is True (False: the best-response MIP is solved)
+    dict['breakpoint_best_response'] = True
+    # Cross-check the exact best response against the MIP
+    dict['check_breakpoint'] = False
+    # Merge the draws with the same captive choice into weighted representatives
+    # (smaller fixed-point MIP model and payoff tensor; no effect on the size of the best-response MIP)
+    dict['draw_deduplication'] = True
+    # Number of CPLEX threads per model (0: automatic)
+    dict['cplex_threads'] = 0
+    # Number of processes solving the best-response problems in parallel
+    # (with cplex_threads = 0, each worker gets cpu_count // workers threads)
+    dict['n_workers_best_response'] = 1
+    # Best-response problems of the column generation method only check whether a supplier
+    # can improve its profit by more than eps_equilibrium_profit (stop at the first such strategy;
+    # solved to optimality if the oracle stops at a limit without a proof)
+    dict['best_response_oracle'] = True
+    # Minimum profit increase of a deviation found by the oracle (absolute, also if the profit at the equilibrium is 0)
+    dict['best_response_oracle_tolerance'] = 1e-4
+    # Memoization of the best responses, keyed by the optimizer, the fixed prices of the competitors,
+    # the price bounds and a fingerprint of the instance (0: no memoization)
+    dict['best_response_cache_size'] = 1000
+    dict['best_response_cache_decimals'] = 6
+    # File where the memoized best responses are persisted across runs (None: not persisted)
+    dict['best_response_cache_file'] = None
 
     #### Parameters for the eps-equilibrium conditions
 
@@ -142,6 +224,21 @@ def setAlgorithmParameters(dict):
     
     dict['min_strategies'] = 3
     dict['max_strategies'] = 6      #Always > initial strategies
+    # Solve the restricted games by enumeration of their payoff tensor, and the fixed-point MIP model
+    # only when the tensor is larger than max_payoff_tensor_size (False: the fixed-point MIP model is always solved)
+    dict['payoff_tensor'] = True
+    # Maximum size of the payoff tensor of the restricted game (strategy profiles x alternatives x draws)
+    # solved by enumeration
+    dict['max_payoff_tensor_size'] = 10**8
+    # Keep the fixed-point MIP model across the iterations of the column generation method,
+    # adding and removing only the blocks of the strategies that enter or leave the strategy sets
+    dict['incremental_fixed_point_MIP'] = True
+    # Number of solutions of the fixed-point MIP model (pool) checked by best responses at each iteration
+    # (1: only the optimal solution, >1: the solution pool is populated)
+    dict['fixed_point_pool_size'] = 3
+    # Maximum objective value (total regret of the suppliers in the restricted game) of the solutions
+    # of the pool: only the subgame equilibria, up to numerical tolerance, are checked by best responses
+    dict['fixed_point_pool_tolerance'] = 1e-3
 
 
 
@@ -157,6 +254,12 @@ def getData():
     # Number of draws
     dict['R'] = 100
 
+    # Directory of the draw store (random tensors generated once and shared as read-only memory maps, None: no store)
+    dict['draw_store'] = None
+    # Seed of the draws of the store (None: drawn from the state of np.random for each instance)
+    dict['draw_store_seed'] = None
+    draw_store.setSeed(dict)
+
     # 1) Read discrete choice model parameters
     # 2) Read supply data
     # 3) Read demand data
@@ -166,7 +269,13 @@ def getData():
     demand(dict)
 
     # Random term (Gumbel distributed 0,1)
-    dict['xi'] = np.random.gumbel(size=(dict['I_tot'], dict['N'], dict['R']))
+    dict['xi'] = draw_store.draws(dict, 'xi', (dict['I_tot'], dict['N'], dict['R']), lambda rng: rng.gumbel(size=(dict['I_tot'], dict['N'], dict['R'])))
+
+    # Weight of each customer and draw in the demand (updated by the choice preprocessing)
+    dict['weights'] = np.repeat(np.asarray(dict['popN'], dtype=float)[:, None] / dict['R'], dict['R'], axis=1)
+    # Fingerprint of the utilities and weights in the keys of the memoized best responses
+    # (computed once, reset by the choice preprocessing when the weights change)
+    dict['instance_fingerprint'] = None
 
     # Define parameters of the algorithm
     setAlgorithmParameters(dict)
@@ -0,0 +1,65 @@
+'''
+Checkpoints of Algorithm 1. The state of a run (data dictionary with the eps-equilibria found,
+the strategy sets, the price bounds and the iteration histories, the current phase of the algorithm
+and the state of the pseudorandom generators) is saved in checkpoint_file, so that an interrupted
+run can be continued from its last checkpoint with: python main.py --resume
+'''
+
+# General
+import os
+import time
+import gzip
+import pickle
+import random
+import numpy as np
+
+# Time of the last checkpoint
+lastCheckpoint = time.time()
+
+
+def saveCheckpoint(data, state, periodic=False):
+    '''
+    Save data, the state of the algorithm and the state of the pseudorandom generators in checkpoint_file
+    (compressed pickle, written to a temporary file, then renamed). Periodic checkpoints are skipped
+    if the last one is more recent than checkpoint_interval. No checkpoint if state is None
+    '''
+
+    global lastCheckpoint
+
+    path = data['checkpoint_file']
+    if path is None or state is None:
+        return
+    if periodic and time.time() - lastCheckpoint < data['checkpoint_interval']:
+        return
+
+    checkpoint = {'data': data, 'state': state, 'np_random': np.random.get_state(), 'random': random.getstate()}
+
+    with open(path + '.tmp', 'wb') as f:
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=1) as g:
+            pickle.dump(checkpoint, g, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+    lastCheckpoint = time.time()
+
+
+def loadCheckpoint(path):
+    '''Data and state of the algorithm saved in the checkpoint, restoring the state of the pseudorandom generators'''
+
+    global lastCheckpoint
+
+    if path is None or not os.path.exists(path):
+        raise Exception('No checkpoint to resume from: {}'.format(path))
+
+    with gzip.open(path, 'rb') as f:
+        checkpoint = pickle.load(f)
+
+    np.random.set_state(checkpoint['np_random'])
+    random.setstate(checkpoint['random'])
+    lastCheckpoint = time.time()
+
+    print('\n\nRESUME FROM CHECKPOINT {:s}: phase {:s}, {:d} eps-equilibria found'
+          .format(path, checkpoint['state']['phase'], len(checkpoint['data']['equilibrium']['profits'])))
+
+    return checkpoint['data'], checkpoint['state']
@@ -5,11 +5,13 @@ import numpy as np
 
 # Project
 import update_bounds
+import timing
 
 # Data
 import Data_LinSibdari_MNL as data_file
 
 
+@timing.timed('preprocess')
 def choicePreprocess(data):
 
     ##########################################################
@@ -18,88 +20,107 @@ def choicePreprocess(data):
     
     # Initialize to -1, since 0 and 1 have other meanings
     data['w_pre'] = np.full((data['I_tot'], data['N'], data['R']), -1.0)
-    countCaptive = 0
-
-    # General choice preprocess
-    for n in range(data['N']):
-        for r in range(data['R']):
-
-            # (1) Find the alternative with the greatest utility lower bound (value and index)
-            LbMax = np.max(data['lb_U'][:, n, r])
-            i_LbMax = np.argmax(data['lb_U'][:, n, r])
-
-            # (2) Find the alternative with the greatest utility upper bound (excluding the alt found before)
-            a = np.ma.masked_values(data['ub_U'][:, n, r], data['ub_U'][i_LbMax, n, r])
-            sub_UbMax = np.max(a)
-
-            # If (1) is greater than (2), then the customer is captive and the choice can be precomputed
-            if LbMax > sub_UbMax:
-
-                countCaptive += 1
-                data['w_pre'][:,n,r] = 0.0
-                data['w_pre'][i_LbMax,n,r] = 1.0
-
-            # Else, exclude only alternatives for which ub < LbMax
-            else:
-                for i in range(data['I_tot']):
-                    if LbMax > data['ub_U'][i, n, r]:
-                        data['w_pre'][i,n,r] = 0.0
-
-    #Captive choices per alternative
-    captive = np.zeros((data['I_tot']))
-    for i in range(data['I_tot']):
-        captive[i] = np.count_nonzero(data['w_pre'][i,:,:] == 1)
-
-    #Count preprocess
-    countEliminated = 0
-    for n in range(data['N']):
-        for r in range(data['R']):
-            countEliminated += len([x for x in data['w_pre'][:,n,r] if x == 0.0])
-
 
+    # (1) Find the alternative with the greatest utility lower bound (value and index)
+    i_LbMax = np.argmax(data['lb_U'], axis=0)
+    LbMax = np.take_along_axis(data['lb_U'], i_LbMax[None, :, :], axis=0)[0]
+
+    # (2) Find the greatest utility upper bound excluding the alt found before,
+    # using the two largest upper bounds of each customer and draw
+    i_UbMax = np.argmax(data['ub_U'], axis=0)
+    if data['I_tot'] > 1:
+        top2 = np.partition(data['ub_U'], data['I_tot'] - 2, axis=0)
+        sub_UbMax = np.where(i_UbMax == i_LbMax, top2[-2], top2[-1])
+    else:
+        sub_UbMax = np.full((data['N'], data['R']), -np.inf)
+
+    # If (1) is greater than (2), then the customer is captive and the choice can be precomputed
+    captive = LbMax > sub_UbMax
+    data['i_captive'] = np.where(captive, i_LbMax, -1)
+
+    # Exclude alternatives for which ub < LbMax, and all the other alternatives of captive customers
+    data['w_pre'][data['ub_U'] < LbMax[None, :, :]] = 0.0
+    data['w_pre'][:, captive] = 0.0
+    n_captive, r_captive = np.nonzero(captive)
+    data['w_pre'][i_LbMax[captive], n_captive, r_captive] = 1.0
+
+    # Indices (i, n, r) of the choices that are not precomputed
+    data['w_free'] = tuple(index.astype(np.int32) for index in np.nonzero(data['w_pre'] < 0))
+
+    # Weights of the draws, merging the draws with the same captive choice
+    drawWeights(data)
+
+
+def drawWeights(data):
+    '''
+    Weight of each customer and draw in the demand (popN[n]/R).
+    The draws of a customer that are captive of the same alternative make the same choice
+    at all prices within the current bounds: if draw_deduplication is True, they are merged
+    into the first of them, which takes their total weight. The other draws get weight 0
+    and are left out of the fixed-point MIP model, the payoff tensor and the simulations.
+    The best-response MIP already treats the captive choices as constants (w_pre), so the merge
+    does not make it smaller. Draws that are not captive have continuous error terms and
+    essentially never share a choice function, so they are not merged.
+    '''
+
+    N, R = data['N'], data['R']
+    weights = np.repeat(np.asarray(data['popN'], dtype=float)[:, None] / R, R, axis=1).ravel()
+
+    if data['draw_deduplication']:
+        # Group of each captive draw: (customer, captive alternative)
+        captive = np.flatnonzero(data['i_captive'].ravel() >= 0)
+        group = np.repeat(np.arange(N), R)[captive] * data['I_tot'] + data['i_captive'].ravel()[captive]
+        _, first, inverse = np.unique(group, return_index=True, return_inverse=True)
+        total = np.bincount(inverse, weights=weights[captive])
+        weights[captive] = 0.0
+        weights[captive[first]] = total
+
+    # The fingerprint of the instance depends on the weights: computed again if they change
+    weights = weights.reshape(N, R)
+    if not np.array_equal(weights, data['weights']):
+        data['instance_fingerprint'] = None
+    data['weights'] = weights
+
+
+@timing.timed('preprocess')
 def choicePreprocessStrategies(data):
-    
-    ##########################################################
-    # Pre-computation of customer choices (captive customers)
-    ##########################################################
-    
-    # Initialize to -1, since 0 and 1 have other meanings
-    data['w_pre_strategies'] = np.full((data['I_tot'], data['N'], data['R'], data['tot_strategies']), -1.0)
+    '''
+    Pre-computation of customer choices for each strategy (w_pre_strategies, indexed [i, n, r, l]),
+    stored as int8 (-1: free, 0: excluded, 1: captive).
+    The choices precomputed in w_pre hold for all the strategies, so w_pre_strategies is a read-only
+    view of w_pre repeated along the strategies. Only if choices are also precomputed within the
+    strategies (nested logit) the array is materialized, with the exclusions of each strategy.
+    '''
 
     # General choice preprocess
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i, n, r] == 0 or data['w_pre'][i, n, r] == 1:
-                    for l in range(data['tot_strategies']):
-                        data['w_pre_strategies'][i,n,r,l] = data['w_pre'][i, n, r]
-
-    # Choice preprocess within strategies
+    w_pre = data['w_pre'].astype(np.int8)
+    data['w_pre_strategies'] = np.broadcast_to(w_pre[:, :, :, None], w_pre.shape + (data['tot_strategies'],))
+
+    # Choice preprocess within strategies: for customers that are not captive, only the alternative
+    # of the optimizer with the maximum utility (at the prices of the strategy) can be chosen
     if data['DCM'] == 'NestedLogit':
-            
+
+        data['w_pre_strategies'] = data['w_pre_strategies'].copy()
+        notCaptive = np.max(w_pre, axis=0) < 1
+        draws = np.arange(data['N']), np.arange(data['R'])
+
         for k in range(1, data['K'] + 1):
-            for l in data['list_strategies_opt'][k]:
-                for n in range(data['N']):
-                    for r in range(data['R']):
-                        if np.max(data['w_pre_strategies'][:, n, r, l]) < 0.5:
-                            maxU = -1000
-                            i_maxU = -1
-                            for i in data['list_alt_supplier'][k]:
-                                U = data['endo_coef'][i, n] * data['strategies']['prices'][i][l] +\
-                                    data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r]
-                                if U > maxU:
-                                    maxU = U
-                                    i_maxU = i
-                            for i in data['list_alt_supplier'][k]:
-                                if i != i_maxU:
-                                    data['w_pre_strategies'][i,n,r,l] = 0
-
-    #Count preprocess
-    countEliminated = 0
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for l in range(data['tot_strategies']):
-                countEliminated += len([x for x in data['w_pre_strategies'][:,n,r,l] if x == 0.0])
+            alts = np.asarray(data['list_alt_supplier'][k], dtype=int)
+            strategies = np.asarray(data['list_strategies_opt'][k], dtype=int)
+            if len(alts) == 0 or len(strategies) == 0:
+                continue
+
+            prices = np.asarray(data['strategies']['prices'], dtype=float)[np.ix_(alts, strategies)][:, None, None, :]
+            U = data['endo_coef'][alts][:, :, None, None] * prices +\
+                (data['exo_utility'][alts] + data['Logsum'][alts] + data['xi'][alts])[:, :, :, None]
+            i_maxU = np.argmax(U, axis=0)
+            exclude = (np.arange(len(alts))[:, None, None, None] != i_maxU[None]) | (np.max(U, axis=0) <= -1000)[None]
+            exclude &= notCaptive[None, :, :, None]
+
+            block = np.ix_(alts, *draws, strategies)
+            w_pre_block = data['w_pre_strategies'][block]
+            w_pre_block[exclude] = 0
+            data['w_pre_strategies'][block] = w_pre_block
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+'''
+Store of the random draws of the instances (common random numbers). Each random tensor of an instance
+is generated once and saved as a .npy file in the directory draw_store, keyed by the instance, its discrete
+choice model, its seed (see setSeed) and the shape of the tensor. It is then opened as a read-only memory map, so that the runs and processes using
+the same draws share them without copies (and cannot modify them).
+'''
+
+# General
+import os
+import zlib
+import numpy as np
+
+
+def setSeed(data, seed=None):
+    '''
+    Seed of the draws of the instance in the store (draw_seed), set by getData for each new instance:
+    draw_store_seed if it is given, otherwise seed (e.g. the seed of the instance), or a seed drawn from
+    the state of np.random if seed is None. draw_store_seed is left unchanged, so that another instance
+    built from the same parameters (e.g. with another data['Seed']) does not reuse these draws.
+    '''
+
+    if data['draw_store'] is None:
+        data['draw_seed'] = None
+    elif data['draw_store_seed'] is not None:
+        data['draw_seed'] = data['draw_store_seed']
+    elif seed is not None:
+        data['draw_seed'] = int(seed)
+    else:
+        data['draw_seed'] = int(np.random.randint(2**31 - 1))
+
+
+def draws(data, name, shape, generate):
+    '''
+    Random tensor name of the instance, of the given shape, generated by generate(rng) with rng a numpy RandomState.
+    Without a draw store (draw_store is None), rng is np.random. Otherwise the tensor is read from the store,
+    where the first process that needs it saves it, with rng seeded by the seed of the instance (draw_seed) and name.
+    '''
+
+    shape = tuple(int(size) for size in shape)
+
+    if data['draw_store'] is None:
+        return generate(np.random)
+
+    seed = data['draw_seed']
+    path = os.path.join(data['draw_store'], '{}_{}_seed{}_{}_{}.npy'.format(
+        data['Instance'], data['DCM'], seed, name, 'x'.join(str(size) for size in shape)))
+
+    if not os.path.exists(path):
+        rng = np.random.RandomState(np.random.MT19937(np.random.SeedSequence([seed, zlib.crc32(name.encode())])))
+        tensor = generate(rng)
+
+        # Written to a temporary file of the process, then renamed (concurrent writers save the same draws)
+        os.makedirs(data['draw_store'], exist_ok=True)
+        with open('{}.{}.tmp'.format(path, os.getpid()), 'wb') as f:
+            np.save(f, tensor)
+        os.replace('{}.{}.tmp'.format(path, os.getpid()), path)
+
+    tensor = np.load(path, mmap_mode='r')
+    if tensor.shape != shape:
+        raise Exception('Draws {} in the store of shape {}, expected {}'.format(path, tensor.shape, shape))
+
+    return tensor
+
+
+if __name__ == '__main__':
+
+    # Check of the store: two seeds give different draws, the same seed gives the same draws
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        data = {'Instance': 'Check', 'DCM': 'MNL', 'N': 3, 'R': 10, 'draw_store': directory, 'draw_store_seed': None}
+        xi = []
+        for seed in [0, 1, 0]:
+            setSeed(data, seed)
+            xi.append(np.array(draws(data, 'xi', (2, data['N'], data['R']), lambda rng: rng.gumbel(size=(2, data['N'], data['R'])))))
+
+        if np.array_equal(xi[0], xi[1]):
+            raise Exception('Same draws in the store for seeds 0 and 1')
+        if not np.array_equal(xi[0], xi[2]):
+            raise Exception('Different draws in the store for the same seed')
+
+    print('Draw store: OK')
@@ -16,14 +16,17 @@ import cplex
 from cplex.exceptions import CplexSolverError
 
 # Project
+import supply_opt
 import generate_strategies
 import update_bounds
 import choice_preprocess
+import timing
 
 # Data
 import Data_LinSibdari_MNL as data_file
 
 
+@timing.timed('build')
 def getModel(data):
     '''
     CPLEX model for the fixed-point MIP model
@@ -43,6 +46,9 @@ def getModel(data):
     
     data['scenarios'] = {}
     data['scenarios'] = copy.deepcopy(data['strategies'])
+
+    # Draws with a positive weight (the other ones are merged into weighted representatives)
+    draws = [np.flatnonzero(data['weights'][n] > 0).tolist() for n in range(data['N'])]
     
     
     ##########################################
@@ -147,7 +153,7 @@ def getModel(data):
     # INITIAL
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i,n,r] != 0:
 
                     typeVar.append(model.variables.type.continuous)
@@ -179,14 +185,14 @@ def getModel(data):
     # INITIAL
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i,n,r] != 0:
                     typeVar.append(model.variables.type.binary)
                     nameVar.append('w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
     # FINAL
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 for l in range(data['tot_strategies']):
                     if data['w_pre_strategies'][i,n,r,l] != 0:
                         typeVar.append(model.variables.type.binary)
@@ -206,7 +212,7 @@ def getModel(data):
     # Customer utility
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
                     typeVar.append(model.variables.type.continuous)
                     nameVar.append('U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
@@ -215,7 +221,7 @@ def getModel(data):
 
     # Maximum utility
     for n in range(data['N']):
-        for r in range(data['R']):
+        for r in draws[n]:
             if np.max(data['w_pre'][:,n,r]) < 0.5:
                 typeVar.append(model.variables.type.continuous)
                 nameVar.append('UMax[' + str(n) + ']' + '[' + str(r) + ']')
@@ -227,7 +233,7 @@ def getModel(data):
     # Customer utility
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 for l in range(data['tot_strategies']):
                     if data['w_pre_strategies'][i,n,r,l] != 0 and data['w_pre'][i,n,r] != 1:
                         typeVar.append(model.variables.type.continuous)
@@ -237,7 +243,7 @@ def getModel(data):
 
     # Maximum utility
     for n in range(data['N']):
-        for r in range(data['R']):
+        for r in draws[n]:
             for l in range(data['tot_strategies']):
                 if np.max(data['w_pre'][:,n,r]) < 0.5:
                     typeVar.append(model.variables.type.continuous)
@@ -350,7 +356,7 @@ def getModel(data):
     # INITIAL
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
                     # Linearized price-choice: variable equal to 0 if alternative is not chosen
                     indicesConstr.append([nameToIndex['alpha_In[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
@@ -382,7 +388,7 @@ def getModel(data):
     #FINAL
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 for l in range(data['tot_strategies']):
                     if data['w_pre_strategies'][i,n,r,l] != 0 and data['w_pre'][i,n,r] != 1:
                         # Linearized price-choice: variable equal to 0 if alternative is not chosen
@@ -420,10 +426,10 @@ def getModel(data):
         # Sum over all alternatives controlled by supplier k
         for i in data['list_alt_supplier'][k]:
             for n in range(data['N']):
-                for r in range(data['R']):
+                for r in draws[n]:
                     if data['w_pre'][i,n,r] != 0:
                         ind.append(nameToIndex['alpha_In[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                        co.append(-data['popN'][n] / data['R'])
+                        co.append(-data['weights'][n,r])
         indicesConstr.append(ind)
         coefsConstr.append(co)
         sensesConstr.append('E')
@@ -436,10 +442,10 @@ def getModel(data):
             # Sum over all alternatives controlled by supplier k
             for i in data['list_alt_supplier'][k]:
                 for n in range(data['N']):
-                    for r in range(data['R']):
+                    for r in draws[n]:
                         if data['w_pre_strategies'][i,n,r,l] != 0:
                             ind.append(nameToIndex['alpha_Fin[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']' + '[' + str(l) + ']'])
-                            co.append(-data['popN'][n] / data['R'])
+                            co.append(-data['weights'][n,r])
             indicesConstr.append(ind)
             coefsConstr.append(co)
             sensesConstr.append('E')
@@ -533,7 +539,7 @@ def getModel(data):
     ### All customers choose one alternative
 
     for n in range(data['N']):
-        for r in range(data['R']):
+        for r in draws[n]:
 
             # INITIAL
             ind = []
@@ -564,7 +570,7 @@ def getModel(data):
 
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i, n, r] == 1:
 
                     # INITIAL
@@ -597,7 +603,7 @@ def getModel(data):
     # INITIAL
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
                     ind = [nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']]
                     co = [1.0]
@@ -622,7 +628,7 @@ def getModel(data):
         for i in range(data['I_tot']):
             if data['operator'][i] == data['scenarios']['optimizer'][l]:
                 for n in range(data['N']):
-                    for r in range(data['R']):
+                    for r in draws[n]:
                         if data['w_pre_strategies'][i,n,r,l] != 0 and data['w_pre'][i,n,r] != 1:
                             indicesConstr.append([nameToIndex['U_Fin[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']' + '[' + str(l) + ']'],
                                                   nameToIndex['price_Fin[' + str(i) + ']' + '[' + str(l) + ']']])
@@ -635,7 +641,7 @@ def getModel(data):
                                 rhsConstr.append(data['exo_utility'][i,n] + data['xi'][i, n, r])
             else:
                 for n in range(data['N']):
-                    for r in range(data['R']):
+                    for r in draws[n]:
                         if data['w_pre_strategies'][i,n,r,l] != 0 and data['w_pre'][i,n,r] != 1:
                             indicesConstr.append([nameToIndex['U_Fin[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']' + '[' + str(l) + ']'],
                                                   nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
@@ -647,7 +653,7 @@ def getModel(data):
 
     for i in range(data['I_tot']):
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
 
                     # INITIAL
@@ -702,10 +708,10 @@ def getModel(data):
         ind = [nameToIndex['demand_In[' + str(i) + ']']]
         co = [1.0]
         for n in range(data['N']):
-            for r in range(data['R']):
+            for r in draws[n]:
                 if data['w_pre'][i, n, r] != 0:
                     ind.append(nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                    co.append(-data['popN'][n]/data['R'])
+                    co.append(-data['weights'][n,r])
         indicesConstr.append(ind)
         coefsConstr.append(co)
         sensesConstr.append('E')
@@ -717,10 +723,10 @@ def getModel(data):
             ind = [nameToIndex['demand_Fin[' + str(i) + ']' + '[' + str(l) + ']']]
             co = [1.0]
             for n in range(data['N']):
-                for r in range(data['R']):
+                for r in draws[n]:
                     if data['w_pre_strategies'][i,n,r,l] != 0:
                         ind.append(nameToIndex['w_Fin[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']' + '[' + str(l) + ']'])
-                        co.append(-data['popN'][n]/data['R'])
+                        co.append(-data['weights'][n,r])
             indicesConstr.append(ind)
             coefsConstr.append(co)
             sensesConstr.append('E')
@@ -732,25 +738,457 @@ def getModel(data):
     print('CPLEX model: all constraints added. N constraints: %r. Time: %r\n'\
           %(model.linear_constraints.get_num(), round(time.time()-t_in,2)))
 
-    return model, nameToIndex
+    timing.modelSize(model)
+
+    return model, solutionIndices(data, model.variables.get_num())
 
 
 #######################################################
-######### SOLVE MODEL, SAVE RESULTS AND PRINT #########
+######## INCREMENTAL MODEL (COLUMN GENERATION) ########
 #######################################################
 
-def solveModel(model, nameToIndex, data):
+def layoutIndices(blocks, start=0):
+    '''Consecutive indices for a list of (name, shape) blocks of variables, starting at start'''
+
+    index = {}
+    for name, shape in blocks:
+        index[name] = start + np.arange(int(np.prod(shape))).reshape(shape)
+        start += int(np.prod(shape))
+    index['nVar'] = start
+
+    return index
+
+
+def sharedIndices(data):
+    '''
+    Indices of the variables of the initial iteration (shared by all the strategies).
+    They come first in the incremental model, so that their indices never change.
+    '''
+
+    I, N, R, K = data['I_tot'], data['N'], data['R'], data['K']
+
+    return layoutIndices([('revenueMax', (K,)), ('revenue', (K,)), ('p', (I,)), ('d', (I,)),
+                          ('w', (I, N, R)), ('U', (I, N, R)), ('Umax', (N, R)),
+                          ('alpha', (I - data['I_opt_out'], N, R))])
+
+
+def blockIndices(data, k):
+    '''
+    Indices of the variables of the final iteration of a strategy of supplier k,
+    relative to the first variable of the block of the strategy.
+    Utility variables are only needed for the alternatives of supplier k
+    (the other utilities are the ones of the initial iteration).
+    '''
+
+    I, N, R, K = data['I_tot'], data['N'], data['R'], data['K']
+
+    return layoutIndices([('x_In', ()), ('x_Fin', ()), ('revenue', (K,)), ('p', (I,)), ('d', (I,)),
+                          ('w', (I, N, R)), ('U', (len(data['list_alt_supplier'][k]), N, R)), ('Umax', (N, R)),
+                          ('alpha', (I - data['I_opt_out'], N, R))])
+
+
+def shiftIndices(index, offset):
+    '''Absolute indices of a block of variables or constraints starting at offset'''
+    return {name: offset + ind for name, ind in index.items() if name != 'nVar'}
+
+
+def choiceConstraints(data, index, U):
+    '''
+    Blocks of constraints linking prices, choices and utilities (initial or final iteration),
+    in the format of supply_opt.addConstraints. U contains the indices of the utilities of all the alternatives.
+    Big-M values are placeholders, set in updateIncrementalModel.
+    '''
+
+    I, N, R = data['I_tot'], data['N'], data['R']
+    endo = np.arange(data['I_opt_out'], I)
+    nEndo = len(endo)
+
+    w = index['w'].reshape(I, N*R)
+    w_endo = index['w'][endo].reshape(-1, 1)
+    alpha = index['alpha'].reshape(-1, 1)
+    p_alpha = np.repeat(index['p'][endo], N*R)[:, None]
+    Umax = np.tile(index['Umax'].ravel(), I)[:, None]
+
+    blocks = [('choice', w.T, 1.0, 'E', np.ones(N*R)),
+              ('utility_max', np.column_stack([U.ravel(), Umax]), [1.0, -1.0], 'L', np.zeros(I*N*R)),
+              ('utility_choice', np.column_stack([Umax, U.ravel(), index['w'].ravel()]), [1.0, -1.0, 1.0], 'L', np.zeros(I*N*R)),
+              ('alpha_choice', np.column_stack([alpha, w_endo]), [1.0, -1.0], 'L', np.zeros(nEndo*N*R)),
+              ('alpha_price', np.column_stack([alpha, p_alpha]), [1.0, -1.0], 'L', np.zeros(nEndo*N*R)),
+              ('alpha_lb', np.column_stack([alpha, p_alpha, w_endo]), [-1.0, 1.0, 1.0], 'L', np.zeros(nEndo*N*R))]
+
+    return blocks
+
+
+def weightedConstraints(data, index):
+    '''
+    Blocks of constraints of the demands and revenues (initial or final iteration), weighted sums over
+    the draws with a positive weight: the draws merged by the choice preprocessing are left out, as in getModel
+    '''
+
+    I = data['I_tot']
+    n, r = np.nonzero(data['weights'] > 0)
+    weights = data['weights'][n, r]
+
+    blocks = [('demand', np.column_stack([index['d'], index['w'][:, n, r]]),
+               np.column_stack([np.ones(I), np.tile(-weights, (I, 1))]), 'E', np.zeros(I))]
+
+    # Revenues of each supplier
+    for k in range(1, data['K'] + 1):
+        alpha_k = index['alpha'][np.asarray(data['list_alt_supplier'][k]) - data['I_opt_out']][:, n, r].ravel()
+        blocks.append((('revenue', k), np.append(index['revenue'][k-1], alpha_k)[None, :],
+                       np.append(1.0, -np.tile(weights, len(data['list_alt_supplier'][k]))), 'E', [0.0]))
+
+    return blocks
+
+
+def utilityConstraints(data, index, alts, p):
+    '''Utility of the alternatives alts as a function of their prices p (indices of the price variables)'''
+
+    N, R = data['N'], data['R']
+    endo_coef, exo = supply_opt.utilityTerms(data)
+
+    return [('utility', np.column_stack([index['U'].ravel(), np.repeat(p, N*R)]),
+             np.column_stack([np.ones(len(alts)*N*R), -endo_coef[alts].ravel()]), 'E', exo[alts].ravel())]
+
+
+def addSharedBlock(data, fixedPoint):
+    '''Variables and constraints of the initial iteration'''
+
+    model = fixedPoint['model']
+    index = fixedPoint['index']
+    I, K = data['I_tot'], data['K']
+    endo = np.arange(data['I_opt_out'], I)
+
+    lb = np.zeros(index['nVar'])
+    ub = np.full(index['nVar'], cplex.infinity)
+    obj = np.zeros(index['nVar'])
+    types = np.full(index['nVar'], model.variables.type.continuous)
+    for name in ['revenueMax', 'revenue', 'U', 'Umax']:
+        lb[index[name]] = -cplex.infinity
+    ub[index['d']] = data['Pop']
+    ub[index['w']] = 1.0
+    types[index['w'].ravel()] = model.variables.type.binary
+    obj[index['revenueMax']] = 1.0
+    obj[index['revenue']] = -1.0
+
+    model.variables.add(obj = obj.tolist(), lb = lb.tolist(), ub = ub.tolist(), types = ''.join(types))
+
+    # Each supplier picks exactly one strategy (coefficients added with the blocks of the strategies)
+    fixedPoint['rows'] = {'x_In': np.arange(K), 'x_Fin': K + np.arange(K)}
+    model.linear_constraints.add(senses = 'E' * (2*K), rhs = [1.0] * (2*K))
+
+    # Prices of the endogenous alternatives are derived from x_In (coefficients added with the blocks)
+    blocks = [('price', index['p'][endo][:, None], 1.0, 'E', np.zeros(len(endo)))]
+    blocks += utilityConstraints(data, index, np.arange(I), index['p'])
+    blocks += choiceConstraints(data, index, index['U'])
+
+    fixedPoint['rows'].update(supply_opt.addConstraints(model, blocks))
+
+
+def addStrategyBlock(data, fixedPoint, l):
+    '''Variables and constraints of the final iteration for the strategy in position l'''
+
+    model = fixedPoint['model']
+    shared = fixedPoint['index']
+    I = data['I_tot']
+    k = data['strategies']['optimizer'][l]
+    alts = data['list_alt_supplier'][k]
+    others = np.array([i for i in range(data['I_opt_out'], I) if data['operator'][i] != k], dtype=int)
+
+    start = model.variables.get_num()
+    rowStart = model.linear_constraints.get_num()
+    if k not in fixedPoint['layouts']:
+        fixedPoint['layouts'][k] = {'index': blockIndices(data, k)}
+    layout = fixedPoint['layouts'][k]
+    index = shiftIndices(layout['index'], start)
+
+    lb = np.zeros(layout['index']['nVar'])
+    ub = np.full(layout['index']['nVar'], cplex.infinity)
+    types = np.full(layout['index']['nVar'], model.variables.type.continuous)
+    for name in ['revenue', 'U', 'Umax']:
+        lb[layout['index'][name]] = -cplex.infinity
+    ub[layout['index']['d']] = data['Pop']
+    for name in ['x_In', 'x_Fin', 'w']:
+        ub[layout['index'][name]] = 1.0
+        types[layout['index'][name].ravel()] = model.variables.type.binary
+    # The prices of the supplier are the ones of the strategy
+    prices = [data['strategies']['prices'][i][l] for i in alts]
+    lb[layout['index']['p'][alts]] = prices
+    ub[layout['index']['p'][alts]] = prices
+
+    model.variables.add(lb = lb.tolist(), ub = ub.tolist(), types = ''.join(types))
+
+    # Utilities: the other alternatives have the utilities of the initial iteration
+    U = shared['U'].copy()
+    U[alts] = index['U']
+
+    blocks = [('revenueMax_lb', [[index['revenue'][k-1], shared['revenueMax'][k-1]]], [1.0, -1.0], 'L', [0.0]),
+              ('revenueMax_ub', [[shared['revenueMax'][k-1], index['revenue'][k-1], index['x_Fin']]], [1.0, -1.0, 1.0], 'L', [0.0]),
+              ('price', np.column_stack([index['p'][others], shared['p'][others]]), [1.0, -1.0], 'E', np.zeros(len(others)))]
+    blocks += utilityConstraints(data, index, alts, index['p'][alts])
+    blocks += choiceConstraints(data, index, U)
+
+    rows = supply_opt.addConstraints(model, blocks)
+    layout['rows'] = {name: ind - rowStart for name, ind in rows.items()}
+    layout['nRows'] = model.linear_constraints.get_num() - rowStart
+
+    # Coefficients of the strategy in the constraints of the initial iteration
+    endoRows = fixedPoint['rows']['price'][np.asarray(alts) - data['I_opt_out']]
+    model.linear_constraints.set_coefficients(
+        [(int(row), int(index['x_In']), -price) for row, price in zip(endoRows, prices)] +
+        [(int(fixedPoint['rows']['x_In'][k-1]), int(index['x_In']), 1.0),
+         (int(fixedPoint['rows']['x_Fin'][k-1]), int(index['x_Fin']), 1.0)])
+
+    fixedPoint['blocks'].append({'id': data['strategies']['id'][l], 'k': k})
+
+
+def blockOffsets(fixedPoint):
+    '''First variable and first constraint of the block of each strategy in the model'''
+
+    offsets = []
+    start = fixedPoint['index']['nVar']
+    rowStart = fixedPoint['nRows']
+    for block in fixedPoint['blocks']:
+        layout = fixedPoint['layouts'][block['k']]
+        offsets.append((start, rowStart))
+        start += layout['index']['nVar']
+        rowStart += layout['nRows']
+
+    return offsets
+
+
+def addWeightedConstraints(data, fixedPoint):
+    '''
+    Demand and revenue constraints of the initial iteration and of all the strategies, with the current
+    weights of the draws. The draws left out change with the choice preprocessing, so these constraints
+    are the last rows of the model, deleted and rebuilt at each update
+    '''
+
+    fixedPoint['weightedRows'] = fixedPoint['model'].linear_constraints.get_num()
+
+    blocks = weightedConstraints(data, fixedPoint['index'])
+    for block, (start, rowStart) in zip(fixedPoint['blocks'], blockOffsets(fixedPoint)):
+        blocks += weightedConstraints(data, shiftIndices(fixedPoint['layouts'][block['k']]['index'], start))
+
+    supply_opt.addConstraints(fixedPoint['model'], blocks)
+
+
+def updateIncrementalModel(data, fixedPoint):
+    '''
+    Update the incremental model to the current data: bounds of prices and utilities,
+    precomputed choices (as bounds of the choice variables) and big-M values
+    '''
+
+    model = fixedPoint['model']
+    I, N, R = data['I_tot'], data['N'], data['R']
+    endo = np.arange(data['I_opt_out'], I)
+
+    lb_p = np.asarray(data['lb_p'], dtype=float).copy()
+    ub_p = np.asarray(data['ub_p'], dtype=float).copy()
+    lb_p[:data['I_opt_out']] = np.asarray(data['p_fixed'], dtype=float)[:data['I_opt_out']]
+    ub_p[:data['I_opt_out']] = lb_p[:data['I_opt_out']]
+    lb_w = np.maximum(data['w_pre'], 0.0)
+    ub_w = lb_w.copy()
+    ub_w[data['w_free']] = 1.0
+    M = np.broadcast_to(data['M_U'], (I, N, R))
+    ub_p_alpha = np.broadcast_to(ub_p[endo, None, None], (len(endo), N, R))
+    M_Rev = np.array([data['M_Rev'][k] for k in range(1, data['K'] + 1)])
+
+    lbVar, ubVar, coefs, rhs = [], [], [], []
+
+    def addValues(target, ind, values):
+        target.append((np.ravel(ind), np.ravel(np.broadcast_to(values, np.shape(ind)))))
+
+    parts = [(fixedPoint['index'], fixedPoint['rows'], np.arange(I), np.arange(I), None)]
+    for block, (start, rowStart) in zip(fixedPoint['blocks'], blockOffsets(fixedPoint)):
+        layout = fixedPoint['layouts'][block['k']]
+        alts = np.asarray(data['list_alt_supplier'][block['k']], dtype=int)
+        parts.append((shiftIndices(layout['index'], start), shiftIndices(layout['rows'], rowStart),
+                      np.setdiff1d(np.arange(I), alts), alts, block['k']))
+
+    for index, rows, alts_p, alts_U, k in parts:
+        # Bounds
+        addValues(lbVar, index['p'][alts_p], lb_p[alts_p])
+        addValues(ubVar, index['p'][alts_p], ub_p[alts_p])
+        addValues(lbVar, index['w'], lb_w)
+        addValues(ubVar, index['w'], ub_w)
+        addValues(lbVar, index['U'], data['lb_U'][alts_U])
+        addValues(ubVar, index['U'], data['ub_U'][alts_U])
+        addValues(ubVar, index['alpha'], ub_p_alpha)
+        addValues(ubVar, index['revenue'], M_Rev)
+        if k is None:
+            addValues(ubVar, index['revenueMax'], M_Rev)
+        else:
+            coefs.append((rows['revenueMax_ub'], index['x_Fin'].ravel(), np.array([M_Rev[k-1]])))
+            addValues(rhs, rows['revenueMax_ub'], M_Rev[k-1])
+
+        # Linearized price and big-M values
+        w_endo = index['w'][endo].ravel()
+        coefs.append((rows['alpha_choice'], w_endo, -ub_p_alpha.ravel()))
+        coefs.append((rows['alpha_lb'], w_endo, ub_p_alpha.ravel()))
+        addValues(rhs, rows['alpha_lb'], ub_p_alpha.ravel())
+        coefs.append((rows['utility_choice'], index['w'].ravel(), M.ravel()))
+        addValues(rhs, rows['utility_choice'], M.ravel())
+
+    lbVar, ubVar, rhs = [[np.concatenate(a).tolist() for a in zip(*target)] for target in (lbVar, ubVar, rhs)]
+    coefs = [np.concatenate(a).tolist() for a in zip(*coefs)]
+
+    model.variables.set_lower_bounds(list(zip(*lbVar)))
+    model.variables.set_upper_bounds(list(zip(*ubVar)))
+    model.linear_constraints.set_rhs(list(zip(*rhs)))
+    model.linear_constraints.set_coefficients(list(zip(*coefs)))
+
+
+def incrementalSolutionIndices(data, fixedPoint):
+    '''
+    Indices of the variables read by solveModel in the incremental model, as in solutionIndices:
+    the variables of the final iteration of strategy l are read from its block, through the offsets of the blocks
+    '''
+
+    shared = fixedPoint['index']
+    I, K, L = data['I_tot'], data['K'], data['tot_strategies']
+
+    index = {'demand_In': shared['d'], 'revenue_In': shared['revenue'], 'revenueMax_Fin': shared['revenueMax'],
+             'x_In': np.zeros(L, dtype=int), 'x_Fin': np.zeros(L, dtype=int), 'price_Fin': np.zeros((I, L), dtype=int),
+             'demand_Fin': np.zeros((I, L), dtype=int), 'revenue_Fin': np.zeros((K, L), dtype=int)}
+
+    for block, (start, rowStart) in zip(fixedPoint['blocks'], blockOffsets(fixedPoint)):
+        layout = fixedPoint['layouts'][block['k']]['index']
+        l = data['strategies']['id'].index(block['id'])
+        index['x_In'][l] = start + layout['x_In']
+        index['x_Fin'][l] = start + layout['x_Fin']
+        index['price_Fin'][:, l] = start + layout['p']
+        index['demand_Fin'][:, l] = start + layout['d']
+        index['revenue_Fin'][:, l] = start + layout['revenue']
+
+    return index
+
+
+@timing.timed('build')
+def getIncrementalModel(data, fixedPoint=None):
+    '''
+    Fixed-point MIP model kept alive across the iterations of the column generation method.
+    All the choice, utility and linearized variables are kept (the precomputed choices are
+    fixed through bounds), so that only the blocks of the strategies that entered or left
+    the strategy sets are added or deleted, and the rest of the model is updated in place.
+    Returns the model (fixedPoint, to be passed to the next call) and the indices of the variables
+    read by solveModel (incrementalSolutionIndices).
+    '''
+
+    print('\n\nFIXED-POINT MIP MODEL:\n')
 
     t_in = time.time()
 
-    model.set_results_stream(None)
-    model.set_warning_stream(None)
-    
-    model.solve()
+    data['scenarios'] = copy.deepcopy(data['strategies'])
 
-    print('Constraints: {:8.0f}\nVariables  : {:8.0f}'.format(model.linear_constraints.get_num(), model.variables.get_num()))
+    if fixedPoint is None:
+        model = cplex.Cplex()
+        # Set time limit
+        model.parameters.timelimit.set(600.0)
+        # Emphasize feasibility over proof of optimality
+        model.parameters.emphasis.mip.set(1)
+        model.objective.set_sense(model.objective.sense.minimize)
+
+        fixedPoint = {'model': model, 'index': sharedIndices(data), 'layouts': {}, 'blocks': [], 'weightedRows': None}
+        addSharedBlock(data, fixedPoint)
+        fixedPoint['nRows'] = model.linear_constraints.get_num()
+
+    model = fixedPoint['model']
+
+    # Delete the demand and revenue constraints (rebuilt with the current weights of the draws)
+    if fixedPoint['weightedRows'] is not None:
+        model.linear_constraints.delete(fixedPoint['weightedRows'], model.linear_constraints.get_num() - 1)
+
+    # Delete the blocks of the strategies removed from the strategy sets (last block first)
+    nRemoved = 0
+    offsets = blockOffsets(fixedPoint)
+    for position in reversed(range(len(fixedPoint['blocks']))):
+        block = fixedPoint['blocks'][position]
+        if block['id'] not in data['strategies']['id']:
+            layout = fixedPoint['layouts'][block['k']]
+            start, rowStart = offsets[position]
+            model.linear_constraints.delete(rowStart, rowStart + layout['nRows'] - 1)
+            model.variables.delete(start, start + layout['index']['nVar'] - 1)
+            fixedPoint['blocks'].pop(position)
+            nRemoved += 1
+
+    # Add the blocks of the new strategies
+    inModel = set(block['id'] for block in fixedPoint['blocks'])
+    nAdded = 0
+    for l in range(data['tot_strategies']):
+        if data['strategies']['id'][l] not in inModel:
+            addStrategyBlock(data, fixedPoint, l)
+            nAdded += 1
+
+    updateIncrementalModel(data, fixedPoint)
+    addWeightedConstraints(data, fixedPoint)
+
+    print('CPLEX model: {:d} strategies added, {:d} removed. N variables: {:d}. N constraints: {:d}. Time: {:.2f}\n'
+          .format(nAdded, nRemoved, model.variables.get_num(), model.linear_constraints.get_num(), time.time()-t_in))
+
+    timing.modelSize(model)
+
+    return fixedPoint, incrementalSolutionIndices(data, fixedPoint)
+
+
+#######################################################
+######### SOLVE MODEL, SAVE RESULTS AND PRINT #########
+#######################################################
+
+def setStartingSolution(data, model, index):
+    '''
+    Partial MIP start with the strategies of the previous subgame equilibrium p_fixed:
+    x_In of each supplier is set to its strategy with the same prices, if it is still in its
+    strategy set. The other variables (x_Fin in particular, which changes when best responses
+    are added to the strategy sets) are completed by CPLEX.
+    '''
+
+    prices = np.asarray(data['strategies']['prices'], dtype=float)
+
+    ind = []
+    val = []
+    for k in range(1, data['K'] + 1):
+        alts = data['list_alt_supplier'][k]
+        strategies = data['list_strategies_opt'][k]
+        diff = np.max(np.abs(prices[alts][:, strategies] - np.asarray(data['p_fixed'], dtype=float)[alts, None]), axis=0)
+        if np.min(diff) < data['tolerance_equilibrium']:
+            for j, l in enumerate(strategies):
+                ind.append(int(index['x_In'][l]))
+                val.append(1.0 if j == np.argmin(diff) else 0.0)
 
-    ### SAVE THE RESULTS OBTAINED FROM THE MODEL IN A DICTIONARY OF RESULTS
+    model.MIP_starts.delete()
+    if len(ind) > 0:
+        model.MIP_starts.add(cplex.SparsePair(ind = ind, val = val), model.MIP_starts.effort_level.solve_MIP)
+
+
+def solutionIndices(data, nVar):
+    '''
+    Indices of the variables read by solveModel in the model of getModel, from the order in which they are added:
+    supply choices (strategies in the order of list_strategies_opt), revenues and prices first,
+    the demands of the initial and final iterations of each alternative last
+    '''
+
+    I, K, L = data['I_tot'], data['K'], data['tot_strategies']
+
+    index = layoutIndices([('x_In', (L,)), ('x_Fin', (L,)), ('revenueMax_Fin', (K,)), ('revenue_In', (K,)),
+                           ('revenue_Fin', (K, L)), ('price_In', (I,)), ('price_Fin', (I, L))])
+    demand = layoutIndices([('demand', (I, 1 + L))], nVar - I*(1 + L))['demand']
+    index['demand_In'] = demand[:, 0]
+    index['demand_Fin'] = demand[:, 1:]
+
+    # Supply choices of each strategy l
+    order = np.concatenate([data['list_strategies_opt'][k] for k in range(1, K + 1)]).astype(int)
+    for name in ['x_In', 'x_Fin']:
+        index[name] = index[name][np.argsort(order)]
+
+    return index
+
+
+@timing.timed('extract')
+def readSolution(data, index, solution, obj):
+    '''Dictionary of results of a solution vector of the model (variables at index), with objective value obj'''
+
+    ### SAVE THE RESULTS IN A DICTIONARY OF RESULTS
     results = {}
     results['prices_in'] = copy.deepcopy(data['p_fixed'])
     results['prices_fin'] = copy.deepcopy(data['p_fixed'])
@@ -768,13 +1206,13 @@ def solveModel(model, nameToIndex, data):
     results['modeshare'] = np.full([4], 0.0)
 
     # Obj value
-    results['obj'] = model.solution.get_objective_value()
+    results['obj'] = obj
 
     # Supply choices
     for k in range(1, data['K'] + 1):
+        results['supply_choice_in'][k][data['list_strategies_opt'][k]] = solution[index['x_In'][data['list_strategies_opt'][k]]]
+        results['supply_choice_fin'][k][data['list_strategies_opt'][k]] = solution[index['x_Fin'][data['list_strategies_opt'][k]]]
         for l in data['list_strategies_opt'][k]:
-            results['supply_choice_in'][k][l] = model.solution.get_values(nameToIndex['x_In[' + str(k) + ']' + '[' + str(l) + ']'])
-            results['supply_choice_fin'][k][l] = model.solution.get_values(nameToIndex['x_Fin[' + str(k) + ']' + '[' + str(l) + ']'])
             # Prices
             if results['supply_choice_in'][k][l] > 0.5:
                 for i in data['list_alt_supplier'][k]:
@@ -784,18 +1222,14 @@ def solveModel(model, nameToIndex, data):
                     results['prices_fin'][i] = data['scenarios']['prices'][i][l]
     
     # Prices and profits for all scenarios
-    for i in range(data['I_tot']):
-        for l in range(data['tot_strategies']):
-            results['prices_scenarios'][i][l] = model.solution.get_values(nameToIndex['price_Fin[' + str(i) + ']' + '[' + str(l) + ']'])
-    for k in range(1, data['K'] + 1):
-        for l in range(data['tot_strategies']):
-            results['profits_scenarios'][k][l] = model.solution.get_values(nameToIndex['revenue_Fin[' + str(k) + ']' + '[' + str(l) + ']'])
+    results['prices_scenarios'][:] = solution[index['price_Fin']]
+    results['profits_scenarios'][1:] = solution[index['revenue_Fin']]
             
     # Demand
+    results['demand'][:] = solution[index['demand_In']]
+    results['demand_scenarios'][:] = solution[index['demand_Fin']]
     for i in range(data['I_tot']):
-        results['demand'][i] = model.solution.get_values(nameToIndex['demand_In[' + str(i) + ']'])
         for l in range(data['tot_strategies']):
-            results['demand_scenarios'][i][l] = model.solution.get_values(nameToIndex['demand_Fin[' + str(i) + ']' + '[' + str(l) + ']'])
             if data['operator'][i] == data['scenarios']['optimizer'][l]:
                 results['demand_fin'][i] += results['demand_scenarios'][i][l] * results['supply_choice_fin'][data['operator'][i]][l]
     
@@ -806,19 +1240,89 @@ def solveModel(model, nameToIndex, data):
             results['max_profit_fin'][k] += results['demand_fin'][i] * results['prices_fin'][i]
 
     # Profits (through model)
-    for k in range(1, data['K'] + 1):
-        results['profit_in'][k] = model.solution.get_values(nameToIndex['revenue_In[' + str(k) + ']'])
-        results['profit_fin'][k] = model.solution.get_values(nameToIndex['revenueMax_Fin[' + str(k) + ']'])
+    results['profit_in'][1:] = solution[index['revenue_In']]
+    results['profit_fin'][1:] = solution[index['revenueMax_Fin']]
     
     # Check
     for k in range(1, data['K'] + 1):
         if abs(results['max_profit_in'][k]-results['profit_in'][k]) > 0.01 or abs(results['max_profit_fin'][k]-results['profit_fin'][k]) > 0.01:
             print('\nINCONSISTENCY! Supp {:2d}\n {:10.4f}  {:10.4f}        {:10.4f}  {:10.4f}\n'
-                .format(k, results['max_profit_in'][k], results['profit_in'][k], results['max_profit_fin'][k],results['profit_fin'][k]))    
+                .format(k, results['max_profit_in'][k], results['profit_in'][k], results['max_profit_fin'][k],results['profit_fin'][k]))
+
+    return results
+
+
+@timing.timed('solve')
+def solveModel(model, index, data):
+    '''Solve the fixed-point MIP model. Returns the results of the optimal solution, None if there is no solution'''
+
+    t_in = time.time()
+
+    model.set_results_stream(None)
+    model.set_warning_stream(None)
+    
+    if data['fixed_point_pool_size'] > 1:
+        # Collect other subgame equilibria in the solution pool (replacing the ones with the worst objective):
+        # solutions with a total regret above the one of the optimal solution plus the tolerance are discarded
+        model.parameters.mip.pool.capacity.set(data['fixed_point_pool_size'])
+        model.parameters.mip.pool.absgap.set(data['fixed_point_pool_tolerance'])
+        model.parameters.mip.pool.replace.set(model.parameters.mip.pool.replace.values.worst_objective)
+        model.parameters.mip.limits.populate.set(data['fixed_point_pool_size'])
+        model.populate_solution_pool()
+    else:
+        model.solve()
+    timing.solverStatus(model)
+
+    print('Constraints: {:8.0f}\nVariables  : {:8.0f}'.format(model.linear_constraints.get_num(), model.variables.get_num()))
+
+    # No solution (e.g. infeasible model or time limit reached without incumbent)
+    if not model.solution.is_primal_feasible():
+        print('\nNo solution of the fixed-point MIP model: {:s}'.format(model.solution.get_status_string()))
+        return None
+
+    results = readSolution(data, index, np.array(model.solution.get_values()), model.solution.get_objective_value())
 
     ### PRINT THE RESULTS OBTAINED FROM THE MODEL
     print('\nRuntime    : {:8.3f} sec'.format(time.time() - t_in))
 
+    printResults(data, results)
+
+    return results
+
+
+@timing.timed('extract')
+def poolResults(model, index, data):
+    '''
+    Results of the other subgame equilibria in the solution pool, sorted by objective value: solutions
+    with prices that differ from the ones of the optimal solution, and with an objective value (total regret
+    of the suppliers in the restricted game) within fixed_point_pool_tolerance
+    '''
+
+    pool = []
+    if data['fixed_point_pool_size'] <= 1:
+        return pool
+
+    prices = [readSolution(data, index, np.array(model.solution.get_values()), 0.0)['prices_in']]
+    solutions = sorted(range(model.solution.pool.get_num()), key=model.solution.pool.get_objective_value)
+    for j in solutions:
+        if model.solution.pool.get_objective_value(j) > data['fixed_point_pool_tolerance']:
+            break
+        results = readSolution(data, index, np.array(model.solution.pool.get_values(j)),
+                               model.solution.pool.get_objective_value(j))
+        if all(np.max(np.abs(results['prices_in'] - p)) >= data['tolerance_equilibrium'] for p in prices):
+            prices.append(results['prices_in'])
+            pool.append(results)
+
+    print('\nSolution pool: {:d} solutions, {:d} other subgame equilibria'.format(model.solution.pool.get_num(), len(pool)))
+    for results in pool:
+        print('Obj value: {:10.4f}    Prices: '.format(results['obj']) + ' '.join('{:8.4f}'.format(p) for p in results['prices_in']))
+
+    return pool
+
+
+def printResults(data, results):
+    '''Print the subgame equilibrium (initial strategies) and the best responses (final strategies)'''
+
     # Obj value
     print('\nObj value: {:10.4f}'.format(results['obj']))
 
@@ -829,8 +1333,6 @@ def solveModel(model, nameToIndex, data):
             .format(data['operator'][i], i, results['prices_in'][i], results['prices_fin'][i],
             results['demand'][i], results['demand_fin'][i], results['max_profit_in'][data['operator'][i]], results['max_profit_fin'][data['operator'][i]]))
 
-    return results
-
 
 if __name__ == '__main__':
 
@@ -850,11 +1352,11 @@ if __name__ == '__main__':
     t_1 = time.time()
 
     # Build the model
-    model, nameToIndex = getModel(data)
+    model, index = getModel(data)
     t_2 = time.time()
 
     # Solve the model
-    results = solveModel(model, nameToIndex, data)
+    results = solveModel(model, index, data)
     t_3 = time.time()
 
     print('\n ---- TIMING ---- ')
@@ -2,30 +2,155 @@
 # (simultaneous game solved in a sequential manner)
 
 # General
+import io
 import time
 import copy
+import contextlib
+import concurrent.futures
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
-from itertools import cycle
+from itertools import cycle, product
 import numpy as np
 
 # Models
 import supply_opt
+import timing
 import update_bounds
 
 # Data
 import Data_LinSibdari_MNL as data_file
 
 
+# Width of the cells of the grid used to hash the price vectors, in units of tolerance_cyclic_equilibrium
+GRID_WIDTH = 4.0
+# Initial number of iterations in the history arrays (doubled each time they are full)
+HISTORY_SIZE = 64
+
+
+def gridCell(data, prices):
+    '''Cell of the grid containing the price vector (key of the hash of the visited price vectors)'''
+
+    width = GRID_WIDTH * data['tolerance_cyclic_equilibrium']
+    return tuple(np.floor(prices / width).astype(int).tolist())
+
+
+def neighbourCells(data, prices):
+    '''
+    Cells of the grid that can contain a price vector within tolerance_cyclic_equilibrium of prices
+    (maximum deviation): two cells for the coordinates close to a border of their cell, one otherwise
+    '''
+
+    width = GRID_WIDTH * data['tolerance_cyclic_equilibrium']
+    margin = data['tolerance_cyclic_equilibrium'] * (1 + 1e-6)
+    low = np.floor((prices - margin) / width).astype(int).tolist()
+    high = np.floor((prices + margin) / width).astype(int).tolist()
+    return product(*[range(l, h + 1) for l, h in zip(low, high)])
+
+
+def growHistory(output, names):
+    '''Double the number of iterations of the history arrays, with the new rows set to -1'''
+
+    for name in names:
+        output[name] = np.concatenate((output[name], np.full(output[name].shape, -1.0)))
+
+
+def bestResponse(data, models=None):
+    '''
+    Best response of the current optimizer, with the prices of the other suppliers
+    fixed at p_fixed and its own prices within the initial bounds
+    '''
+
+    # Update price bounds
+    for i in range(data['I_opt_out'], data['I_tot']):
+        if data['operator'][i] != data['optimizer']:
+            data['lb_p'][i] = copy.deepcopy(data['p_fixed'][i])
+            data['ub_p'][i] = copy.deepcopy(data['p_fixed'][i])
+        else:
+            data['lb_p'][i] = copy.deepcopy(data['initial_data']['lb_p'][i])
+            data['ub_p'][i] = copy.deepcopy(data['initial_data']['ub_p'][i])
+
+    # Update utility bounds and preprocess choices
+    update_bounds.updateUtilityBounds(data, incremental=True)
+
+    # Print fixed prices of non-optimizing suppliers
+    print('\nAlt  Supplier   Fixed price')
+    for i in range(data['I_opt_out'], data['I_tot']):
+        if data['operator'][i] != data['optimizer']:
+            print(' {:2d}       {:2d}      {:8.3f}'.format(i, data['operator'][i], data['p_fixed'][i]))
+
+    ### Run the best response (BR) problem for the current optimizer
+    return supply_opt.solveBestResponse(data, models)
+
+
+def bestResponseWorker(snapshot, k, lb_profit, threads):
+    '''
+    Best response of supplier k on a worker's own copy of data, with its profit lb_profit at the
+    current prices (None if unknown) and threads CPLEX threads, capturing its output and timing
+    '''
+
+    snapshot['optimizer'] = k
+    snapshot['lb_profit'] = lb_profit
+    snapshot['cplex_threads'] = threads
+    timing.resetSummary()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        results = bestResponse(snapshot)
+
+    return results, log.getvalue(), timing.workerSummary()
+
+
+def simultaneousBestResponses(data, models, profits):
+    '''
+    Best responses of all the suppliers to the same prices p_fixed (Jacobi mode), with profits
+    the profits at p_fixed (None if unknown). The K problems are independent: with n_workers_best_response > 1
+    they are solved in a process pool, each worker on its own copy of data (pickled by the executor, the models
+    are then rebuilt) with its share of the cores (workerThreads), and the output is printed in the order of the suppliers. Returns the new prices, in which the prices
+    of each supplier move to its best response, damped by best_response_damping, and the best-response
+    prices themselves (undamped).
+    '''
+
+    BR_list = []
+
+    if data['n_workers_best_response'] <= 1:
+        for k in range(1, data['K'] + 1):
+            data['optimizer'] = k
+            data['lb_profit'] = None if profits is None else profits[k]
+            BR_list.append((k, bestResponse(data, models)))
+
+    else:
+        workers = min(data['n_workers_best_response'], data['K'])
+        threads = supply_opt.workerThreads(data, workers)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for k in range(1, data['K'] + 1):
+                futures[k] = pool.submit(bestResponseWorker, data, k, None if profits is None else profits[k], threads)
+
+            for k in range(1, data['K'] + 1):
+                results, log, timings = futures[k].result()
+                print(log, end='')
+                timing.mergeSummary(timings)
+                BR_list.append((k, results))
+
+    prices = np.array(data['p_fixed'], dtype=float)
+    bestResponses = np.array(data['p_fixed'], dtype=float)
+    for k, results in BR_list:
+        alts = data['list_alt_supplier'][k]
+        bestResponses[alts] = np.asarray(results['prices'])[alts]
+        prices[alts] = data['best_response_damping'] * prices[alts] + (1 - data['best_response_damping']) * bestResponses[alts]
+
+    return prices, bestResponses
+
+
 def fixedPointIterationAlg(data):
 
     output = {}
 
     # Price, profit, market share and demand at each iteration
-    output['p_history'] = np.full((data['max_iter']+1, data['I_tot']), -1.0)
-    output['profit'] = np.full((data['max_iter']+1, data['K'] + 1), -1.0)
-    output['market_share'] = np.full((data['max_iter']+1, data['I_tot']), -1.0)
-    output['demand_history'] = np.full((data['max_iter']+1, data['I_tot']), -1.0)
+    output['p_history'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['I_tot']), -1.0)
+    output['profit'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['K'] + 1), -1.0)
+    output['market_share'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['I_tot']), -1.0)
+    output['demand_history'] = np.full((min(data['max_iter'], HISTORY_SIZE)+1, data['I_tot']), -1.0)
     # Information about equilibrium: iteration number of cycle start and end, type of equilibrium
     output['cycle_start'] = None
     output['cycle_end'] = None
@@ -34,43 +159,43 @@ def fixedPointIterationAlg(data):
     # Initialize variables of the sequential game
     iter = 0
     cycle = False
+    # Price vectors visited at each iteration, hashed by optimizer and cell of the grid
+    visited = {}
     data['lb_profit'] = None
 
+    # Best-response models of each optimizer, reused across iterations
+    models = {}
+
+    # Iterations between two best responses of the same supplier
+    stride = 1 if data['best_response_mode'] == 'Jacobi' else data['K']
+    # Share of the distance to the best responses covered by an iteration: in Jacobi mode, consecutive prices
+    # differ by (1 - best_response_damping) times this distance, so the cycle test is scaled accordingly
+    step = 1 - data['best_response_damping'] if data['best_response_mode'] == 'Jacobi' else 1.0
+
     # Main loop
     while (iter < data['max_iter']) and cycle is False:
         
         iter += 1
         print('\n\nITERATION %r' %iter)
 
-        #########################
-        # PREPROCESS
-        #########################
-        
-        # Update price bounds
-        for i in range(data['I_opt_out'], data['I_tot']):
-            if data['operator'][i] != data['optimizer']:
-                data['lb_p'][i] = copy.deepcopy(data['p_fixed'][i])
-                data['ub_p'][i] = copy.deepcopy(data['p_fixed'][i])
-            else:
-                data['lb_p'][i] = copy.deepcopy(data['initial_data']['lb_p'][i])
-                data['ub_p'][i] = copy.deepcopy(data['initial_data']['ub_p'][i])
-        
-        # Update utility bounds and preprocess choices
-        update_bounds.updateUtilityBounds(data)
-
-        # Print fixed prices of non-optimizing suppliers
-        print('\nAlt  Supplier   Fixed price')
-        for i in range(data['I_opt_out'], data['I_tot']):
-            if data['operator'][i] != data['optimizer']:
-                print(' {:2d}       {:2d}      {:8.3f}'.format(i, data['operator'][i], data['p_fixed'][i]))
+        # Grow the history arrays if they are full
+        if iter >= len(output['profit']):
+            growHistory(output, ['p_history', 'profit', 'market_share', 'demand_history'])
 
         #########################
-        # BEST RESPONSE PROBLEM
+        # BEST RESPONSE PROBLEMS
         #########################
 
-        ### Run the best response (BR) problem for the current optimizer
-        model = supply_opt.getModel(data)
-        BR_results = supply_opt.solveModel(data, model)
+        if data['best_response_mode'] == 'Jacobi':
+            ### Best responses of all the suppliers to the same prices, then choices of the customers at the new prices
+            p_previous = np.array(data['p_fixed'], dtype=float)
+            data['p_fixed'], bestResponses = simultaneousBestResponses(data, models, None if iter == 1 else output['profit'][iter-1])
+            # Maximum deviation of the best responses from the prices they respond to
+            gapBestResponse = np.amax(abs(bestResponses - p_previous))
+            BR_results = supply_opt.simulateResults(data)
+        else:
+            ### Best response of the current optimizer
+            BR_results = bestResponse(data, models)
 
         #########################
         # POSTPROCESS
@@ -95,8 +220,11 @@ def fixedPointIterationAlg(data):
         # UPDATE INDICATORS
         #########################
 
-        ### Cycle detection: all iterations in which the current optimizer previously optimized
-        iterations_to_check = range(iter - data['K'], 0, -data['K'])
+        ### Cycle detection: iterations in which the current optimizer previously optimized (all iterations
+        ### in Jacobi mode) and visited a price vector in a neighbouring cell of the grid (most recent first)
+        prices = output['p_history'][iter,:]
+        iterations_to_check = sorted([j for cell in neighbourCells(data, prices)
+                                      for j in visited.get((iter % stride, cell), [])], reverse=True)
         print('\nIterations to check: %r' % list(iterations_to_check))
         print('\nIter     MaxDevPrice')
 
@@ -106,7 +234,7 @@ def fixedPointIterationAlg(data):
             deviation = np.amax(abs(output['p_history'][j,:] - output['p_history'][iter,:]))
             print(' {:3d}      {:10.2f}'.format(j, deviation))
 
-            if deviation > data['tolerance_cyclic_equilibrium']:
+            if deviation > data['tolerance_cyclic_equilibrium'] * step:
                 cycle = False
                     
             else:
@@ -118,8 +246,11 @@ def fixedPointIterationAlg(data):
                 output['market_share'] = output['market_share'][:iter+1,:]
                 output['demand_history'] = output['demand_history'][:iter+1,:]
 
-                # Define the type of cycle
-                if iter - output['cycle_start'] == data['K'] and deviation < data['tolerance_equilibrium'] and data['DCM'] != 'NestedLogit':
+                # Define the type of cycle (in Jacobi mode, a Nash equilibrium if the undamped best responses
+                # are within tolerance_equilibrium of the prices they respond to)
+                if data['best_response_mode'] == 'Jacobi':
+                    deviation = gapBestResponse
+                if iter - output['cycle_start'] == stride and deviation < data['tolerance_equilibrium'] and data['DCM'] != 'NestedLogit':
                     print('\nNash equilibrium detected\n')
                     output['cycle_type'] = 'NashEquilibrium'
                 else:
@@ -130,15 +261,17 @@ def fixedPointIterationAlg(data):
         ### Update the data for the next iteration
         if cycle is False:
 
+            visited.setdefault((iter % stride, gridCell(data, prices)), []).append(iter)
+
             data['optimizer'] = ((data['optimizer']) % data['K']) + 1
             data['lb_profit'] = output['profit'][iter][data['optimizer']]
             
             data['p_fixed'] = copy.deepcopy(BR_results['prices'])
             
-            # If no convergence before max iter is reached, then just save last 5*K iterations
+            # If no convergence before max iter is reached, then just save last 5 rounds of best responses
             if iter == data['max_iter']:
                 # Save all useful information
-                output['cycle_start'] = max(iter - 5 * data['K'], data['K'])
+                output['cycle_start'] = max(iter - 5 * stride, stride)
                 output['cycle_end'] = iter
                 output['p_history'] = output['p_history'][:iter+1,:]
                 output['profit'] = output['profit'][:iter+1,:]
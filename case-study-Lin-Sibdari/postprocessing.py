@@ -3,13 +3,18 @@
 # General
 import sys
 import time
-import copy
 import matplotlib.pyplot as plt
 import numpy as np
 
+# Project
+import timing
+
 # Data
 import Data_LinSibdari_MNL as data_file
 
+# Maximum number of simulated utilities held in memory at once
+CHUNK_SIZE = 10**7
+
 
 def printOutputAnalysis(data):
 
@@ -57,104 +62,223 @@ def printOutputAnalysis(data):
     print()
 
 
-def calculation(data):
+def simulateChoices(U, drawShare):
+    '''
+    Choices of the customers for the utilities U[i,n,r], for all the customers and draws at once:
+    choice indicators w[i,n,r], expected maximum utilities EMU[n] (averaged over the draws) and
+    choice probabilities P[i,n], where drawShare[n,r] is the share of draw r in the probabilities of customer n
+    '''
+
+    choice = np.argmax(U, axis=0)
+
+    w = np.zeros(U.shape)
+    np.put_along_axis(w, choice[None], 1.0, axis=0)
+
+    EMU = np.sum(np.take_along_axis(U, choice[None], axis=0)[0], axis=1) / U.shape[2]
+    P = np.einsum('inr,nr->in', w, drawShare)
+
+    return w, EMU, P
+
+
+def utilityTerms(data):
+    '''
+    Endogenous coefficients and exogenous terms (including the error terms) of the utilities
+    U[i,n,r] = endo_coef[i,n,r] * price[i] + exo[i,n,r] of the simulation, as arrays of shape (I, N, R)
+    '''
+
+    I, N, R = data['I_tot'], data['N'], data['R']
 
-    price = copy.deepcopy(data['p_fixed'])
+    endo_coef = np.zeros((I, N, R))
+    exo = np.zeros((I, N, R))
+    exo[0] = data['xi'][0]
+    if data['DCM'] == 'MixedLogit':
+        endo_coef[1:] = data['endo_coef'][1:]
+        exo[1:] = data['exo_utility'][1:] + data['xi'][1:]
+    else:
+        endo_coef[1:] = data['beta']
+        exo[1:] = data['exo_utility'][1:][:, :, None] + data['xi'][1:]
+
+    return endo_coef, exo
+
+
+@timing.timed('postprocess')
+def calculation(data, weights=None):
+    '''
+    Utilities, choices, demands and profits at the prices p_fixed.
+    weights are the weights of the draws in the demand (e.g. data['weights'], valid for prices
+    within the bounds of the choice preprocessing), popN[n]/R if None. Expected maximum utilities
+    are averaged over all the draws, since merged draws have the same choice but not the same utility.
+    '''
+
+    price = np.array(data['p_fixed'], dtype=float)
+
+    # Share of each draw in the choice probabilities of its customer
+    if weights is None:
+        weights = np.repeat(np.asarray(data['popN'], dtype=float)[:, None] / data['R'], data['R'], axis=1)
+    drawShare = weights / np.sum(weights, axis=1, keepdims=True)
 
     data['output'] = {}
-    data['output']['U'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['EMU'] = np.zeros([data['N']])
-    data['output']['w'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['P'] = np.zeros([data['I_tot'], data['N']])
-    data['output']['profit'] = np.zeros([data['K']+1])
-    data['output']['demand'] = np.zeros([data['I_tot']])
-    data['output']['market_share'] = np.zeros([data['I_tot']])
 
     # Calculate utilities and choices
-    for n in range(data['N']):
-        for r in range(data['R']):
-            if data['DCM'] == 'MixedLogit':
-                data['output']['U'][0,n,r] = data['xi'][0, n, r]
-                data['output']['U'][1,n,r] = data['endo_coef'][1,n,r] * price[1] + data['exo_utility'][1,n,r] + data['xi'][1, n, r]
-                data['output']['U'][2,n,r] = data['endo_coef'][2,n,r] * price[2] + data['exo_utility'][2,n,r] + data['xi'][2, n, r]
-            else:
-                data['output']['U'][0,n,r] = data['xi'][0, n, r]
-                data['output']['U'][1,n,r] = data['beta'] * price[1] + data['exo_utility'][1,n] + data['xi'][1, n, r]
-                data['output']['U'][2,n,r] = data['beta'] * price[2] + data['exo_utility'][1,n] + data['xi'][2, n, r]
-            i_UMax = np.argmax(data['output']['U'][:,n,r])
-            data['output']['EMU'][n] += data['output']['U'][i_UMax, n, r]/data['R']
-            data['output']['w'][i_UMax,n,r] = 1
-            data['output']['P'][i_UMax, n] += 1/data['R']
-    
+    endo_coef, exo = utilityTerms(data)
+    U = endo_coef * price[:, None, None] + exo
+    data['output']['U'] = U
+    data['output']['w'], data['output']['EMU'], data['output']['P'] = simulateChoices(U, drawShare)
+
     # Calculate demand
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            data['output']['demand'][i] += data['output']['P'][i,n] * data['popN'][n]
-    
+    data['output']['demand'] = data['output']['P'] @ np.asarray(data['popN'], dtype=float)
+
     # Calculate market shares
     data['output']['market_share'] = data['output']['demand'] / data['Pop']
-    
+
     # Calculate profits
-    for k in range(data['K'] + 1):
-        for i in data['list_alt_supplier'][k]:
-            data['output']['profit'][k] += data['output']['demand'][i] * price[i]
-
-
-def linearProfitCurve():
-
-        data = data_file.getData()
-        data_file.printCustomers(data)
-
-        price = copy.deepcopy(data['p_fixed'])
-
-        opt = data['optimizer']
-        price[opt] = data['lb_p'][opt]
-
-        while price[opt] <= data['ub_p'][opt]:
-
-            data['output'] = {}
-            data['output']['U'] = np.zeros([data['I_tot'], data['N'], data['R']])
-            data['output']['EMU'] = np.zeros([data['N']])
-            data['output']['w'] = np.zeros([data['I_tot'], data['N'], data['R']])
-            data['output']['P'] = np.zeros([data['I_tot'], data['N']])
-            data['output']['profit'] = np.zeros([data['K']+1])
-            data['output']['demand'] = np.zeros([data['I_tot']])
-            data['output']['market_share'] = np.zeros([data['I_tot']])
-
-            # Calculate utilities and choices
-            for n in range(data['N']):
-                for r in range(data['R']):
-                    if data['DCM'] == 'MixedLogit':
-                        data['output']['U'][0,n,r] = data['xi'][0, n, r]
-                        data['output']['U'][1,n,r] = data['endo_coef'][i,n,r] * price[1] + data['exo_utility'][1,n,r] + data['xi'][1, n, r]
-                        data['output']['U'][2,n,r] = data['endo_coef'][i,n,r] * price[2] + data['exo_utility'][2,n,r] + data['xi'][2, n, r]
-                    else:
-                        data['output']['U'][0,n,r] = data['xi'][0, n, r]
-                        data['output']['U'][1,n,r] = data['beta'] * price[1] + data['exo_utility'][1,n] + data['xi'][1, n, r]
-                        data['output']['U'][2,n,r] = data['beta'] * price[2] + data['exo_utility'][2,n] + data['xi'][2, n, r]
-                    i_UMax = np.argmax(data['output']['U'][:,n,r])
-                    data['output']['EMU'][n] += data['output']['U'][i_UMax, n, r]/data['R']
-                    data['output']['w'][i_UMax,n,r] = 1
-                    data['output']['P'][i_UMax, n] += 1/data['R']
-            
-            # Calculate demand
-            for i in range(data['I_tot']):
-                for n in range(data['N']):
-                    data['output']['demand'][i] += data['output']['P'][i,n] * data['popN'][n]
-            
-            # Calculate market shares
-            data['output']['market_share'] = data['output']['demand'] / data['Pop']
-            
-            # Calculate profits
-            for k in range(data['K'] + 1):
-                for i in data['list_alt_supplier'][k]:
-                    data['output']['profit'][k] += data['output']['demand'][i] * price[i]
+    data['output']['profit'] = np.zeros([data['K']+1])
+    np.add.at(data['output']['profit'], data['operator'], data['output']['demand'] * price)
 
-            data['p_fixed'] = price
 
-            printOutputAnalysis(data)
+@timing.timed('postprocess')
+def evaluatePrices(data, prices, weights=None):
+    '''
+    Demands, market shares, profits and expected maximum utilities for each row of prices (M x I_tot),
+    as arrays of shape (M, I_tot), (M, I_tot), (M, K+1) and (M, N). Same simulation as calculation,
+    vectorized over the price vectors, which are evaluated in chunks of at most CHUNK_SIZE utilities.
+    '''
+
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    M, I, N, R = len(prices), data['I_tot'], data['N'], data['R']
+
+    endo_coef, exo = utilityTerms(data)
+    popN = np.asarray(data['popN'], dtype=float)
+
+    # Share of each draw in the choice probabilities of its customer
+    if weights is None:
+        weights = np.repeat(popN[:, None] / R, R, axis=1)
+    drawShare = weights / np.sum(weights, axis=1, keepdims=True)
+
+    results = {}
+    results['demand'] = np.zeros((M, I))
+    results['EMU'] = np.zeros((M, N))
+
+    chunk = max(1, CHUNK_SIZE // (I * N * R))
+    for start in range(0, M, chunk):
+        p = prices[start:start + chunk]
+        U = endo_coef[None] * p[:, :, None, None] + exo[None]
+        choice = np.argmax(U, axis=1)
+        results['EMU'][start:start + chunk] = np.sum(np.take_along_axis(U, choice[:, None], axis=1)[:, 0], axis=2) / R
+        for i in range(I):
+            results['demand'][start:start + chunk, i] = np.sum((choice == i) * drawShare, axis=2) @ popN
+
+    results['market_share'] = results['demand'] / data['Pop']
+
+    results['profit'] = np.zeros((M, data['K'] + 1))
+    for i in range(I):
+        results['profit'][:, data['operator'][i]] += results['demand'][:, i] * prices[:, i]
+
+    return results
+
+
+def checkEvaluation(data, simulated):
+    '''
+    Check that evaluatePrices reproduces the demands simulated by the best-response problems
+    (supply_opt.simulateResults) at the prices p_fixed, with the same weights of the draws
+    '''
+
+    demand = evaluatePrices(data, data['p_fixed'], data['weights'])['demand'][0]
+    if not np.allclose(demand, simulated['demand']):
+        raise Exception('Demands of evaluatePrices {} differ from the simulated demands {}'.format(demand, simulated['demand']))
+
+
+def drawChunks(simulateDraws, data, R, chunk_draws):
+    '''Random terms of R new draws, generated by simulateDraws (of the data file) in chunks of at most chunk_draws draws'''
+
+    for start in range(0, R, chunk_draws):
+        yield simulateDraws(data, min(chunk_draws, R - start))
+
+
+@timing.timed('postprocess')
+def streamingEvaluation(data, prices, chunks):
+    '''
+    Demands, market shares, profits and expected maximum utilities for each row of prices, as evaluatePrices,
+    with the draws given by chunks (dictionaries with the random terms of the draws of each chunk, e.g. drawChunks).
+    The results are accumulated chunk by chunk, so that only one chunk of draws is held in memory.
+    '''
+
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+
+    results = {}
+    results['R'] = 0
+    results['demand'] = np.zeros((len(prices), data['I_tot']))
+    results['profit'] = np.zeros((len(prices), data['K'] + 1))
+    results['EMU'] = np.zeros((len(prices), data['N']))
+
+    for draws in chunks:
+        chunk = dict(data)
+        chunk.update(draws)
+        chunk['R'] = draws['xi'].shape[2]
+
+        chunkResults = evaluatePrices(chunk, prices)
+        for key in ['demand', 'profit', 'EMU']:
+            results[key] += chunkResults[key] * chunk['R']
+        results['R'] += chunk['R']
+
+    if results['R'] == 0:
+        raise Exception('No draws to evaluate the prices')
+
+    for key in ['demand', 'profit', 'EMU']:
+        results[key] /= results['R']
+    results['market_share'] = results['demand'] / data['Pop']
+
+    return results
+
+
+def printOutOfSampleAnalysis(data, results):
+    '''Print the demands, market shares and profits of the first row of prices of streamingEvaluation'''
+
+    print('\n\nOUT-OF-SAMPLE VALIDATION ({:d} draws)'.format(results['R']))
+    print('TOTAL DEMAND               ', end =" ")
+    for i in range(data['I_tot']):
+        print(' {:8.3f}'.format(results['demand'][0, i]), end=" ")
+    print('\nTOTAL MARKET SHARE         ', end =" ")
+    for i in range(data['I_tot']):
+        print(' {:8.4f}'.format(results['market_share'][0, i]), end=" ")
+    print('\nPROFITS                    ', end =" ")
+    for k in range(data['K']+1):
+        print(' {:8.4f}'.format(results['profit'][0, k]), end=" ")
+    print()
+
+
+def linearProfitCurve(step=1.0):
+    '''
+    Demands and profits as a function of the price of the optimizer, from lb_p to ub_p with the given step
+    (other prices fixed to p_fixed), evaluated in a single batch
+    '''
+
+    data = data_file.getData()
+
+    opt = data['optimizer']
+
+    grid = data['lb_p'][opt] + step * np.arange(int(np.floor((data['ub_p'][opt] - data['lb_p'][opt]) / step + 1e-9)) + 1)
+    prices = np.tile(np.asarray(data['p_fixed'], dtype=float), (len(grid), 1))
+    prices[:, opt] = grid
+
+    t_0 = time.time()
+    results = evaluatePrices(data, prices)
+
+    print('\n\nPROFIT CURVE OF ALTERNATIVE {:d} ({:d} prices in {:.3f} sec)'.format(opt, len(grid), time.time() - t_0))
+    print('\n   PRICE ', end=' ')
+    for i in range(data['I_tot']):
+        print('  DEMAND {:1d}'.format(i), end=' ')
+    for k in range(data['K'] + 1):
+        print('  PROFIT {:1d}'.format(k), end=' ')
+    for m in range(len(grid)):
+        print('\n{:8.3f} '.format(grid[m]), end=' ')
+        for i in range(data['I_tot']):
+            print(' {:9.3f}'.format(results['demand'][m, i]), end=' ')
+        for k in range(data['K'] + 1):
+            print(' {:9.4f}'.format(results['profit'][m, k]), end=' ')
+    print()
 
-            price[opt] += 1
+    return grid, results
 
 
 def mainSimulation():
@@ -1,8 +1,12 @@
 # Sensitivity analysis of equilibrium results
 
 # General
+import io
+import os
 import time
 import copy
+import contextlib
+import concurrent.futures
 import numpy as np
 
 # Project
@@ -10,6 +14,7 @@ import supply_opt
 import choice_preprocess
 import update_bounds
 import postprocessing
+import timing
 
 # Data
 import Data_LinSibdari_MNL as data_file
@@ -17,76 +22,170 @@ import Data_LinSibdari_ObservedHet as data_file
 import Data_LinSibdari_UnobservedHet as data_file
 
 
-def sensitivityAnalysisEquilibrium():
+def replication(seed):
+    '''
+    Replication of the analysis with the draws of the given seed: demands, market shares and profits
+    at the prices p_fixed, and largest relative profit increase of the best responses (epsilon)
+    '''
 
-    t_0 = time.time()
+    print('\n\n\n---------------\nREPLICATION {:3d}\n---------------'.format(seed+1))
 
-    replications = 100
+    # Set random seed
+    np.random.seed(seed)
 
-    demand = np.zeros((replications,3))
-    marketshares = np.zeros((replications,3))
-    profit = np.zeros((replications, 3))
-    
-    epsilon = np.zeros(replications)
+    # Read instance
+    data = data_file.getData()
 
-    for seed in range(replications):
+    postprocessing.calculation(data)
+    postprocessing.printOutputAnalysis(data)
+
+    results = {}
+    results['demand'] = copy.deepcopy(data['output']['demand'])
+    results['market_share'] = copy.deepcopy(data['output']['market_share'])
+    results['profit'] = copy.deepcopy(data['output']['profit'])
+    results['market_share_out_of_sample'] = np.zeros([data['I_tot']])
+
+    BR_profits = data['output']['profit']
+
+    print('\nBEST RESPONSE PROBLEMS:')
+    for k in range(1, data['K'] + 1):
+
+        data['optimizer'] = k
+        data['lb_profit'] = results['profit'][k]
+
+        # Set price bounds to either initial bounds (optimizer) or fixed prices
+        for i in range(data['I_opt_out'], data['I_tot']):
+            if data['operator'][i] != k:
+                data['lb_p'][i] = copy.deepcopy(data['p_fixed'][i])
+                data['ub_p'][i] = copy.deepcopy(data['p_fixed'][i])
+
+        update_bounds.updateUtilityBounds(data)
+        choice_preprocess.choicePreprocess(data)
+
+        # Solve the best response problem
+        BR_results = supply_opt.solveBestResponse(data)
+
+        # Update prices and profits after the Stackelberg games
+        BR_profits[k] = BR_results['profits'][k]
 
-        print('\n\n\n---------------\nREPLICATION {:3d}\n---------------'.format(seed+1))
+    ### Verify profit differences (absolute and in %)
+    profit_diff = [BR_profits[k] - results['profit'][k] for k in range(data['K'] + 1)]
+    profit_perc = np.zeros([data['K'] + 1])
+    for k in range(1, data['K'] + 1):
+        profit_perc[k] = profit_diff[k] / results['profit'][k]
+    results['epsilon'] = np.max(profit_perc)
 
-        # Set random seed
-        np.random.seed(seed)
+    ### Out-of-sample validation of the prices (new draws, simulated in chunks)
+    if data['R_out_of_sample'] > 0:
+        postprocessing.checkEvaluation(data, supply_opt.simulateResults(data))
+        chunks = postprocessing.drawChunks(data_file.simulateDraws, data, data['R_out_of_sample'], data['chunk_draws'])
+        out_of_sample = postprocessing.streamingEvaluation(data, data['p_fixed'], chunks)
+        postprocessing.printOutOfSampleAnalysis(data, out_of_sample)
+        results['market_share_out_of_sample'] = out_of_sample['market_share'][0]
 
-        # Read instance
-        data = data_file.getData()
+    return results
 
-        data_file.printCustomers(data)
 
-        postprocessing.calculation(data)
-        postprocessing.printOutputAnalysis(data)
+def replicationWorker(seed):
+    '''Replication of the given seed in a worker process, capturing its output and timing'''
 
-        demand[seed] = data['output']['demand']
-        marketshares[seed] = data['output']['market_share']
-        profit[seed] = data['output']['profit']
+    timing.resetSummary()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        results = replication(seed)
 
-        BR_profits = data['output']['profit']
+    return seed, results, log.getvalue(), timing.workerSummary()
 
-        print('\nBEST RESPONSE PROBLEMS:')
-        for k in range(1, data['K'] + 1):
 
-            data['optimizer'] = k
-            data['lb_profit'] = profit[seed][k]
+def saveResults(path, results):
+    '''Save the results of the replications in path (written to a temporary file, then renamed)'''
 
-            # Set price bounds to either initial bounds (optimizer) or fixed prices
-            for i in range(data['I_opt_out'], data['I_tot']):
-                if data['operator'][i] != k:
-                    data['lb_p'][i] = copy.deepcopy(data['p_fixed'][i])
-                    data['ub_p'][i] = copy.deepcopy(data['p_fixed'][i])
+    if path is None:
+        return
 
-            update_bounds.updateUtilityBounds(data)
-            choice_preprocess.choicePreprocess(data)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **results)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
 
-            # Solve the best response problem
-            model = supply_opt.getModel(data)
-            results = supply_opt.solveModel(data, model)
 
-            # Update prices and profits after the Stackelberg games
-            BR_profits[k] = results['profits'][k]
+def loadResults(path, results):
+    '''Results of the replications completed by a previous run saved in path (results if there are none)'''
 
-        ### Verify profit differences (absolute and in %)
-        profit_diff = [BR_profits[k] - profit[seed][k] for k in range(data['K'] + 1)]
-        profit_perc = np.zeros([data['K'] + 1])
-        for k in range(1, data['K'] + 1):
-            profit_perc[k] = profit_diff[k] / profit[seed][k]
-        epsilon[seed] = np.max(profit_perc)
+    if path is None or not os.path.exists(path):
+        return results
+
+    with np.load(path) as saved:
+        for key in results:
+            if key not in saved or saved[key].shape != results[key].shape:
+                raise Exception('Results in {} do not match the replications of the analysis ({})'.format(path, key))
+        results = {key: saved[key] for key in results}
+
+    print('\nRESUME FROM {:s}: {:d} replications completed'.format(path, int(np.sum(results['done']))))
+
+    return results
+
+
+def sensitivityAnalysisEquilibrium():
+    '''
+    Independent replications of the analysis (seed = index of the replication), in a process pool
+    with n_workers_sensitivity > 1. The results of each completed replication are saved in
+    sensitivity_results_file, so that an interrupted analysis only runs the remaining replications.
+    '''
+
+    t_0 = time.time()
+
+    # Parameters of the analysis
+    parameters = {}
+    data_file.setAlgorithmParameters(parameters)
+    replications = parameters['replications']
+    path = parameters['sensitivity_results_file']
+
+    # Results of all the replications, completed ones from a previous run
+    results = {}
+    results['done'] = np.zeros(replications, dtype=bool)
+    results['demand'] = np.zeros((replications,3))
+    results['market_share'] = np.zeros((replications,3))
+    results['profit'] = np.zeros((replications, 3))
+    results['market_share_out_of_sample'] = np.zeros((replications,3))
+    results['epsilon'] = np.zeros(replications)
+    results = loadResults(path, results)
+
+    remaining = [seed for seed in range(replications) if not results['done'][seed]]
+
+    if parameters['n_workers_sensitivity'] <= 1:
+        for seed in remaining:
+            for key, value in replication(seed).items():
+                results[key][seed] = value
+            results['done'][seed] = True
+            saveResults(path, results)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=parameters['n_workers_sensitivity']) as pool:
+            futures = [pool.submit(replicationWorker, seed) for seed in remaining]
+            for future in concurrent.futures.as_completed(futures):
+                seed, replicationResults, log, timings = future.result()
+                print(log, end='')
+                timing.mergeSummary(timings)
+                for key, value in replicationResults.items():
+                    results[key][seed] = value
+                results['done'][seed] = True
+                saveResults(path, results)
 
     ###########################################
     # POST-PROCESS: ANALYSIS
     ###########################################
     for seed in range(replications):
         print('\n{:4d}  '.format(seed+1), end =" ")
-        print('  {:6.4f}    '.format(epsilon[seed]), end=" ")
+        print('  {:6.4f}    '.format(results['epsilon'][seed]), end=" ")
         for i in range(3):
-            print(' {:6.4f}'.format(marketshares[seed][i]), end=" ")
+            print(' {:6.4f}'.format(results['market_share'][seed][i]), end=" ")
+        if parameters['R_out_of_sample'] > 0:
+            print('   ', end=" ")
+            for i in range(3):
+                print(' {:6.4f}'.format(results['market_share_out_of_sample'][seed][i]), end=" ")
+
+    print('\n\nTOTAL TIME: {:8.3f} sec ({:d} replications run)'.format(time.time() - t_0, len(remaining)))
 
 ##### MAIN
 if __name__ == '__main__':
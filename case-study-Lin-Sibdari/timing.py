@@ -0,0 +1,172 @@
+'''
+Timing of the phases of the equilibrium pipeline (bounds, preprocess, build, solve, extract, postprocess).
+Each phase records its wall time and CPU time, excluding the nested phases, and optionally the size of the
+CPLEX model and the solver status. A sub-phase (e.g. the CPLEX callbacks, which run in the solver threads
+during the solve) is included in the time of its parent phase: it is reported separately and is not
+subtracted from the parent. The events are appended to timing_file (one JSON object per line)
+and an aggregated summary per phase is printed at exit. Worker processes end without running the exit
+handlers: they return their summary (workerSummary), which the parent merges in its own (mergeSummary).
+'''
+
+# General
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import functools
+import contextlib
+
+# JSON-lines file of the events (None: summary only), set by configure
+timingFile = None
+
+# Phases currently open in each thread
+openPhases = threading.local()
+
+# Aggregated wall time, CPU time and number of calls per (module, phase, parent phase or None)
+summary = {}
+summaryLock = threading.Lock()
+
+
+def configure(data):
+    '''Write the events to data['timing_file']'''
+
+    global timingFile
+    timingFile = data['timing_file']
+
+
+def currentEvent():
+    '''Event of the innermost open phase of the current thread (None outside of the phases)'''
+
+    stack = getattr(openPhases, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def modelSize(model):
+    '''Add the number of variables and constraints of a CPLEX model to the current event'''
+
+    event = currentEvent()
+    if event is not None:
+        event['variables'] = model.variables.get_num()
+        event['constraints'] = model.linear_constraints.get_num()
+
+
+def solverStatus(model):
+    '''Add the solution status of a CPLEX model to the current event'''
+
+    event = currentEvent()
+    if event is not None:
+        event['status'] = model.solution.get_status_string()
+
+
+def record(event):
+    '''Aggregate an event in the summary and append it to timingFile'''
+
+    key = (event['module'], event['phase'], event.get('parent'))
+    with summaryLock:
+        calls, wall, cpu = summary.get(key, (0, 0.0, 0.0))
+        summary[key] = (calls + 1, wall + event['wall'], cpu + event['cpu'])
+
+    if timingFile is not None:
+        with open(timingFile, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+
+
+def resetSummary():
+    '''Clear the summary, at the start of a task of a worker process (which inherits the summary of its parent)'''
+
+    with summaryLock:
+        summary.clear()
+
+
+def workerSummary():
+    '''Copy of the summary of a worker process, returned to the parent with the results of its task'''
+
+    with summaryLock:
+        return dict(summary)
+
+
+def mergeSummary(other):
+    '''Add the summary of a worker process to the summary'''
+
+    with summaryLock:
+        for key, (calls, wall, cpu) in other.items():
+            total = summary.get(key, (0, 0.0, 0.0))
+            summary[key] = (total[0] + calls, total[1] + wall, total[2] + cpu)
+
+
+@contextlib.contextmanager
+def phase(name, module, parent=None):
+    '''Time the statements of a phase of the module. Nested phases are excluded from its time.
+    With a parent phase, it is a sub-phase whose time is included in the parent (and not subtracted from it);
+    the phases nested in a sub-phase are sub-phases of the same parent'''
+
+    if getattr(openPhases, 'stack', None) is None:
+        openPhases.stack = []
+    if module == '__main__':
+        module = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+    event = {'module': module, 'phase': name, 'pid': os.getpid(), 'start': time.time()}
+    enclosing = currentEvent()
+    if parent is not None:
+        event['parent'] = parent
+    elif enclosing is not None and 'parent' in enclosing:
+        event['parent'] = enclosing['parent']
+    openPhases.stack.append(event)
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    try:
+        yield event
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        openPhases.stack.pop()
+
+        # Time of the phase itself, and time of the nested phases for the enclosing one (but a sub-phase stays in it)
+        event['wall'] = wall - event.pop('nested_wall', 0.0)
+        event['cpu'] = cpu - event.pop('nested_cpu', 0.0)
+        if enclosing is not None and parent is None:
+            enclosing['nested_wall'] = enclosing.get('nested_wall', 0.0) + wall
+            enclosing['nested_cpu'] = enclosing.get('nested_cpu', 0.0) + cpu
+
+        record(event)
+
+
+def timed(name, parent=None):
+    '''Decorator timing each call of a function as a phase of its module (a sub-phase of parent, if any)'''
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name, function.__module__, parent) as event:
+                event['function'] = function.__name__
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def printSummary():
+    '''Print the wall time, CPU time and number of calls of each phase, sorted by wall time.
+    The sub-phases are printed after the phases, since their time is already included in their parent'''
+
+    if not summary:
+        return
+
+    ordered = sorted(summary.items(), key=lambda item: -item[1][1])
+
+    print('\n ---- PHASE TIMING ---- ')
+    print('Module                   Phase            Calls     Wall (sec)      CPU (sec)')
+    for (module, name, parent), (calls, wall, cpu) in ordered:
+        if parent is None:
+            print('{:24s} {:12s} {:9d} {:14.3f} {:14.3f}'.format(module, name, calls, wall, cpu))
+
+    if any(parent is not None for (module, name, parent) in summary):
+        print('\n Sub-phases (included in the time of their parent phase)')
+        print('Module                   Phase        Parent           Calls     Wall (sec)      CPU (sec)')
+        for (module, name, parent), (calls, wall, cpu) in ordered:
+            if parent is not None:
+                print('{:24s} {:12s} {:12s} {:9d} {:14.3f} {:14.3f}'.format(module, name, parent, calls, wall, cpu))
+
+
+atexit.register(printSummary)
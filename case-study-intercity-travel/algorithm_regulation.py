@@ -2,8 +2,11 @@
 # (simultaneous game solved in a sequential manner)
 
 # General
+import io
 import time
 import copy
+import contextlib
+import concurrent.futures
 import random
 import numpy as np
 
@@ -15,6 +18,7 @@ import update_bounds
 import choice_preprocess
 import nested_logit
 import postprocessing
+import timing
 
 # Data
 import data_intercity as data_file
@@ -86,6 +90,87 @@ def printResults(data, output):
     print()
 
 
+def supplierBestResponse(data):
+    '''
+    Best response of the current optimizer in the smoothing procedure, with the prices
+    of the other suppliers fixed and the regulator policies fixed
+    '''
+
+    ##### Preprocess
+
+    # Update price bounds
+    for i in range(data['I_opt_out'], data['I_tot']):
+        if data['operator'][i] != data['optimizer']:
+            data['lb_p_urban'][i] = copy.deepcopy(data['p_urban_fixed'][i])
+            data['ub_p_urban'][i] = copy.deepcopy(data['p_urban_fixed'][i])
+            data['lb_p_rural'][i] = copy.deepcopy(data['p_rural_fixed'][i])
+            data['ub_p_rural'][i] = copy.deepcopy(data['p_rural_fixed'][i])
+        else:
+            data['lb_p_urban'][i] = copy.deepcopy(data['initial_data']['lb_p_urban'][i])
+            data['ub_p_urban'][i] = copy.deepcopy(data['initial_data']['ub_p_urban'][i])
+            data['lb_p_rural'][i] = copy.deepcopy(data['initial_data']['lb_p_rural'][i])
+            data['ub_p_rural'][i] = copy.deepcopy(data['initial_data']['ub_p_rural'][i])
+
+    # Update utility bounds and preprocess choices
+    update_bounds.updateUtilityBoundsFixedRegulator(data, incremental=True)
+    choice_preprocess.choicePreprocess(data)
+
+    ##### Run the best response (BR) problem for the current optimizer
+    model = supplier_opt.getModel(data)
+    return supplier_opt.solveModel(data, model)
+
+
+def bestResponseWorker(snapshot):
+    '''Best response of the optimizer of a worker's own copy of data, capturing its output and timing'''
+
+    timing.resetSummary()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        results = supplierBestResponse(snapshot)
+
+    return results, log.getvalue(), timing.workerSummary()
+
+
+def simultaneousBestResponses(data):
+    '''
+    Best responses of all the suppliers to the same fixed prices (Jacobi mode). The K problems
+    are independent: with n_workers_best_response > 1 they are solved in a process pool, each worker
+    on its own snapshot of data, and the output is printed in the order of the suppliers.
+    Returns the list of (k, results).
+    '''
+
+    BR_list = []
+
+    if data['n_workers_best_response'] <= 1:
+        for k in range(1, data['K'] + 1):
+            data['optimizer'] = k
+            BR_list.append((k, supplierBestResponse(data)))
+        return BR_list
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(data['n_workers_best_response'], data['K'])) as pool:
+        futures = {}
+        for k in range(1, data['K'] + 1):
+            snapshot = copy.deepcopy(data)
+            snapshot['optimizer'] = k
+            futures[k] = pool.submit(bestResponseWorker, snapshot)
+
+        for k in range(1, data['K'] + 1):
+            results, log, timings = futures[k].result()
+            print(log, end='')
+            timing.mergeSummary(timings)
+            BR_list.append((k, results))
+
+    return BR_list
+
+
+def updateFixedPrices(data, k, BR_results):
+    '''Move the fixed prices of supplier k towards its best response (smoothing with weight best_response_damping)'''
+
+    for i in data['list_alt_supplier'][k]:
+        data['p_urban_fixed'][i] = data['best_response_damping'] * data['p_urban_fixed'][i] + (1 - data['best_response_damping']) * BR_results['prices_urban'][i]
+        data['p_rural_fixed'][i] = data['best_response_damping'] * data['p_rural_fixed'][i] + (1 - data['best_response_damping']) * BR_results['prices_rural'][i]
+
+
 def heuristic_algorithm_regulation(data):
     
     output = {}
@@ -118,48 +203,25 @@ def heuristic_algorithm_regulation(data):
         iter += 1
         print('\n\n-------------\nITERATION %r\n-------------' %iter)
 
-        ##### (1) Each supplier updates its strategy sequentially (smoothing procedure)
+        ##### (1) Each supplier updates its strategy sequentially, or all of them simultaneously
+        #####     in Jacobi mode (smoothing procedure)
 
-        print('\nSmoothing through sequential solving:')
+        print('\nSmoothing through {:s} solving:'.format('simultaneous' if data['best_response_mode'] == 'Jacobi' else 'sequential'))
 
         data['optimizer'] = np.random.randint(1, high = data['K'] + 1)
         
         for it in range(data['max_iter_smoothing']):
             print('\nIteration {:3d}'.format(it+1))
 
-            for k in range(1, data['K'] + 1):
-                
-                data['optimizer'] = (data['optimizer'] % data['K']) + 1
-                
-                ##### Preprocess
-
-                # Update price bounds
-                for i in range(data['I_opt_out'], data['I_tot']):
-                    if data['operator'][i] != data['optimizer']:
-                        data['lb_p_urban'][i] = copy.deepcopy(data['p_urban_fixed'][i])
-                        data['ub_p_urban'][i] = copy.deepcopy(data['p_urban_fixed'][i])
-                        data['lb_p_rural'][i] = copy.deepcopy(data['p_rural_fixed'][i])
-                        data['ub_p_rural'][i] = copy.deepcopy(data['p_rural_fixed'][i])                    
-                    else:
-                        data['lb_p_urban'][i] = copy.deepcopy(data['initial_data']['lb_p_urban'][i])
-                        data['ub_p_urban'][i] = copy.deepcopy(data['initial_data']['ub_p_urban'][i])
-                        data['lb_p_rural'][i] = copy.deepcopy(data['initial_data']['lb_p_rural'][i])
-                        data['ub_p_rural'][i] = copy.deepcopy(data['initial_data']['ub_p_rural'][i])
-
-                # Update utility bounds and preprocess choices
-                update_bounds.updateUtilityBoundsFixedRegulator(data)
-                choice_preprocess.choicePreprocess(data)
-
-                ##### Run the best response (BR) problem for the current optimizer
-                model = supplier_opt.getModel(data)
-                BR_results = supplier_opt.solveModel(data, model)
-                    
-                ##### Postprocess
+            if data['best_response_mode'] == 'Jacobi':
+                for k, BR_results in simultaneousBestResponses(data):
+                    updateFixedPrices(data, k, BR_results)
 
-                # Update the prices and profits (with smoothing)
-                for i in data['list_alt_supplier'][data['optimizer']]:
-                    data['p_urban_fixed'][i] = 0.5 * data['p_urban_fixed'][i] + 0.5 * BR_results['prices_urban'][i]
-                    data['p_rural_fixed'][i] = 0.5 * data['p_rural_fixed'][i] + 0.5 * BR_results['prices_rural'][i]
+            else:
+                for k in range(1, data['K'] + 1):
+                    data['optimizer'] = (data['optimizer'] % data['K']) + 1
+                    BR_results = supplierBestResponse(data)
+                    updateFixedPrices(data, data['optimizer'], BR_results)
 
         ##### (2) The regulator updates its policies
         
@@ -323,6 +385,7 @@ if __name__ == '__main__':
 
     # Define parameters of the algorithm
     data_file.setAlgorithmParameters(data)
+    timing.configure(data)
 
     #Read instance
     data_file.getData(data)
@@ -4,6 +4,7 @@ import numpy as np
 import math
 
 import nested_logit
+import draw_store
 
 # Data
 import data_intercity_nested_logit
@@ -24,6 +25,11 @@ def setAlgorithmParameters(dict):
     # Number of draws
     dict['R'] = 50
 
+    # Directory of the draw store (random tensors generated once and shared as read-only memory maps, None: no store)
+    dict['draw_store'] = None
+    # Seed of the draws of the store (None: seed of the instance, dict['Seed'])
+    dict['draw_store_seed'] = None
+
     # Number of equilibria
     dict['nEquilibria'] = 1
 
@@ -34,9 +40,20 @@ def setAlgorithmParameters(dict):
     # Max iter
     dict['max_iter'] = 20                          #Modify here for testing (ideally >= 100)
     dict['max_iter_smoothing'] = 2
+    # Best responses of the smoothing procedure one supplier at a time ('GaussSeidel') or simultaneously ('Jacobi')
+    dict['best_response_mode'] = 'GaussSeidel'
+    # Weight of the previous prices in the smoothing of the best responses (0: no smoothing)
+    dict['best_response_damping'] = 0.5
+    # Number of processes solving the best-response problems in parallel (Jacobi mode)
+    dict['n_workers_best_response'] = 1
     # Tolerance to identify identical solutions
     dict['tolerance'] = 0.10
 
+    #### Phase timing (wall time, CPU time, model size and solver status of each phase, summary printed at exit)
+
+    # JSON-lines file of the timing events (None: summary only)
+    dict['timing_file'] = None
+
     #### Parameters of the choice-based optimization model
 
     dict['lb_profit'] = None
@@ -60,6 +77,7 @@ def getData(dict):
 
     # Set random seed
     np.random.seed(dict['Seed'])
+    draw_store.setSeed(dict, dict['Seed'])
 
     # 1) Read discrete choice model parameters
     # 2) Read supply data
@@ -71,7 +89,7 @@ def getData(dict):
     data_intercity_nested_logit.regulator(dict)
 
     # Random term (Gumbel distributed 0,1)
-    dict['xi'] = np.random.gumbel(size=(dict['I_tot'], dict['N'], dict['R']))
+    dict['xi'] = draw_store.draws(dict, 'xi', (dict['I_tot'], dict['N'], dict['R']), lambda rng: rng.gumbel(size=(dict['I_tot'], dict['N'], dict['R'])))
 
 
     ##########################################################
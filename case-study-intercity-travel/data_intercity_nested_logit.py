@@ -3,6 +3,7 @@ import copy
 import numpy as np
 
 import nested_logit
+import draw_store
 
 # Data
 import data_intercity as data_file
@@ -389,11 +390,14 @@ def arrival_times(data):
     # DESIRED ARRIVAL TIMES
 
     # Between 9:00 (=540) and 12:00 (=720) differentiated by travel purpose
+    # Uniform draws of the time slot and of the arrival time within the slot
+    uniforms = draw_store.draws(data, 'arrival_times', (2, data['N'], data['R']), lambda rng: rng.random_sample((2, data['N'], data['R'])))
+
     data['DAT'] = np.zeros((data['N'],data['R']))
-    data['slot'] = np.random.random_sample((data['N'],data['R']))
+    data['slot'] = uniforms[0]
     for n in range(data['N']):
         for r in range(data['R']):
-            rand = np.random.random_sample()
+            rand = uniforms[1, n, r]
             if data['BUSINESS'][n] == 1:            # GROUP 1: BUSINESS CUSTOMERS
                 if data['slot'][n,r] < 0.50:        # 09:00-10:00: 50% of arrivals
                     data['DAT'][n,r] = 9 * 60 + rand*60
@@ -409,12 +413,12 @@ def arrival_times(data):
     data['ACCESS'] = np.zeros((data['I_tot'], data['N'], data['R']))
     data['EGRESS'] = np.zeros((data['I_tot'], data['N'], data['R']))
 
+    # Uniform draws of the access and egress times to/from train stations and airports
+    uniforms = draw_store.draws(data, 'access_egress_times', (data['N'], data['R'], 4), lambda rng: rng.random_sample((data['N'], data['R'], 4)))
+
     for n in range(data['N']):
         for r in range(data['R']):
-            r_acc_TrainStation = np.random.random_sample()
-            r_egr_TrainStation = np.random.random_sample()
-            r_acc_Airport = np.random.random_sample()
-            r_egr_Airport = np.random.random_sample()
+            r_acc_TrainStation, r_egr_TrainStation, r_acc_Airport, r_egr_Airport = uniforms[n, r]
             for i in range(data['I_tot']):
                 if data['alternatives'][i]['Mode'] == 'Car':  # No access/egress times for cars
                     data['ACCESS'][i,n,r] = 0
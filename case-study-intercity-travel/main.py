@@ -22,6 +22,7 @@ import time
 # Models
 import algorithm_regulation
 import nested_logit
+import timing
 
 # Data
 import data_intercity as data_file
@@ -33,6 +34,7 @@ if __name__ == '__main__':
 
     # Define parameters of the algorithm
     data_file.setAlgorithmParameters(data)
+    timing.configure(data)
 
     data['Seed'] = 0
 
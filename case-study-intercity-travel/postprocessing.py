@@ -1,11 +1,11 @@
 # Code for the ex-post analysis (segmentation, market shares, etc.)
 
 # General
-import copy
 import numpy as np
 
 # Functions
 import nested_logit
+import timing
 
 # Data
 import data_intercity as data_file
@@ -109,94 +109,65 @@ def printOutputAnalysis(data):
     print('COST OF EMISSIONS:    {:9.2f}  eur'.format(data['output']['cost_emissions']))
 
 
+def simulateChoices(U, drawShare):
+    '''
+    Choices of the customers for the utilities U[i,n,r], for all the customers and draws at once:
+    choice indicators w[i,n,r], expected maximum utilities EMU[n] (averaged over the draws) and
+    choice probabilities P[i,n], where drawShare[n,r] is the share of draw r in the probabilities of customer n
+    '''
+
+    choice = np.argmax(U, axis=0)
+
+    w = np.zeros(U.shape)
+    np.put_along_axis(w, choice[None], 1.0, axis=0)
+
+    EMU = np.sum(np.take_along_axis(U, choice[None], axis=0)[0], axis=1) / U.shape[2]
+    P = np.einsum('inr,nr->in', w, drawShare)
+
+    return w, EMU, P
+
+
+@timing.timed('postprocess')
 def calculation(data):
 
-    price_urban = copy.deepcopy(data['p_urban_fixed'])
-    price_rural = copy.deepcopy(data['p_rural_fixed'])
-    taxsubsidy_high = copy.deepcopy(data['fixed_taxsubsidy_highinc'])
-    taxsubsidy_low = copy.deepcopy(data['fixed_taxsubsidy_lowinc'])
+    price_urban = np.array(data['p_urban_fixed'], dtype=float)
+    price_rural = np.array(data['p_rural_fixed'], dtype=float)
+    taxsubsidy_high = np.array(data['fixed_taxsubsidy_highinc'], dtype=float)
+    taxsubsidy_low = np.array(data['fixed_taxsubsidy_lowinc'], dtype=float)
+    popN = np.asarray(data['popN'], dtype=float)
+
+    # Customers of each group
+    groups = {'high': np.asarray(data['INCOME']) == 1,
+              'low': np.asarray(data['INCOME']) == 0,
+              'urban': np.asarray(data['ORIGIN']) == 1,
+              'rural': np.asarray(data['ORIGIN']) == 0,
+              'business': np.asarray(data['BUSINESS']) == 1,
+              'nonbusiness': np.asarray(data['BUSINESS']) == 0}
 
     data['output'] = {}
-    data['output']['U'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['EMU'] = np.zeros([data['N']])
-    data['output']['w'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['P'] = np.zeros([data['I_tot'], data['N']])
-    data['output']['profit'] = np.zeros([data['K']+1])
-    data['output']['demand'] = np.zeros([data['I_tot']])
-    data['output']['demand_high'] = np.zeros([data['I_tot']])
-    data['output']['demand_low'] = np.zeros([data['I_tot']])
-    data['output']['demand_urban'] = np.zeros([data['I_tot']])
-    data['output']['demand_rural'] = np.zeros([data['I_tot']])
-    data['output']['demand_business'] = np.zeros([data['I_tot']])
-    data['output']['demand_nonbusiness'] = np.zeros([data['I_tot']])
-    data['output']['market_share'] = np.zeros([data['I_tot']])
-    data['output']['market_share_high'] = np.zeros([data['I_tot']])
-    data['output']['market_share_low'] = np.zeros([data['I_tot']])
-    data['output']['market_share_urban'] = np.zeros([data['I_tot']])
-    data['output']['market_share_rural'] = np.zeros([data['I_tot']])
-    data['output']['market_share_business'] = np.zeros([data['I_tot']])
-    data['output']['market_share_nonbusiness'] = np.zeros([data['I_tot']])
-
-    # Calculate utilities and choices
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-                if data['INCOME'][n] == 1 and data['ORIGIN'][n] == 1:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n] * (price_urban[i] + taxsubsidy_high[i]) +\
-                                                 data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i,n,r]
-                elif data['INCOME'][n] == 1 and data['ORIGIN'][n] == 0:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n] * (price_rural[i] + taxsubsidy_high[i]) +\
-                                                 data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i,n,r]
-                elif data['INCOME'][n] == 0 and data['ORIGIN'][n] == 1:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n] * (price_urban[i] + taxsubsidy_low[i]) +\
-                                                 data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i,n,r]
-                elif data['INCOME'][n] == 0 and data['ORIGIN'][n] == 0:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n] * (price_rural[i] + taxsubsidy_low[i]) +\
-                                                 data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i,n,r]
-            i_UMax = np.argmax(data['output']['U'][:,n,r])
-            data['output']['EMU'][n] += data['output']['U'][i_UMax, n, r]/data['R']
-            data['output']['w'][i_UMax,n,r] = 1
-            data['output']['P'][i_UMax, n] += 1/data['R']
-    
+
+    # Calculate utilities and choices (urban or rural price, plus the tax or subsidy of the income class)
+    price = np.where(groups['urban'][None, :], price_urban[:, None], price_rural[:, None]) +\
+            np.where(groups['high'][None, :], taxsubsidy_high[:, None], taxsubsidy_low[:, None])
+    U = (data['endo_coef'] * price)[:, :, None] + data['exo_utility'] + data['Logsum'] + data['xi']
+    data['output']['U'] = U
+    data['output']['w'], data['output']['EMU'], data['output']['P'] =\
+        simulateChoices(U, np.full([data['N'], data['R']], 1/data['R']))
+
     # Calculate demand
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            data['output']['demand'][i] += data['output']['P'][i,n] * data['popN'][n]
-            if data['INCOME'][n] == 1:
-                data['output']['demand_high'][i] += data['output']['P'][i,n] * data['popN'][n]
-            elif data['INCOME'][n] == 0:
-                data['output']['demand_low'][i] += data['output']['P'][i,n] * data['popN'][n]
-            if data['ORIGIN'][n] == 1:
-                data['output']['demand_urban'][i] += data['output']['P'][i,n] * data['popN'][n]
-            elif data['ORIGIN'][n] == 0:
-                data['output']['demand_rural'][i] += data['output']['P'][i,n] * data['popN'][n]    
-            if data['BUSINESS'][n] == 1:
-                data['output']['demand_business'][i] += data['output']['P'][i,n] * data['popN'][n]
-            elif data['BUSINESS'][n] == 0:
-                data['output']['demand_nonbusiness'][i] += data['output']['P'][i,n] * data['popN'][n] 
+    data['output']['demand'] = data['output']['P'] @ popN
+    for group, customers in groups.items():
+        data['output']['demand_' + group] = data['output']['P'][:, customers] @ popN[customers]
 
     # Calculate market shares
-    popHI = int(sum([data['popN'][n] for n in range(data['N']) if data['INCOME'][n] == 1]))
-    popLI = int(sum([data['popN'][n] for n in range(data['N']) if data['INCOME'][n] == 0]))
-    popU = int(sum([data['popN'][n] for n in range(data['N']) if data['ORIGIN'][n] == 1]))
-    popR = int(sum([data['popN'][n] for n in range(data['N']) if data['ORIGIN'][n] == 0]))
-    popB = int(sum([data['popN'][n] for n in range(data['N']) if data['BUSINESS'][n] == 1]))
-    popN = int(sum([data['popN'][n] for n in range(data['N']) if data['BUSINESS'][n] == 0]))
-
     data['output']['market_share'] = data['output']['demand'] / data['Pop']
-    data['output']['market_share_high'] = data['output']['demand_high'] / popHI
-    data['output']['market_share_low'] = data['output']['demand_low'] / popLI
-    data['output']['market_share_urban'] = data['output']['demand_urban'] / popU
-    data['output']['market_share_rural'] = data['output']['demand_rural'] / popR
-    data['output']['market_share_business'] = data['output']['demand_business'] / popB
-    data['output']['market_share_nonbusiness'] = data['output']['demand_nonbusiness'] / popN
-    
+    for group, customers in groups.items():
+        data['output']['market_share_' + group] = data['output']['demand_' + group] / int(np.sum(popN[customers]))
+
     # Calculate profits
-    for k in range(data['K'] + 1):
-        for i in data['list_alt_supplier'][k]:
-            data['output']['profit'][k] +=\
-                (data['output']['demand_urban'][i] * price_urban[i] +
-                data['output']['demand_rural'][i] * price_rural[i])
+    data['output']['profit'] = np.zeros([data['K']+1])
+    np.add.at(data['output']['profit'], data['operator'],
+              data['output']['demand_urban'] * price_urban + data['output']['demand_rural'] * price_rural)
 
     # Calculate emissions and cost of emissions
     data['output']['emissions'] = 0
@@ -231,7 +202,6 @@ def segments(data):
     
     # Initialize population in each segment
     data['SEGMENT'] = np.zeros((data['N'],data['nSegments']))
-    data['popSegments'] = np.zeros((data['nSegments']))
 
     # Assign people to segments
     for n in range(data['N']):
@@ -263,8 +233,7 @@ def segments(data):
         if data['INCOME'][n] == 1 and data['ORIGIN'][n] == 1:
             data['SEGMENT'][n,11] = 1
 
-        for s in range(data['nSegments']):
-            data['popSegments'][s] += data['SEGMENT'][n][s] * data['popN'][n]
+    data['popSegments'] = data['SEGMENT'].T @ np.asarray(data['popN'], dtype=float)
 
     # Create list of people for each segment
     data['list_customer_segment'] = {}
@@ -272,12 +241,7 @@ def segments(data):
         data['list_customer_segment'][s] = [i for i, segment in enumerate(data['SEGMENT'][:,s]) if segment == s]
 
     # Calculate market shares for segments
-    data['SEGMENT_MARKET_SHARE'] = np.zeros((data['nSegments'], data['I_tot']))
-    for s in range(data['nSegments']):
-        for n in range(data['N']):
-            if data['SEGMENT'][n,s] == 1:
-                for i in range(data['I_tot']):
-                    data['SEGMENT_MARKET_SHARE'][s,i] += data['output']['P'][i,n] * data['popN'][n]
+    data['SEGMENT_MARKET_SHARE'] = data['SEGMENT'].T @ (data['output']['P'] * np.asarray(data['popN'], dtype=float)).T
 
     # Print market shares for segments
     print('\nMARKET SHARES PER SEGMENT  ', end=' ')
@@ -15,11 +15,13 @@ from cplex.exceptions import CplexSolverError
 import update_bounds
 import choice_preprocess
 import nested_logit
+import timing
 
 # Data
 import data_intercity as data_file
 
 
+@timing.timed('build')
 def getModel(data):
     '''
     Leader = regulator
@@ -758,16 +760,21 @@ def getModel(data):
     print('CPLEX model: all constraints added. N constraints: %r. Time: %r\n'
           % (model.linear_constraints.get_num(), round(time.time()-t_in, 2)))
 
+    timing.modelSize(model)
+
     return model
 
 
+@timing.timed('extract')
 def solveModel(data, model):
 
     try:
         model.set_results_stream(None)
         #model.set_warning_stream(None)
 
-        model.solve()
+        with timing.phase('solve', __name__):
+            model.solve()
+            timing.solverStatus(model)
 
         ### INITIALIZE DICTIONARY OF RESULTS
         results = {}
@@ -777,39 +784,41 @@ def solveModel(data, model):
         results['cust_prices_urban_low'] = np.full([data['I_tot']], -1.0)
         results['cust_prices_rural_high'] = np.full([data['I_tot']], -1.0)
         results['cust_prices_rural_low'] = np.full([data['I_tot']], -1.0)
-        results['taxsubsidy_highinc'] = np.full([data['I_tot']], -1.0)
-        results['taxsubsidy_lowinc'] = np.full([data['I_tot']], -1.0)
-        results['demand'] = np.empty(data['I_tot'])
-        results['demand_urban'] = np.empty(data['I_tot'])
-        results['demand_rural'] = np.empty(data['I_tot'])
         results['profit'] = np.full([data['K']+1], 0.0)
         results['modeshare'] = np.full([4], 0.0)
-        results['delta'] = np.zeros((data['I_tot'], data['N'],data['R']))
-        results['delta_pos'] = np.zeros((data['I_tot'], data['N'],data['R']))
-        results['delta_neg'] = np.zeros((data['I_tot'], data['N'],data['R']))
-        results['SWF_Budget'] = model.solution.get_values('SWF_Budget')
-        results['SWF_CostPublicFunds'] = model.solution.get_values('SWF_CostPublicFunds')
-        results['SWF_Emissions'] = model.solution.get_values('SWF_Emissions')
-        results['SWF_Utilities'] = model.solution.get_values('SWF_Utilities')
-        results['SWF_Utilities_high'] = model.solution.get_values('SWF_Utilities_high')
-        results['SWF_Utilities_low'] = model.solution.get_values('SWF_Utilities_low')
-        results['SWF_Profits'] = model.solution.get_values('SWF_Profits')
 
         ### SAVE RESULTS
-        
+
+        # Solution vector, extracted once
+        I, N, R = data['I_tot'], data['N'], data['R']
+        solution = np.array(model.solution.get_values())
+        alts = [str(i) for i in range(I)]
+
+        # Social welfare terms
+        SWF = ['SWF_Budget', 'SWF_CostPublicFunds', 'SWF_Emissions', 'SWF_Utilities',
+               'SWF_Utilities_high', 'SWF_Utilities_low', 'SWF_Profits']
+        for name, value in zip(SWF, solution[model.variables.get_indices(SWF)]):
+            results[name] = value
+
+        # Subsidies / taxes, demands
+        results['taxsubsidy_highinc'] = solution[model.variables.get_indices(['taxsubsidy_highincome[' + i + ']' for i in alts])]\
+                                        - np.asarray(data['ub_subsidy_highincome'], dtype=float)
+        results['taxsubsidy_lowinc'] = solution[model.variables.get_indices(['taxsubsidy_lowincome[' + i + ']' for i in alts])]\
+                                       - np.asarray(data['ub_subsidy_lowincome'], dtype=float)
+        results['demand'] = solution[model.variables.get_indices(['demand[' + i + ']' for i in alts])]
+        results['demand_urban'] = solution[model.variables.get_indices(['demand_urban[' + i + ']' for i in alts])]
+        results['demand_rural'] = solution[model.variables.get_indices(['demand_rural[' + i + ']' for i in alts])]
+
+        # Government expenses: delta, delta_pos and delta_neg are contiguous blocks in (i, n, r) order
+        first = model.variables.get_indices('delta[0][0][0]')
+        results['delta'], results['delta_pos'], results['delta_neg'] = solution[first:first + 3*I*N*R].reshape(3, I, N, R)
+
         for i in range(data['I_tot']):
-            # Subsidies / taxes
-            results['taxsubsidy_highinc'][i] = model.solution.get_values('taxsubsidy_highincome[' + str(i) + ']') - data['ub_subsidy_highincome'][i]
-            results['taxsubsidy_lowinc'][i] = model.solution.get_values('taxsubsidy_lowincome[' + str(i) + ']') - data['ub_subsidy_lowincome'][i]
             # Customer price
             results['cust_prices_urban_high'][i] = results['prices_urban'][i] + results['taxsubsidy_highinc'][i]
             results['cust_prices_urban_low'][i] = results['prices_urban'][i] + results['taxsubsidy_lowinc'][i]
             results['cust_prices_rural_high'][i] = results['prices_rural'][i] + results['taxsubsidy_highinc'][i]
             results['cust_prices_rural_low'][i] = results['prices_rural'][i] + results['taxsubsidy_lowinc'][i]
-            # Demands
-            results['demand'][i] = model.solution.get_values('demand[' + str(i) + ']')
-            results['demand_urban'][i] = model.solution.get_values('demand_urban[' + str(i) + ']')
-            results['demand_rural'][i] = model.solution.get_values('demand_rural[' + str(i) + ']')
 
         for i in range(data['I_tot']):
             # Profits
@@ -822,14 +831,6 @@ def solveModel(data, model):
                 results['modeshare'][1] += results['demand'][i] / data['Pop']
             elif data['alternatives'][i]['Mode'] == 'Car':
                 results['modeshare'][2] += results['demand'][i] / data['Pop']
-        
-        # Government expenses
-        for i in range(data['I_tot']):
-            for n in range(data['N']):
-                for r in range(data['R']):
-                    results['delta'][i,n,r] = model.solution.get_values('delta[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
-                    results['delta_pos'][i,n,r] = model.solution.get_values('delta_pos[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
-                    results['delta_neg'][i,n,r] = model.solution.get_values('delta_neg[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
 
         ### PRINT OBJ FUNCTION
         print('\nSOLUTION:\n\nPopulation                         : {:10.0f}'.format(data['Pop']))
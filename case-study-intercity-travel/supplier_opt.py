@@ -5,7 +5,6 @@
 
 # General
 import time
-import copy
 import numpy as np
 
 # CPLEX
@@ -16,11 +15,13 @@ from cplex.exceptions import CplexSolverError
 import update_bounds
 import choice_preprocess
 import nested_logit
+import timing
 
 # Data
 import data_intercity as data_file
 
 
+@timing.timed('build')
 def getModel(data):
 
     print('\nOPTIMIZER {:2d}'.format(data['optimizer']))
@@ -450,43 +451,45 @@ def getModel(data):
     print('CPLEX model: all constraints added. N constraints: %r. Time: %r\n'
           % (model.linear_constraints.get_num(), round(time.time()-t_in, 2)))
 
+    timing.modelSize(model)
+
     return model
 
 
+@timing.timed('extract')
 def solveModel(data, model):
 
     try:
         model.set_results_stream(None)
         #model.set_warning_stream(None)
 
-        model.solve()
+        with timing.phase('solve', __name__):
+            model.solve()
+            timing.solverStatus(model)
 
         ### INITIALIZE DICTIONARY OF RESULTS
         results = {}
-        results['prices_urban'] = copy.deepcopy(data['p_urban_fixed'])
-        results['prices_rural'] = copy.deepcopy(data['p_rural_fixed'])
         results['cust_prices_urban_high'] = np.full([data['I_tot']], -1.0)
         results['cust_prices_urban_low'] = np.full([data['I_tot']], -1.0)
         results['cust_prices_rural_high'] = np.full([data['I_tot']], -1.0)
         results['cust_prices_rural_low'] = np.full([data['I_tot']], -1.0)
         results['taxsubsidy_highinc'] = np.full([data['I_tot']], -1.0)
         results['taxsubsidy_lowinc'] = np.full([data['I_tot']], -1.0)
-        results['demand'] = np.empty(data['I_tot'])
-        results['demand_urban'] = np.empty(data['I_tot'])
-        results['demand_rural'] = np.empty(data['I_tot'])
         results['profit'] = np.full([data['K']+1], 0.0)
         results['modeshare'] = np.full([4], 0.0)
 
         ### SAVE RESULTS
-        for i in range(data['I_tot']):
-            
-            results['demand'][i] = model.solution.get_values('demand[' + str(i) + ']')
-            results['demand_urban'][i] = model.solution.get_values('demand_urban[' + str(i) + ']')
-            results['demand_rural'][i] = model.solution.get_values('demand_rural[' + str(i) + ']')
 
-            results['prices_urban'][i] = model.solution.get_values('p_urban[' + str(i) + ']')
-            results['prices_rural'][i] = model.solution.get_values('p_rural[' + str(i) + ']')
+        # Solution vector, extracted once
+        solution = np.array(model.solution.get_values())
+        alts = [str(i) for i in range(data['I_tot'])]
+        results['demand'] = solution[model.variables.get_indices(['demand[' + i + ']' for i in alts])]
+        results['demand_urban'] = solution[model.variables.get_indices(['demand_urban[' + i + ']' for i in alts])]
+        results['demand_rural'] = solution[model.variables.get_indices(['demand_rural[' + i + ']' for i in alts])]
+        results['prices_urban'] = solution[model.variables.get_indices(['p_urban[' + i + ']' for i in alts])]
+        results['prices_rural'] = solution[model.variables.get_indices(['p_rural[' + i + ']' for i in alts])]
 
+        for i in range(data['I_tot']):
             results['taxsubsidy_highinc'][i] = data['fixed_taxsubsidy_highinc'][i]
             results['taxsubsidy_lowinc'][i] = data['fixed_taxsubsidy_lowinc'][i]
             results['cust_prices_urban_high'][i] = results['prices_urban'][i] + results['taxsubsidy_highinc'][i]
@@ -5,164 +5,126 @@ import numpy as np
 
 # Project
 import nested_logit
+import timing
 
 # Data
 import data_intercity as data_file
 
 
-def updateUtilityBoundsWithRegulator(data):
-
-    # Utility bounds
-    lb_U = np.empty([data['I_tot'], data['N'], data['R']])
-    ub_U = np.empty([data['I_tot'], data['N'], data['R']])
-    lb_Umin = np.full((data['N'], data['R']), np.inf)
-    ub_Umax = np.full((data['N'], data['R']), -np.inf)
-
-    M = np.empty([data['N'], data['R']])
-
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-                if data['DCM'] == 'NestedLogit':
-                    if data['endo_coef'][i, n] <= 0: #This is always the case when prices are the only endogenous variables
-                        if data['INCOME'][n] == 1:      #High income
-                            if data['ORIGIN'][n] == 1: 
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_urban'][i] + data['ub_tax_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_urban'][i] - data['ub_subsidy_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                            elif data['ORIGIN'][n] == 0:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_rural'][i] + data['ub_tax_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_rural'][i] - data['ub_subsidy_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                        elif data['INCOME'][n] == 0:    #Low income
-                            if data['ORIGIN'][n] == 1:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_urban'][i] + data['ub_tax_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_urban'][i] - data['ub_subsidy_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                            elif data['ORIGIN'][n] == 0:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_rural'][i] + data['ub_tax_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_rural'][i] - data['ub_subsidy_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-            # Bounds for each customer, for each draw
-            lb_Umin[n, r] = np.min(lb_U[:, n, r])
-            ub_Umax[n, r] = np.max(ub_U[:, n, r])
-
-            # Calcule the big-M values
-            M[n, r] = ub_Umax[n, r] - lb_Umin[n, r]
+def segmentValues(data, high_urban, high_rural, low_urban, low_rural):
+    '''Values per alternative (I_tot,) mapped to every customer (I_tot, N) according to income and origin'''
+
+    high = (np.asarray(data['INCOME']) == 1)[None, :]
+    urban = (np.asarray(data['ORIGIN']) == 1)[None, :]
+
+    def column(values):
+        return np.asarray(values, dtype=float)[:, None]
+
+    return np.where(high,
+                    np.where(urban, column(high_urban), column(high_rural)),
+                    np.where(urban, column(low_urban), column(low_rural)))
+
+
+def updateUtilityBoundsPrices(data, p_high, p_low, incremental=False):
+    '''
+    Utility bounds given the highest (p_high) and lowest (p_low) prices, including
+    taxes and subsidies, that each customer (I_tot, N) can face for each alternative.
+    If incremental is True, only the alternatives whose prices changed since the
+    previous call are recomputed.
+    '''
+
+    shape = (data['I_tot'], data['N'], data['R'])
+    exo_terms = (data['exo_utility'], data['endo_coef'], data['Logsum'], data['xi'])
+    cache = data.get('utility_bounds_cache')
+
+    # The previous bounds can be reused only if the exogenous terms
+    # (including the logsum terms of the nested logit) are unchanged
+    if (incremental and cache is not None and
+        all(a is b for a, b in zip(cache['exo_terms'], exo_terms)) and
+        data['lb_U'].shape == shape):
+        alts = np.flatnonzero(np.any((p_high != cache['p_high']) | (p_low != cache['p_low']), axis=1))
+        lb_U = data['lb_U'].copy()
+        ub_U = data['ub_U'].copy()
+    else:
+        alts = np.arange(data['I_tot'])
+        lb_U = np.empty(shape)
+        ub_U = np.empty(shape)
+
+    if len(alts) > 0:
+        if data['DCM'] != 'NestedLogit':
+            raise Exception('\nERROR! Utility bounds are only defined for the nested logit model!')
+        #This is always the case when prices are the only endogenous variables
+        if np.any(data['endo_coef'][alts] > 0):
+            raise Exception('\nERROR! Positive beta_cost coefficient!')
+        endo_coef = data['endo_coef'][alts][:, :, None]
+        exo = data['exo_utility'][alts] + data['Logsum'][alts] + data['xi'][alts]
+        lb_U[alts] = endo_coef * p_high[alts][:, :, None] + exo
+        ub_U[alts] = endo_coef * p_low[alts][:, :, None] + exo
+
+    data['utility_bounds_cache'] = {'p_high': p_high, 'p_low': p_low, 'exo_terms': exo_terms}
+
+    # Bounds for each customer, for each draw
+    lb_Umin = np.min(lb_U, axis=0)
+    ub_Umax = np.max(ub_U, axis=0)
 
     data['lb_U'] = lb_U
     data['ub_U'] = ub_U
     data['lb_Umin'] = lb_Umin
     data['ub_Umax'] = ub_Umax
-    data['M_U'] = M
+    # Calcule the big-M values
+    data['M_U'] = ub_Umax - lb_Umin
 
 
-def updateUtilityBoundsFixedPrice(data):
-    
-    # Utility bounds
-    lb_U = np.empty([data['I_tot'], data['N'], data['R']])
-    ub_U = np.empty([data['I_tot'], data['N'], data['R']])
-    lb_Umin = np.full((data['N'], data['R']), np.inf)
-    ub_Umax = np.full((data['N'], data['R']), -np.inf)
-
-    M = np.empty([data['N'], data['R']])
-
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-                if data['DCM'] == 'NestedLogit':
-                    if data['endo_coef'][i, n] <= 0: #This is always the case when prices are the only endogenous variables
-                        if data['INCOME'][n] == 1:      #High income
-                            if data['ORIGIN'][n] == 1:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_urban_fixed'][i] + data['ub_tax_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_urban_fixed'][i] - data['ub_subsidy_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                            elif data['ORIGIN'][n] == 0:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_rural_fixed'][i] + data['ub_tax_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_rural_fixed'][i] - data['ub_subsidy_highincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                        elif data['INCOME'][n] == 0:    #Low income
-                            if data['ORIGIN'][n] == 1:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_urban_fixed'][i] + data['ub_tax_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_urban_fixed'][i] - data['ub_subsidy_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                            elif data['ORIGIN'][n] == 0:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_rural_fixed'][i] + data['ub_tax_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['p_rural_fixed'][i] - data['ub_subsidy_lowincome'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-
-            # Bounds for each customer, for each draw
-            lb_Umin[n, r] = np.min(lb_U[:, n, r])
-            ub_Umax[n, r] = np.max(ub_U[:, n, r])
-
-            # Calcule the big-M values
-            M[n, r] = ub_Umax[n, r] - lb_Umin[n, r]
+@timing.timed('bounds')
+def updateUtilityBoundsWithRegulator(data, incremental=False):
 
-    data['lb_U'] = lb_U
-    data['ub_U'] = ub_U
-    data['lb_Umin'] = lb_Umin
-    data['ub_Umax'] = ub_Umax
-    data['M_U'] = M
+    lb_p_urban = np.asarray(data['lb_p_urban'], dtype=float)
+    ub_p_urban = np.asarray(data['ub_p_urban'], dtype=float)
+    lb_p_rural = np.asarray(data['lb_p_rural'], dtype=float)
+    ub_p_rural = np.asarray(data['ub_p_rural'], dtype=float)
 
+    p_high = segmentValues(data,
+        ub_p_urban + data['ub_tax_highincome'], ub_p_rural + data['ub_tax_highincome'],
+        ub_p_urban + data['ub_tax_lowincome'], ub_p_rural + data['ub_tax_lowincome'])
+    p_low = segmentValues(data,
+        lb_p_urban - data['ub_subsidy_highincome'], lb_p_rural - data['ub_subsidy_highincome'],
+        lb_p_urban - data['ub_subsidy_lowincome'], lb_p_rural - data['ub_subsidy_lowincome'])
 
-def updateUtilityBoundsFixedRegulator(data):
-    
-    # Utility bounds
-    lb_U = np.empty([data['I_tot'], data['N'], data['R']])
-    ub_U = np.empty([data['I_tot'], data['N'], data['R']])
-    lb_Umin = np.full((data['N'], data['R']), np.inf)
-    ub_Umax = np.full((data['N'], data['R']), -np.inf)
-
-    M = np.empty([data['N'], data['R']])
-
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-                if data['DCM'] == 'NestedLogit':
-                    if data['endo_coef'][i, n] <= 0: #This is always the case when prices are the only endogenous variables
-                        if data['INCOME'][n] == 1:  # High income
-                            if data['ORIGIN'][n] == 1:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_urban'][i] + data['fixed_taxsubsidy_highinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_urban'][i] + data['fixed_taxsubsidy_highinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                            elif data['ORIGIN'][n] == 0:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_rural'][i] + data['fixed_taxsubsidy_highinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_rural'][i] + data['fixed_taxsubsidy_highinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                        elif data['INCOME'][n] == 0:    #Low income
-                            if data['ORIGIN'][n] == 1:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_urban'][i] + data['fixed_taxsubsidy_lowinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_urban'][i] + data['fixed_taxsubsidy_lowinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                            elif data['ORIGIN'][n] == 0:
-                                lb_U[i, n, r] = (data['endo_coef'][i, n] * (data['ub_p_rural'][i] + data['fixed_taxsubsidy_lowinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-                                ub_U[i, n, r] = (data['endo_coef'][i, n] * (data['lb_p_rural'][i] + data['fixed_taxsubsidy_lowinc'][i]) +
-                                                data['exo_utility'][i,n,r] + data['Logsum'][i,n,r] + data['xi'][i, n, r])
-
-            # Bounds for each customer, for each draw
-            lb_Umin[n, r] = np.min(lb_U[:, n, r])
-            ub_Umax[n, r] = np.max(ub_U[:, n, r])
-
-            # Calcule the big-M values
-            M[n, r] = ub_Umax[n, r] - lb_Umin[n, r]
+    updateUtilityBoundsPrices(data, p_high, p_low, incremental)
 
-    data['lb_U'] = lb_U
-    data['ub_U'] = ub_U
-    data['lb_Umin'] = lb_Umin
-    data['ub_Umax'] = ub_Umax
-    data['M_U'] = M
+
+@timing.timed('bounds')
+def updateUtilityBoundsFixedPrice(data, incremental=False):
+
+    p_urban = np.asarray(data['p_urban_fixed'], dtype=float)
+    p_rural = np.asarray(data['p_rural_fixed'], dtype=float)
+
+    p_high = segmentValues(data,
+        p_urban + data['ub_tax_highincome'], p_rural + data['ub_tax_highincome'],
+        p_urban + data['ub_tax_lowincome'], p_rural + data['ub_tax_lowincome'])
+    p_low = segmentValues(data,
+        p_urban - data['ub_subsidy_highincome'], p_rural - data['ub_subsidy_highincome'],
+        p_urban - data['ub_subsidy_lowincome'], p_rural - data['ub_subsidy_lowincome'])
+
+    updateUtilityBoundsPrices(data, p_high, p_low, incremental)
+
+
+@timing.timed('bounds')
+def updateUtilityBoundsFixedRegulator(data, incremental=False):
+
+    lb_p_urban = np.asarray(data['lb_p_urban'], dtype=float)
+    ub_p_urban = np.asarray(data['ub_p_urban'], dtype=float)
+    lb_p_rural = np.asarray(data['lb_p_rural'], dtype=float)
+    ub_p_rural = np.asarray(data['ub_p_rural'], dtype=float)
+
+    p_high = segmentValues(data,
+        ub_p_urban + data['fixed_taxsubsidy_highinc'], ub_p_rural + data['fixed_taxsubsidy_highinc'],
+        ub_p_urban + data['fixed_taxsubsidy_lowinc'], ub_p_rural + data['fixed_taxsubsidy_lowinc'])
+    p_low = segmentValues(data,
+        lb_p_urban + data['fixed_taxsubsidy_highinc'], lb_p_rural + data['fixed_taxsubsidy_highinc'],
+        lb_p_urban + data['fixed_taxsubsidy_lowinc'], lb_p_rural + data['fixed_taxsubsidy_lowinc'])
+
+    updateUtilityBoundsPrices(data, p_high, p_low, incremental)
 
 
 if __name__ == '__main__':
@@ -29,6 +29,8 @@ def updateStrategySets(data, BRinSet):
             data['n_strategies'][k] += 1
 
             data['strategies']['optimizer'].append(k)
+            data['strategies']['id'].append(data['strategies']['next_id'])
+            data['strategies']['next_id'] += 1
             for i in range(data['I_tot']):
                 if data['operator'][i] == k:
                     data['strategies']['prices'][i].append(data['best_response_prices'][i])
@@ -49,6 +51,7 @@ def updateStrategySets(data, BRinSet):
             for i in range(data['I_tot']):
                 data['strategies']['prices'][i].pop(index)
             data['strategies']['optimizer'].pop(index)
+            data['strategies']['id'].pop(index)
         
         else:
             if data['n_strategies'][k] == data['max_strategies']:
@@ -80,6 +83,7 @@ def updateStrategySets(data, BRinSet):
             for i in range(data['I_tot']):
                 data['strategies']['prices'][i].pop(index)
             data['strategies']['optimizer'].pop(index)
+            data['strategies']['id'].pop(index)
 
         # Update the list of strategies in the restricted sets
         updateListStrategies(data)
@@ -110,6 +114,10 @@ def generateStrategySets(data):
                 else:
                     data['strategies']['prices'][i].append(-1.0)
 
+    # Identifiers of the strategies, which do not change when other strategies are added or removed
+    data['strategies']['id'] = list(range(len(data['strategies']['optimizer'])))
+    data['strategies']['next_id'] = len(data['strategies']['optimizer'])
+
     updateListStrategies(data)
 
 
@@ -14,9 +14,13 @@ Transportation Res. Part A Policy Practice 70:41-49.
 '''
 
 # General
+import io
 import sys
 import time
 import copy
+import contextlib
+import concurrent.futures
+import multiprocessing
 import math
 import random
 import numpy as np
@@ -25,11 +29,14 @@ import numpy as np
 import supply_opt
 import fixed_point_iteration_algorithm
 import fixed_point_MIP
+import payoff_tensor
 
 import generate_strategies
 import update_bounds
 import choice_preprocess
 import postprocessing
+import checkpoint
+import timing
 
 # Data
 import data_parking as data_file
@@ -105,7 +112,7 @@ def newRegionSolutionSpace(data):
         data['initial_data']['ub_p']  = lb
 
 
-def NewInitialSolution(data):
+def newInitialSolution(data):
 
     data['strategies'] = {}
     data['n_strategies'] = copy.deepcopy(data['initial_data']['n_strategies'])
@@ -124,12 +131,140 @@ def NewInitialSolution(data):
               .format(i, data['initial_data']['lb_p'][i], data['initial_data']['ub_p'][i], data['p_fixed'][i]))
 
 
-def columnGenerationMethod(data):
+def bestResponseProblem(data, k):
+    '''
+    Best-response problem of operator k, with all other prices fixed at data['p_fixed'].
+    Modifies data (optimizer, price bounds, preprocessed choices).
+    '''
+
+    data['optimizer'] = k
+
+    # Set price bounds to either initial bounds (optimizer) or prices of the subgame equilibrium
+    for i in range(data['I_opt_out'], data['I_tot']):
+        if data['operator'][i] == k:
+            data['lb_p'][i] = copy.deepcopy(data['best_response_lb_p'][i])
+            data['ub_p'][i] = copy.deepcopy(data['best_response_ub_p'][i])
+        else:
+            data['lb_p'][i] = copy.deepcopy(data['p_fixed'][i])
+            data['ub_p'][i] = copy.deepcopy(data['p_fixed'][i])
+
+    update_bounds.updateUtilityBounds(data)
+    choice_preprocess.choicePreprocess(data)
+
+    # Solve the best response problem (only a profitable deviation is needed in oracle mode)
+    results = supply_opt.solveBestResponse(data, oracle=data['best_response_oracle'])
+
+    # The oracle stopped at a limit without proving that there is no profitable deviation: solve to optimality
+    if data['best_response_oracle'] and not results['certified']:
+        print('\nOPTIMIZER {:2d}: oracle not certified, best response solved to optimality'.format(k))
+        results = supply_opt.solveBestResponse(data)
+
+    return results
+
+
+def bestResponseWorker(snapshot, k, lb_profit, threads):
+    '''
+    Solve the best-response problem of operator k on a worker's own copy of data, with its profit
+    at the subgame equilibrium lb_profit and threads CPLEX threads, capturing its output and timing
+    '''
+
+    snapshot['lb_profit'] = lb_profit
+    snapshot['cplex_threads'] = threads
+    timing.resetSummary()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        results = bestResponseProblem(snapshot, k)
+
+    return results, log.getvalue(), timing.workerSummary()
+
+
+def bestResponseProblems(data, FP_results):
+    '''
+    Best-response problems of all operators at the subgame equilibrium data['p_fixed'].
+    The K problems are independent: with n_workers_best_response > 1 they are solved
+    in a process pool, each worker on its own copy of data (pickled by the executor), and the output
+    is printed in the order of the operators. With cplex_threads = 0 (automatic) the cores are shared
+    among the workers. Returns the list of (k, results).
+    '''
+
+    BR_list = []
+
+    if data['n_workers_best_response'] <= 1:
+        for k in range(1, data['K'] + 1):
+            data['lb_profit'] = FP_results['max_profit_in'][k]
+            BR_list.append((k, bestResponseProblem(data, k)))
+        return BR_list
+
+    workers = min(data['n_workers_best_response'], data['K'])
+    threads = supply_opt.workerThreads(data, workers)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for k in range(1, data['K'] + 1):
+            futures[k] = pool.submit(bestResponseWorker, data, k, FP_results['max_profit_in'][k], threads)
+
+        for k in range(1, data['K'] + 1):
+            results, log, timings = futures[k].result()
+            print(log, end='')
+            timing.mergeSummary(timings)
+            BR_list.append((k, results))
+
+    return BR_list
+
+
+def verifySubgameEquilibrium(data, FP_results):
+    '''
+    Check a subgame equilibrium on the original game by solving the best-response problems
+    of all operators. Returns the best-response results and the relative profit differences.
+    '''
+
+    ### Save results of fixed-point MIP
+    data['p_fixed'] = copy.deepcopy(FP_results['prices_in'])
+
+    BR_results = {}
+    BR_results['prices'] = copy.deepcopy(FP_results['prices_in'])
+    BR_results['profits'] = copy.deepcopy(FP_results['max_profit_in'])
+
+    ### Launch a best-response problem for each operator
+    print('\nBEST RESPONSE PROBLEMS:')
+    for k, results in bestResponseProblems(data, FP_results):
+
+        # Update prices and profits after the Stackelberg games
+        BR_results['profits'][k] = results['profits'][k]
+        for i in data['list_alt_supplier'][k]:
+            BR_results['prices'][i] = results['prices'][i]
+
+    ### Verify price differences (absolute and in %)
+    price_diff = [abs(BR_results['prices'][i] - FP_results['prices_in'][i]) for i in range(data['I_tot'])]
+    price_perc = np.zeros([data['I_tot']])
+    for i in range(data['I_opt_out'], data['I_tot']):
+        price_perc[i] = price_diff[i] / FP_results['prices_in'][i]
+    FP_results['eps_price'] = np.max(price_perc)
+    ### Verify profit differences (absolute and in %)
+    profit_diff = [BR_results['profits'][k] - FP_results['max_profit_in'][k] for k in range(data['K'] + 1)]
+    profit_perc = np.zeros([data['K'] + 1])
+    for k in range(1, data['K'] + 1):
+        profit_perc[k] = profit_diff[k] / FP_results['max_profit_in'][k]
+    FP_results['eps_profit'] = np.max(profit_perc)
+
+    ### Print prices and profits in the fixed-point MIP (FP) and in the best response problems (BR)
+    print('\n Alt     PriceFP     PriceBR')
+    for i in range(data['I_opt_out'], data['I_tot']):
+        print('  {:2d}    {:8.3f}    {:8.3f}'.format(i, FP_results['prices_in'][i], BR_results['prices'][i]))
+    print('\nSupp     ProfitFP   ProfitBR    epsilon')
+    for k in range(1, data['K'] + 1):
+        print('  {:2d}    {:9.3f}  {:9.3f}    {:7.4f}'.format(k, FP_results['max_profit_in'][k], BR_results['profits'][k], profit_perc[k]))
+
+    return BR_results, profit_perc
+
+
+def columnGenerationMethod(data, state=None):
     ''' 
         Use the fixed-point MIP model to find a subgame equilibrium.
         Check the solution on the original game by solving best-response problems.
         If not all eps-equilibrium conditions are satisfied,
         best-response strategies are added to the strategy sets.
+        With the state of a run, the iterations are checkpointed and resumed.
     '''
 
     ### INITIALIZE VARIABLES FOR THE METHOD
@@ -137,6 +272,13 @@ def columnGenerationMethod(data):
     game_equilibrium = False
     hist_best_response = []
     hist_fixed_point = []
+    fixedPoint = None
+
+    # Resume the iterations of an interrupted run
+    if state is not None and state['column_generation'] is not None:
+        iter = state['column_generation']['iter']
+        hist_best_response = state['column_generation']['hist_best_response']
+        hist_fixed_point = state['column_generation']['hist_fixed_point']
 
     ### MAIN LOOP
     while game_equilibrium is False:
@@ -144,91 +286,73 @@ def columnGenerationMethod(data):
         # Identify captive customers for the current strategy sets
         update_bounds.updateUtilityBounds(data)
         choice_preprocess.choicePreprocess(data)
-        choice_preprocess.choicePreprocessStrategies(data)
-
-        ### Solve the fixed-point MIP model to find a subgame equilibrium
-        model, nameToIndex = fixed_point_MIP.getModel(data)
-        FP_results = fixed_point_MIP.solveModel(model, nameToIndex, data)
 
-        ### Save results of fixed-point MIP
-        data['p_fixed'] = copy.deepcopy(FP_results['prices_in'])
-        
-        BR_results = {}
-        BR_results['prices'] = copy.deepcopy(FP_results['prices_in'])
-        BR_results['profits'] = copy.deepcopy(FP_results['max_profit_in'])
-        
-        ### Launch a best-response problem for each operator
-        print('\nBEST RESPONSE PROBLEMS:')
-        for k in range(1, data['K'] + 1):
-
-            data['optimizer'] = k
-            data['lb_profit'] = FP_results['max_profit_in'][k]
-
-            # Set price bounds to either initial bounds (optimizer) or prices of the subgame equilibrium
-            for i in range(data['I_opt_out'], data['I_tot']):
-                if data['operator'][i] == k:
-                    data['lb_p'][i] = copy.deepcopy(data['best_response_lb_p'][i])
-                    data['ub_p'][i] = copy.deepcopy(data['best_response_ub_p'][i])
+        ### Find a subgame equilibrium: enumeration of the payoff tensor of the restricted game
+        ### if it is enabled and small enough, otherwise the fixed-point MIP model
+        if data['payoff_tensor'] and payoff_tensor.tensorSize(data) <= data['max_payoff_tensor_size']:
+            FP_results = payoff_tensor.solveRestrictedGame(data)
+            pool = []
+        else:
+            if data['incremental_fixed_point_MIP']:
+                fixedPoint, index = fixed_point_MIP.getIncrementalModel(data, fixedPoint)
+                model = fixedPoint['model']
+            else:
+                choice_preprocess.choicePreprocessStrategies(data)
+                model, index = fixed_point_MIP.getModel(data)
+            # Warm start from the previous subgame equilibrium
+            fixed_point_MIP.setStartingSolution(data, model, index)
+            FP_results = fixed_point_MIP.solveModel(model, index, data)
+            # Without a solution of the incremental model, solve the model built from scratch
+            if FP_results is None and data['incremental_fixed_point_MIP']:
+                print('\nBuild the fixed-point MIP model from scratch.')
+                fixedPoint = None
+                choice_preprocess.choicePreprocessStrategies(data)
+                model, index = fixed_point_MIP.getModel(data)
+                fixed_point_MIP.setStartingSolution(data, model, index)
+                FP_results = fixed_point_MIP.solveModel(model, index, data)
+            if FP_results is None:
+                print('\nNo subgame equilibrium of the restricted game. Restart algorithmic framework.\n\n')
+                return
+            # Other subgame equilibria of the solution pool, checked if the optimal one is not an equilibrium
+            pool = fixed_point_MIP.poolResults(model, index, data)
+
+        ### Check the optimal solution, then the other solutions of the pool until an equilibrium is found
+        checked = []
+        for FP_results in [FP_results] + pool:
+
+            BR_results, profit_perc = verifySubgameEquilibrium(data, FP_results)
+            checked.append((FP_results, BR_results))
+
+            # If profits satisfy the tolerance threshold, the solution is considered an epsilon-equilibrium
+            if all(k < data['eps_equilibrium_profit'] for k in profit_perc):
+                updateListEquilibriumColumnGeneration(data, FP_results)
+
+                print('\nProfit tolerance satisfied. Epsilon-equilibrium found.\nEps = {:7.4f}'.format(FP_results['eps_profit']))
+                '''
+                # Case (1): eps-equilibrium found + price tolerances satisfied => we restart the whole algorithm
+                if all(i < data['eps_equilibrium_price'] for i in price_perc) or len(data['equilibrium']['prices']) >= data['nEquilibria']:
+                    game_equilibrium = True
+                    print('\nPrice tolerance satisfied. Restart algorithmic framework.\n')
+                # Case (2): eps-equilibrium found + price tolerances not satisfied => we search other eps-equilibria with same restricted strategy sets
                 else:
-                    data['lb_p'][i] = copy.deepcopy(data['p_fixed'][i])
-                    data['ub_p'][i] = copy.deepcopy(data['p_fixed'][i])
-
-            update_bounds.updateUtilityBounds(data)
-            choice_preprocess.choicePreprocess(data)
-
-            # Solve the best response problem
-            model = supply_opt.getModel(data)
-            results = supply_opt.solveModel(data, model)
-
-            # Update prices and profits after the Stackelberg games
-            BR_results['profits'][k] = results['profits'][k]
-            for i in data['list_alt_supplier'][k]:
-                BR_results['prices'][i] = results['prices'][i]
-
-        ### Verify price differences (absolute and in %)
-        price_diff = [abs(BR_results['prices'][i] - FP_results['prices_in'][i]) for i in range(data['I_tot'])]
-        price_perc = np.zeros([data['I_tot']])
-        for i in range(data['I_opt_out'], data['I_tot']):
-            price_perc[i] = price_diff[i] / FP_results['prices_in'][i]
-        FP_results['eps_price'] = np.max(price_perc)
-        ### Verify profit differences (absolute and in %)
-        profit_diff = [BR_results['profits'][k] - FP_results['max_profit_in'][k] for k in range(data['K'] + 1)]
-        profit_perc = np.zeros([data['K'] + 1])
-        for k in range(1, data['K'] + 1):
-            profit_perc[k] = profit_diff[k] / FP_results['max_profit_in'][k]
-        FP_results['eps_profit'] = np.max(profit_perc)
-
-        ### Print prices and profits in the fixed-point MIP (FP) and in the best response problems (BR)
-        print('\n Alt     PriceFP     PriceBR')
-        for i in range(data['I_opt_out'], data['I_tot']):
-            print('  {:2d}    {:8.3f}    {:8.3f}'.format(i, FP_results['prices_in'][i], BR_results['prices'][i]))
-        print('\nSupp     ProfitFP   ProfitBR    epsilon')
-        for k in range(1, data['K'] + 1):
-            print('  {:2d}    {:9.3f}  {:9.3f}    {:7.4f}'.format(k, FP_results['max_profit_in'][k], BR_results['profits'][k], profit_perc[k]))
-
-        # If profits satisfy the tolerance threshold, the solution is considered an epsilon-equilibrium
-        if all(k < data['eps_equilibrium_profit'] for k in profit_perc):
-            updateListEquilibriumColumnGeneration(data, FP_results)
-
-            print('\nProfit tolerance satisfied. Epsilon-equilibrium found.\nEps = {:7.4f}'.format(FP_results['eps_profit']))
-            '''
-            # Case (1): eps-equilibrium found + price tolerances satisfied => we restart the whole algorithm
-            if all(i < data['eps_equilibrium_price'] for i in price_perc) or len(data['equilibrium']['prices']) >= data['nEquilibria']:
+                    print('\nPrice tolerance not satisfied. Add/remove strategies.')
+                '''
                 game_equilibrium = True
-                print('\nPrice tolerance satisfied. Restart algorithmic framework.\n')
-            # Case (2): eps-equilibrium found + price tolerances not satisfied => we search other eps-equilibria with same restricted strategy sets
+                print('\nRestart algorithmic framework.\n\n')
+            # Case (3): eps-equilibrium not found => we search for eps-equilibria with same restricted strategy sets
             else:
-                print('\nPrice tolerance not satisfied. Add/remove strategies.')
-            '''
-            game_equilibrium = True
-            print('\nRestart algorithmic framework.\n\n')
-        # Case (3): eps-equilibrium not found => we search for eps-equilibria with same restricted strategy sets
-        else:
-            print('\nProfit tolerance not satisfied. Add/remove strategies.')            
+                print('\nProfit tolerance not satisfied. Add/remove strategies.')            
+
+            if game_equilibrium is True:
+                break
 
         # If not, the algorithm continues
         if game_equilibrium is False:
 
+            # The strategy sets are updated with the best responses to the optimal solution
+            FP_results, BR_results = checked[0]
+            data['p_fixed'] = copy.deepcopy(FP_results['prices_in'])
+
             # Randomly choose to increase eps to increase chance of finding an eps-equilibrium
             if random.random() > 0.25:
                 data['eps_equilibrium_profit'] = 1.1*data['eps_equilibrium_profit']
@@ -261,29 +385,21 @@ def columnGenerationMethod(data):
 
             iter += 1
 
+            # Periodic checkpoint of the iterations
+            if state is not None:
+                state['column_generation'] = {'iter': iter, 'hist_best_response': hist_best_response, 'hist_fixed_point': hist_fixed_point}
+                checkpoint.saveCheckpoint(data, state, periodic=True)
 
-def main():
-        
-    t_0 = time.time()
-
-    #Fix seed for pseudorandom draws
-    seed = 10
-    np.random.seed(seed)
-
-    #Read instance and precompute exogenous terms
-    data = data_file.getData()
-    data_file.preprocessUtilities(data)
 
-    data_file.printCustomers(data)
+def runAlgorithm(data, title, state=None):
+    '''
+    Fixed-point iteration algorithm and column generation method from the current
+    initial solution (lines 4-17 of Algorithm 1). The eps-equilibria found are added to data['equilibrium'].
+    With the state of a run, checkpoints are saved and the phases already completed are skipped
+    '''
 
-    #Initialize the list of eps-equilibrium solutions (line 1 of Algorithm 1)
-    data['equilibrium'] = {'prices': [], 'profits': [], 'demand': [], 'eps_price': [], 'eps_profit': []}
-    
-    #Initial bounds to use when restarting exploration from different region (loop lines 2-18 of Algorithm 1)
-    data['initialLb'] = copy.deepcopy(data['initial_data']['lb_p'])
-    data['initialUb'] = copy.deepcopy(data['initial_data']['ub_p'])
+    if state is None or state['phase'] == 'FixedPointIteration':
 
-    while True:
         #Calculate utility bounds
         update_bounds.updateUtilityBounds(data)
         #Preprocess captive choices
@@ -293,7 +409,7 @@ def main():
         print('\n\nFIXED-POINT ITERATION ALGORITHM:')
 
         fixed_point_it_results = fixed_point_iteration_algorithm.fixedPointIterationAlg(data)
-        fixed_point_iteration_algorithm.plotGraphs('FixedPoint_Iteration_Algorithm', data, fixed_point_it_results)
+        fixed_point_iteration_algorithm.plotGraphs(title, data, fixed_point_it_results)
 
         t_1 = time.time()
 
@@ -304,26 +420,194 @@ def main():
 
         # SECOND PHASE: Fixed-point MIP + best response problem (lines 9-17 of Algorithm 1)
         elif fixed_point_it_results['cycle_type'] == 'CyclicEquilibrium':
-    
+
             restrictedStrategySets(data, fixed_point_it_results)        
             columnGenerationMethod(data)
         '''
         restrictedStrategySets(data, fixed_point_it_results)        
-        columnGenerationMethod(data)
 
-        # Stopping criterion (line 18 of Algorithm 1)
-        if len(data['equilibrium']['prices']) >= data['nEquilibria']:
-            break
-        
-        else:
-            seed += 1
+        # Checkpoint at the end of the first phase
+        if state is not None:
+            state['phase'] = 'ColumnGeneration'
+            state['column_generation'] = None
+            checkpoint.saveCheckpoint(data, state)
+
+    columnGenerationMethod(data, state)
+
+
+def registerEquilibria(data, registry, lock, state, restarts):
+    '''
+    Add the eps-equilibria of data['equilibrium'] to the registry shared by the workers of the multi-start
+    driver, unless an equilibrium with the same prices (within tolerance_equilibrium) is already registered.
+    The registry and the restarts of the workers are then checkpointed.
+    Returns the number of equilibria in the registry
+    '''
+
+    with lock:
+        for j in range(len(data['equilibrium']['prices'])):
+            prices = np.asarray(data['equilibrium']['prices'][j], dtype=float)
+            if all(np.max(np.abs(prices - np.asarray(eq['prices'], dtype=float))) >= data['tolerance_equilibrium'] for eq in registry):
+                registry.append({key: data['equilibrium'][key][j] for key in data['equilibrium']})
+
+        data['equilibrium'] = {key: [eq[key] for eq in registry] for key in data['equilibrium']}
+        state['phase'] = 'Finished' if len(registry) >= data['nEquilibria'] else 'FixedPointIteration'
+        state['multi_start_restarts'] = dict(restarts)
+        checkpoint.saveCheckpoint(data, state)
+
+        return len(registry)
+
+
+def multiStartRegion(data, w):
+    '''Initial price region of worker w: slice w of the initial price bounds, split in n_workers_multi_start slices'''
+
+    lb = np.asarray(data['initialLb'], dtype=float)
+    ub = np.asarray(data['initialUb'], dtype=float)
+
+    data['initial_data']['lb_p'] = lb + (ub - lb) * w / data['n_workers_multi_start']
+    data['initial_data']['ub_p'] = lb + (ub - lb) * (w + 1) / data['n_workers_multi_start']
+
+
+def multiStartWorker(data, w, registry, lock, stop, timings, state, restarts):
+    '''
+    Restarts of Algorithm 1 in worker w of the multi-start driver, until the shared registry
+    holds nEquilibria eps-equilibria. Each restart has its own seed (multi_start_seed, w, restart),
+    and restarts[w] counts the restarts of the worker, including those of the run resumed from.
+    The first restart explores the price region of the worker, the following ones a new region
+    with respect to all the registered equilibria (line 2 of Algorithm 1).
+    The output of the worker is written to its own log file, and its timing to timings[w] after each restart
+    '''
+
+    timing.resetSummary()
+
+    with open(data['multi_start_log'] % w, 'w', buffering=1) as log, contextlib.redirect_stdout(log):
+
+        first = restart = restarts.get(w, 0)
+        while not stop.is_set():
+
+            seed = np.random.SeedSequence([data['multi_start_seed'], w, restart]).generate_state(1)[0]
             np.random.seed(seed)
+            random.seed(int(seed))
+
+            # Equilibria found by all the workers
+            with lock:
+                data['equilibrium'] = {key: [eq[key] for eq in registry] for key in data['equilibrium']}
+
+            if restart == first or len(data['equilibrium']['prices']) == 0:
+                multiStartRegion(data, w)
+            else:
+                newRegionSolutionSpace(data)
+            newInitialSolution(data)
+
+            runAlgorithm(data, 'FixedPoint_Iteration_Algorithm_Worker_%d' % w)
+
+            timings[w] = timing.workerSummary()
+            restart += 1
+            restarts[w] = restart
+            if registerEquilibria(data, registry, lock, state, restarts) >= data['nEquilibria']:
+                stop.set()
+
+
+def multiStartMethod(data, state):
+    '''
+    Parallel multi-start driver: n_workers_multi_start processes run independent restarts of
+    Algorithm 1 (multiStartWorker) and share a registry of eps-equilibria, initialized with the
+    equilibria of data['equilibrium'] (those of the run resumed from). All the workers are
+    stopped as soon as the registry holds nEquilibria equilibria, which are saved in data['equilibrium']
+    '''
+
+    print('\n\nMULTI-START: {:d} workers, output in {:s}'.format(data['n_workers_multi_start'], data['multi_start_log'] % 0))
+
+    with multiprocessing.Manager() as manager:
+        registry = manager.list([{key: data['equilibrium'][key][j] for key in data['equilibrium']}
+                                 for j in range(len(data['equilibrium']['prices']))])
+        lock = manager.Lock()
+        stop = manager.Event()
+        timings = manager.dict()
+        restarts = manager.dict(state.get('multi_start_restarts', {}))
+
+        workers = [multiprocessing.Process(target=multiStartWorker, args=(data, w, registry, lock, stop, timings, state, restarts))
+                   for w in range(data['n_workers_multi_start'])]
+        for worker in workers:
+            worker.start()
+
+        # Wait for the target number of equilibria, unless all the workers have failed
+        while not stop.wait(1.0) and any(worker.is_alive() for worker in workers):
+            pass
+
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+        equilibria = list(registry)
+        state['multi_start_restarts'] = dict(restarts)
+        for workerTimings in timings.values():
+            timing.mergeSummary(workerTimings)
+
+    data['equilibrium'] = {key: [eq[key] for eq in equilibria] for key in data['equilibrium']}
+
+    if len(equilibria) >= data['nEquilibria']:
+        state['phase'] = 'Finished'
+    checkpoint.saveCheckpoint(data, state)
+
+
+def main():
+        
+    t_0 = time.time()
+
+    #Fix seed for pseudorandom draws
+    seed = 10
+    np.random.seed(seed)
+
+    #Read instance and precompute exogenous terms
+    data = data_file.getData()
+    timing.configure(data)
+    data_file.preprocessUtilities(data)
+
+    data_file.printCustomers(data)
+
+    if '--resume' in sys.argv[1:]:
+        #Continue an interrupted run from its last checkpoint
+        data, state = checkpoint.loadCheckpoint(data['checkpoint_file'])
+        seed = state['seed']
+
+    else:
+        #Initialize the list of eps-equilibrium solutions (line 1 of Algorithm 1)
+        data['equilibrium'] = {'prices': [], 'profits': [], 'demand': [], 'eps_price': [], 'eps_profit': []}
+
+        #Initial bounds to use when restarting exploration from different region (loop lines 2-18 of Algorithm 1)
+        data['initialLb'] = copy.deepcopy(data['initial_data']['lb_p'])
+        data['initialUb'] = copy.deepcopy(data['initial_data']['ub_p'])
+
+        state = {'seed': seed, 'phase': 'FixedPointIteration'}
+        checkpoint.saveCheckpoint(data, state)
+
+    # Restarts of Algorithm 1 in parallel worker processes
+    if data['n_workers_multi_start'] > 1:
+        if state['phase'] != 'Finished':
+            multiStartMethod(data, state)
+    else:
+        while state['phase'] != 'Finished':
+            runAlgorithm(data, 'FixedPoint_Iteration_Algorithm', state)
+
+            # Stopping criterion (line 18 of Algorithm 1)
+            if len(data['equilibrium']['prices']) >= data['nEquilibria']:
+                state = {'seed': seed, 'phase': 'Finished'}
+
+            else:
+                seed += 1
+                np.random.seed(seed)
+
+                # Identify a different region of the solution space (line 2 of Algorithm 1)
+                newRegionSolutionSpace(data)
+
+                # Restart the algorithm with random fixed prices and optimizer (line 3 of Algorithm 1)
+                newInitialSolution(data)
+
+                state = {'seed': seed, 'phase': 'FixedPointIteration'}
 
-            # Identify a different region of the solution space (line 2 of Algorithm 1)
-            newRegionSolutionSpace(data)
-            
-            # Restart the algorithm with random fixed prices and optimizer (line 3 of Algorithm 1)
-            newInitialSolution(data)   
+            # Checkpoint at the end of each restart
+            checkpoint.saveCheckpoint(data, state)
 
     ##################################################
     # POST-PROCESS: PRINT ALL FOUND EPSILON-EQUILIBRIA
@@ -0,0 +1,186 @@
+'''
+Payoff tensor of the restricted game defined by the finite strategy sets of the suppliers.
+For small restricted games, the profits of all the strategy profiles are simulated directly
+and the subgame equilibrium is found by enumeration, instead of solving the fixed-point MIP model.
+'''
+
+# General
+import time
+import copy
+import itertools
+import numpy as np
+
+# Project
+import supply_opt
+import fixed_point_MIP
+import generate_strategies
+import update_bounds
+import choice_preprocess
+import timing
+
+# Data
+import data_parking as data_file
+
+# Maximum number of simulated utilities held in memory at once
+CHUNK_SIZE = 10**7
+
+
+def tensorSize(data):
+    '''Number of simulated utilities: strategy profiles x alternatives x draws with a positive weight'''
+
+    nProfiles = np.prod([len(data['list_strategies_opt'][k]) for k in range(1, data['K'] + 1)], dtype=float)
+
+    return nProfiles * data['I_tot'] * np.count_nonzero(data['weights'])
+
+
+def profilePrices(data, profiles):
+    '''
+    Prices of all the alternatives (one row per profile) for the strategy profiles
+    (one row per profile, one column per supplier, with the indices of the strategies)
+    '''
+
+    strategyPrices = np.asarray(data['strategies']['prices'], dtype=float)
+
+    prices = np.tile(np.asarray(data['p_fixed'], dtype=float), (len(profiles), 1))
+    for k in range(1, data['K'] + 1):
+        alts = data['list_alt_supplier'][k]
+        prices[:, alts] = strategyPrices[alts][:, profiles[:, k - 1]].T
+
+    return prices
+
+
+def simulateProfits(data, prices):
+    '''
+    Demands and profits for each row of prices, simulating the choices
+    of the customers and draws with a positive weight
+    '''
+
+    I = data['I_tot']
+    n, r = np.nonzero(data['weights'] > 0)
+    endo_coef, exo = supply_opt.utilityTerms(data)
+    endo_coef, exo, weights = endo_coef[:, n, r], exo[:, n, r], data['weights'][n, r]
+
+    demand = np.zeros((len(prices), I))
+    chunk = max(1, CHUNK_SIZE // (I * len(weights)))
+    for start in range(0, len(prices), chunk):
+        p = prices[start:start + chunk]
+        choice = np.argmax(endo_coef[None, :, :] * p[:, :, None] + exo[None, :, :], axis=1)
+        for i in range(I):
+            demand[start:start + chunk, i] = (choice == i) @ weights
+
+    profits = np.zeros((len(prices), data['K'] + 1))
+    for i in range(I):
+        profits[:, data['operator'][i]] += demand[:, i] * (prices[:, i] - data['customer_cost'][i])
+
+    return demand, profits
+
+
+@timing.timed('solve')
+def solveRestrictedGame(data):
+    '''
+    Subgame equilibrium of the restricted game by enumeration of its payoff tensor.
+    The selected profile minimizes the total regret of the suppliers (sum over the suppliers
+    of the profit of their best strategy minus their profit), as the objective function
+    of the fixed-point MIP model: a pure equilibrium if the regret is zero, an approximate
+    equilibrium otherwise. Returns the same dictionary of results as fixed_point_MIP.solveModel.
+    '''
+
+    print('\n\nPAYOFF TENSOR OF THE RESTRICTED GAME:\n')
+
+    t_in = time.time()
+
+    data['scenarios'] = copy.deepcopy(data['strategies'])
+
+    K = data['K']
+    strategySets = [data['list_strategies_opt'][k] for k in range(1, K + 1)]
+    shape = [len(strategies) for strategies in strategySets]
+
+    # Profits of all the strategy profiles
+    profiles = np.array(list(itertools.product(*strategySets)), dtype=int)
+    prices = profilePrices(data, profiles)
+    demand, profits = simulateProfits(data, prices)
+    payoff = profits[:, 1:].reshape(shape + [K])
+
+    # Regret of each profile
+    regret = np.zeros(shape)
+    for k in range(K):
+        regret += np.max(payoff[..., k], axis=k, keepdims=True) - payoff[..., k]
+    best = np.argmin(regret)
+
+    print('Strategy profiles: {:8d}\nTensor size      : {:8.0f}'.format(len(profiles), tensorSize(data)))
+
+    ### SAVE THE RESULTS IN A DICTIONARY OF RESULTS
+    results = {}
+    results['prices_in'] = prices[best]
+    results['prices_fin'] = copy.deepcopy(results['prices_in'])
+    results['demand'] = demand[best]
+    results['demand_fin'] = np.full([data['I_tot']], 0.0)
+    results['modeshare'] = np.full([4], 0.0)
+    results['supply_choice_in'] = np.full([K+1, data['tot_strategies']], 0.0)
+    results['supply_choice_fin'] = np.full([K+1, data['tot_strategies']], 0.0)
+    results['max_profit_in'] = profits[best].copy()
+    results['max_profit_in'][0] = 0.0
+    results['max_profit_fin'] = np.full(K+1, 0.0)
+
+    # Scenarios: unilateral deviation of the owner of each strategy from the selected profile
+    scenarioPrices = np.tile(results['prices_in'], (data['tot_strategies'], 1))
+    for l in range(data['tot_strategies']):
+        alts = data['list_alt_supplier'][data['scenarios']['optimizer'][l]]
+        scenarioPrices[l, alts] = np.asarray(data['scenarios']['prices'], dtype=float)[alts, l]
+    demandScenarios, profitsScenarios = simulateProfits(data, scenarioPrices)
+    results['prices_scenarios'] = scenarioPrices.T
+    results['demand_scenarios'] = demandScenarios.T
+    results['profits_scenarios'] = np.full([K+1, data['tot_strategies']], -1.0)
+    results['profits_scenarios'][1:] = profitsScenarios[:, 1:].T
+
+    # Supply choices: strategy of the selected profile (initial) and best strategy (final)
+    for k in range(1, K + 1):
+        l_in = profiles[best, k - 1]
+        l_fin = data['list_strategies_opt'][k][np.argmax(results['profits_scenarios'][k][data['list_strategies_opt'][k]])]
+        results['supply_choice_in'][k][l_in] = 1.0
+        results['supply_choice_fin'][k][l_fin] = 1.0
+        for i in data['list_alt_supplier'][k]:
+            results['prices_fin'][i] = results['prices_scenarios'][i][l_fin]
+            results['demand_fin'][i] = results['demand_scenarios'][i][l_fin]
+            results['max_profit_fin'][k] += results['demand_fin'][i] * (results['prices_fin'][i] - data['customer_cost'][i])
+
+    results['profit_in'] = copy.deepcopy(results['max_profit_in'])
+    results['profit_in'][0] = -1.0
+    results['profit_fin'] = copy.deepcopy(results['max_profit_fin'])
+    results['profit_fin'][0] = -1.0
+    results['obj'] = regret.ravel()[best]
+
+    ### PRINT THE RESULTS
+    print('\nRuntime    : {:8.3f} sec'.format(time.time() - t_in))
+    if results['obj'] > 0:
+        print('No pure equilibrium of the restricted game: profile with the minimum total regret')
+
+    fixed_point_MIP.printResults(data, results)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    t_0 = time.time()
+
+    # Get the data and compute exogenous terms
+    data = data_file.getData()
+    data_file.preprocessUtilities(data)
+
+    generate_strategies.generateStrategySets(data)
+
+    update_bounds.updateSubgamePriceBounds(data)
+    update_bounds.updateUtilityBounds(data)
+
+    choice_preprocess.choicePreprocess(data)
+
+    t_1 = time.time()
+
+    # Enumerate the payoff tensor
+    results = solveRestrictedGame(data)
+    t_2 = time.time()
+
+    print('\n ---- TIMING ---- ')
+    print('Read data + preprocess : {:8.3f} sec'.format(t_1 - t_0))
+    print('Payoff tensor          : {:8.3f} sec'.format(t_2 - t_1))
@@ -3,11 +3,13 @@
 # General
 import sys
 import time
-import copy
 import matplotlib.pyplot as plt
 import warnings
 import numpy as np
 
+# Project
+import timing
+
 # Data
 import data_parking as data_file
 
@@ -73,60 +75,69 @@ def printOutputAnalysis(data):
     print()
 
 
-def calculation(data):
+def simulateChoices(U, drawShare):
+    '''
+    Choices of the customers for the utilities U[i,n,r], for all the customers and draws at once:
+    choice indicators w[i,n,r], expected maximum utilities EMU[n] (averaged over the draws) and
+    choice probabilities P[i,n], where drawShare[n,r] is the share of draw r in the probabilities of customer n
+    '''
+
+    choice = np.argmax(U, axis=0)
+
+    w = np.zeros(U.shape)
+    np.put_along_axis(w, choice[None], 1.0, axis=0)
+
+    EMU = np.sum(np.take_along_axis(U, choice[None], axis=0)[0], axis=1) / U.shape[2]
+    P = np.einsum('inr,nr->in', w, drawShare)
+
+    return w, EMU, P
 
-    price = copy.deepcopy(data['p_fixed'])
+
+@timing.timed('postprocess')
+def calculation(data, weights=None):
+    '''
+    Utilities, choices, demands and profits at the prices p_fixed.
+    weights are the weights of the draws in the demand (e.g. data['weights'], valid for prices
+    within the bounds of the choice preprocessing), popN[n]/R if None. Expected maximum utilities
+    are averaged over all the draws, since merged draws have the same choice but not the same utility.
+    '''
+
+    price = np.array(data['p_fixed'], dtype=float)
+    popN = np.asarray(data['popN'], dtype=float)
+    resident = np.asarray(data['RESIDENT']) == 1
+    nonresident = np.asarray(data['RESIDENT']) == 0
+
+    # Share of each draw in the choice probabilities of its customer
+    if weights is None:
+        weights = np.repeat(popN[:, None] / data['R'], data['R'], axis=1)
+    drawShare = weights / np.sum(weights, axis=1, keepdims=True)
 
     data['output'] = {}
-    data['output']['U'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['EMU'] = np.zeros([data['N']])
-    data['output']['w'] = np.zeros([data['I_tot'], data['N'], data['R']])
-    data['output']['P'] = np.zeros([data['I_tot'], data['N']])
-    data['output']['profit'] = np.zeros([data['K']+1])
-    data['output']['demand'] = np.zeros([data['I_tot']])
-    data['output']['demand_res'] = np.zeros([data['I_tot']])
-    data['output']['demand_nonres'] = np.zeros([data['I_tot']])
-    data['output']['market_share'] = np.zeros([data['I_tot']])
-    data['output']['market_share_res'] = np.zeros([data['I_tot']])
-    data['output']['market_share_nonres'] = np.zeros([data['I_tot']])
 
+    # Calculate utilities and choices (discount of the residents on the price of alternative 2)
+    endo_coef = np.array(data['endo_coef'], dtype=float)
+    endo_coef[2, resident] = endo_coef[2, resident] * (1 - data['disc_residents_PUP'])
+    U = endo_coef * price[:, None, None] + data['exo_utility'] + data['xi']
+    data['output']['U'] = U
+    data['output']['w'], data['output']['EMU'], data['output']['P'] = simulateChoices(U, drawShare)
 
-    # Calculate utilities and choices
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-                if data['RESIDENT'][n] == 1 and i == 2:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n,r] * (1 - data['disc_residents_PUP']) * price[i] +\
-                                                 data['exo_utility'][i,n,r] + data['xi'][i,n,r]
-                else:
-                    data['output']['U'][i,n,r] = data['endo_coef'][i,n,r] * price[i] +\
-                                                 data['exo_utility'][i,n,r] + data['xi'][i,n,r]
-            i_UMax = np.argmax(data['output']['U'][:,n,r])
-            data['output']['EMU'][n] += data['output']['U'][i_UMax, n, r]/data['R']
-            data['output']['w'][i_UMax,n,r] = 1
-            data['output']['P'][i_UMax, n] += 1/data['R']
-    
     # Calculate demand
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            data['output']['demand'][i] += data['output']['P'][i,n] * data['popN'][n]
-            if data['RESIDENT'][n] == 1:
-                data['output']['demand_res'][i] += data['output']['P'][i,n] * data['popN'][n]
-            elif data['RESIDENT'][n] == 0:
-                data['output']['demand_nonres'][i] += data['output']['P'][i,n] * data['popN'][n]
-    
+    data['output']['demand'] = data['output']['P'] @ popN
+    data['output']['demand_res'] = data['output']['P'][:, resident] @ popN[resident]
+    data['output']['demand_nonres'] = data['output']['P'][:, nonresident] @ popN[nonresident]
+
     # Calculate market shares
-    popR = int(sum([data['popN'][n] for n in range(data['N']) if data['RESIDENT'][n] == 1]))
-    popNR = int(sum([data['popN'][n] for n in range(data['N']) if data['RESIDENT'][n] == 0]))
+    popR = int(np.sum(popN[resident]))
+    popNR = int(np.sum(popN[nonresident]))
 
     data['output']['market_share'] = data['output']['demand'] / data['Pop']
     data['output']['market_share_res'] = data['output']['demand_res'] / popR
     data['output']['market_share_nonres'] = data['output']['demand_nonres'] / popNR
-    
+
     # Calculate profits
-    for k in range(data['K'] + 1):
-        for i in data['list_alt_supplier'][k]:
-            data['output']['profit'][k] += data['output']['demand'][i] * (price[i] - data['customer_cost'][i])
+    data['output']['profit'] = np.zeros([data['K']+1])
+    np.add.at(data['output']['profit'], data['operator'],
+              data['output']['demand'] * (price - np.asarray(data['customer_cost'], dtype=float)))
 
 
 def segments(data):
@@ -146,7 +157,6 @@ def segments(data):
 
     # Initialize population in each segment
     data['SEGMENT'] = np.zeros((data['N'],data['nSegments']))
-    data['popSegments'] = np.zeros((data['nSegments']))
 
     # Assign people to segments
     for n in range(data['N']):
@@ -169,8 +179,7 @@ def segments(data):
         if data['RESIDENT'][n] == 0 and data['LOW_INC'][n] == 0:
             data['SEGMENT'][n,7] = 1
  
-        for s in range(data['nSegments']):
-            data['popSegments'][s] += data['SEGMENT'][n][s] * data['popN'][n]
+    data['popSegments'] = data['SEGMENT'].T @ np.asarray(data['popN'], dtype=float)
 
     # Create list of people for each segment
     data['list_customer_segment'] = {}
@@ -178,12 +187,7 @@ def segments(data):
         data['list_customer_segment'][s] = [i for i, segment in enumerate(data['SEGMENT'][:,s]) if segment == s]
 
     # Calculate market shares for segments
-    data['SEGMENT_MARKET_SHARE'] = np.zeros((data['nSegments'], data['I_tot']))
-    for s in range(data['nSegments']):
-        for n in range(data['N']):
-            if data['SEGMENT'][n,s] == 1:
-                for i in range(data['I_tot']):
-                    data['SEGMENT_MARKET_SHARE'][s,i] += data['output']['P'][i,n] * data['popN'][n]
+    data['SEGMENT_MARKET_SHARE'] = data['SEGMENT'].T @ (data['output']['P'] * np.asarray(data['popN'], dtype=float)).T
 
     # Print market shares for segments
     print('\n\nMARKET SHARES PER SEGMENT  ', end=' ')
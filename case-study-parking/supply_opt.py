@@ -5,8 +5,12 @@
 
 # General
 import sys
+import os
 import time
 import copy
+import pickle
+import hashlib
+import collections
 import warnings
 import numpy as np
 
@@ -17,23 +21,167 @@ from cplex.exceptions import CplexSolverError
 # Project
 import update_bounds
 import choice_preprocess
+import timing
 
 # Data
 import data_parking as data_file
 
 
-def getModel(data):
+def getIndices(data, fixedStructure=False):
+    '''
+    Indices of the decision variables, computed from the (i, n, r) layout.
+    Prices and demands come first, so their indices depend only on I_tot.
+    Choice, utility and linearized variables are only defined for the choices that are not
+    precomputed and the draws with a positive weight (index -1 otherwise), unless fixedStructure is True.
+    '''
+
+    I, N, R = data['I_tot'], data['N'], data['R']
+
+    index = {}
+
+    # Alternatives managed by the optimizer (linearized choice-price variables)
+    index['alts_opt'] = np.array([i for i in range(data['I_opt_out'], data['I_tot'])
+                                  if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer'])], dtype=int)
+    # Alternatives with a fixed price (managed by the other suppliers)
+    index['alts_fixed'] = np.array([i for i in range(data['I_opt_out'], data['I_tot'])
+                                    if data['operator'][i] != data['optimizer']], dtype=int)
+
+    # Choices that are not precomputed, and customers that are not captive
+    if fixedStructure:
+        free = np.full((I, N, R), True)
+        notCaptive = np.full((N, R), True)
+        index['w_captive'] = np.full((I, N, R), False)
+    else:
+        free = np.full((I, N, R), False)
+        free[data['w_free']] = True
+        free &= data['weights'] > 0
+        notCaptive = (np.max(data['w_pre'], axis=0) < 0.5) & (data['weights'] > 0)
+        index['w_captive'] = data['w_pre'] == 1
+
+    index['p'] = np.arange(I)
+    index['d'] = I + np.arange(I)
+    start = 2*I
+    index['w'] = np.full((I, N, R), -1)
+    index['w'][free] = start + np.arange(np.count_nonzero(free))
+    start += np.count_nonzero(free)
+    index['U'] = np.full((I, N, R), -1)
+    index['U'][free] = start + np.arange(np.count_nonzero(free))
+    start += np.count_nonzero(free)
+    index['Umax'] = np.full((N, R), -1)
+    index['Umax'][notCaptive] = start + np.arange(np.count_nonzero(notCaptive))
+    start += np.count_nonzero(notCaptive)
+    free_opt = free[index['alts_opt']]
+    index['alpha'] = np.full((len(index['alts_opt']), N, R), -1)
+    index['alpha'][free_opt] = start + np.arange(np.count_nonzero(free_opt))
+    start += np.count_nonzero(free_opt)
+    index['nVar'] = start
+
+    return index
+
+
+def variableNames(name, indices, offset=None):
+    '''
+    Names of a block of variables, e.g. w[i][n][r], skipping the undefined ones (index -1).
+    The first index of the names is taken from offset if given (e.g. alternatives of alpha).
+    '''
+    return [name + ''.join('[' + str(j) + ']' for j in
+                           (position if offset is None else (offset[position[0]],) + position[1:]))
+            for position in np.ndindex(*np.shape(indices)) if indices[position] >= 0]
+
+
+def addConstraints(model, blocks):
+    '''
+    Add a list of constraint blocks to the model with a single bulk call.
+    Each block is a tuple (name, cols, vals, sense, rhs): cols and vals have one row per constraint
+    (vals is broadcast to the shape of cols) and rhs one value per constraint.
+    Returns the indices of the rows of each block.
+    '''
+
+    rows, cols, vals, senses, rhs = [], [], [], [], []
+    rowsBlock = {}
+    nRows = 0
+    first = model.linear_constraints.get_num()
+
+    for name, c, v, s, b in blocks:
+        b = np.ravel(b).astype(float)
+        rowsBlock[name] = first + np.arange(nRows, nRows + len(b))
+        if len(b) == 0:
+            continue
+        c = np.asarray(c).reshape(len(b), -1)
+        v = np.broadcast_to(np.asarray(v, dtype=float), c.shape)
+        rows.append(np.repeat(np.arange(nRows, nRows + len(b)), c.shape[1]))
+        cols.append(c.ravel())
+        vals.append(v.ravel())
+        senses.append(s * len(b))
+        rhs.append(b)
+        nRows += len(b)
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    vals = np.concatenate(vals)
+    nonzero = vals != 0
+
+    model.linear_constraints.add(senses = ''.join(senses),
+                                 rhs = np.concatenate(rhs).tolist())
+    model.linear_constraints.set_coefficients(list(zip((first + rows[nonzero]).tolist(),
+                                                       cols[nonzero].tolist(),
+                                                       vals[nonzero].tolist())))
+
+    return rowsBlock
+
+
+def utilityTerms(data):
+    '''
+    Endogenous coefficients and exogenous terms (including the error terms)
+    of the utilities, as arrays of shape (I, N, R)
+    '''
+
+    I, N = data['I_tot'], data['N']
+
+    # Parking case study: discount for residents on the PUP alternative
+    discount = np.ones((I, N, 1))
+    discount[np.ix_(np.arange(I) == 2, np.asarray(data['RESIDENT']) == 1)] = 1 - data['disc_residents_PUP']
+
+    return data['endo_coef'] * discount, data['exo_utility'] + data['xi']
+
+
+def getModel(data, names=False):
     '''
     CPLEX model for the choice-based optimization problem
     (1 supplier optimizing, all the rest fixed)
+    Variable names are only added if names is True.
+    '''
+
+    model, index = buildModel(data, names)
+
+    return model
+
+
+@timing.timed('build')
+def buildModel(data, names=False, fixedStructure=False):
+    '''
+    Build the model of getModel, and return it together with the
+    indices of its variables and of its blocks of constraints.
+    The choices precomputed in w_pre are removed from the model: captive customers
+    only contribute a constant demand. If fixedStructure is True, the precomputed
+    choices are imposed through the bounds of w instead, so that the model can be
+    updated when the preprocessing changes.
     '''
 
     print('\nOPTIMIZER {:2d}'.format(data['optimizer']))
 
     t_in = time.time()
+
+    I, N, R = data['I_tot'], data['N'], data['R']
+    lb_p = np.asarray(data['lb_p'], dtype=float)
+    ub_p = np.asarray(data['ub_p'], dtype=float)
+    weights = data['weights']
+    index = getIndices(data, fixedStructure)
+    alts_opt = index['alts_opt']
     
     # Initialize the model
     model = cplex.Cplex()
+    model.parameters.threads.set(data['cplex_threads'])
 
     ##########################################
     ##### ----- OBJECTIVE FUNCTION ----- #####
@@ -43,120 +191,79 @@ def getModel(data):
     model.objective.set_sense(model.objective.sense.maximize)
 
     # Add the fixed cost to the objective function
-    initial_cost = 0.0
-    for i in range(data['I_opt_out'], data['I_tot']):
-        if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-            # Alternative i is managed by the optimizer
-            initial_cost += data['fixed_cost'][i]
+    # (alternatives managed by the optimizer)
+    initial_cost = np.sum(np.asarray(data['fixed_cost'], dtype=float)[alts_opt])
     model.objective.set_offset(-initial_cost)
 
     ##########################################
     ##### ----- DECISION VARIABLES ----- #####
     ##########################################
 
-    # BATCH OF CHOICE VARIABLES
-    typeVar = []
-    nameVar = []
+    obj = np.zeros(index['nVar'])
+    lb = np.zeros(index['nVar'])
+    ub = np.zeros(index['nVar'])
+    types = np.full(index['nVar'], model.variables.type.continuous)
 
-    # Customer choice variables
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                typeVar.append(model.variables.type.binary)
-                nameVar.append('w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
+    free = index['w'] >= 0
+    notCaptive = index['Umax'] >= 0
+    free_opt = free[alts_opt]
 
-    model.variables.add(types = [typeVar[i] for i in range(len(typeVar))],
-                        names = [nameVar[i] for i in range(len(nameVar))])
+    # Price variables
+    lb[index['p']] = lb_p
+    ub[index['p']] = ub_p
+    # Revenue from the captive customers of the optimizer (constant demand)
+    obj[index['p'][alts_opt]] = np.sum(index['w_captive'][alts_opt] * weights, axis=(1, 2))
 
-    # BATCH OF UTILITY AND PRICE VARIABLES
-    typeVar = []
-    nameVar = []
-    lbVar = []
-    ubVar = []
+    # Auxiliary variables to calculate the demand
+    # Add customer cost in the objective function
+    obj[index['d'][alts_opt]] = -np.asarray(data['customer_cost'], dtype=float)[alts_opt]
+    ub[index['d']] = data['Pop']
+
+    # Customer choice variables
+    ub[index['w'][free]] = 1.0
+    types[index['w'][free]] = model.variables.type.binary
+    if fixedStructure:
+        # Precomputed choices are fixed through the bounds
+        lb[index['w'][data['w_pre'] == 1]] = 1.0
+        ub[index['w'][data['w_pre'] == 0]] = 0.0
 
     # Utility variables
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-                    typeVar.append(model.variables.type.continuous)
-                    nameVar.append('U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
-                    lbVar.append(data['lb_U'][i,n,r])
-                    ubVar.append(data['ub_U'][i,n,r])
+    lb[index['U'][free]] = data['lb_U'][free]
+    ub[index['U'][free]] = data['ub_U'][free]
 
     # Maximum utility for each customer and draw
-    for n in range(data['N']):
-        for r in range(data['R']):
-            if np.max(data['w_pre'][:,n,r]) < 0.5:
-                typeVar.append(model.variables.type.continuous)
-                nameVar.append('Umax[' + str(n) + ']' + '[' + str(r) + ']')
-                lbVar.append(-cplex.infinity)
-                ubVar.append(cplex.infinity)
-
-    # Price variables
-    for i in range(data['I_tot']):
-        typeVar.append(model.variables.type.continuous)
-        nameVar.append('p[' + str(i) + ']')
-        lbVar.append(data['lb_p'][i])
-        ubVar.append(data['ub_p'][i])
-
-    model.variables.add(types = [typeVar[i] for i in range(len(typeVar))],
-                        lb = [lbVar[i] for i in range(len(typeVar))],
-                        ub = [ubVar[i] for i in range(len(typeVar))],
-                        names = [nameVar[i] for i in range(len(nameVar))])
-
-    # BATCH OF CHOICE-PRICE AND DEMAND VARIABLES
-    objVar = []
-    typeVar = []
-    nameVar = []
-    lbVar = []
-    ubVar = []
+    lb[index['Umax'][notCaptive]] = -cplex.infinity
+    ub[index['Umax'][notCaptive]] = cplex.infinity
 
     # Linearized choice-price variables
-    for i in range(data['I_opt_out'], data['I_tot']):
-        if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-            for n in range(data['N']):
-                for r in range(data['R']):
-                    objVar.append(data['popN'][n]/data['R'])
-                    typeVar.append(model.variables.type.continuous)
-                    nameVar.append('alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']')
-                    lbVar.append(0.0)
-                    ubVar.append(data['ub_p'][i])
-
-    # Auxiliary variables to calculate the demand
-    for i in range(data['I_tot']):
-        # Add customer cost in the objective function
-        if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-            objVar.append(-data['customer_cost'][i])
-        else:
-            objVar.append(0.0)
-        typeVar.append(model.variables.type.continuous)
-        nameVar.append('d[' + str(i) + ']')
-        lbVar.append(0.0)
-        ubVar.append(data['Pop'])
-
-    model.variables.add(obj = [objVar[i] for i in range(len(objVar))],
-                        types = [typeVar[i] for i in range(len(typeVar))],
-                        lb = [lbVar[i] for i in range(len(typeVar))],
-                        ub = [ubVar[i] for i in range(len(typeVar))],
-                        names = [nameVar[i] for i in range(len(nameVar))])
+    obj[index['alpha'][free_opt]] = np.broadcast_to(weights, free_opt.shape)[free_opt]
+    ub[index['alpha'][free_opt]] = np.broadcast_to(ub_p[alts_opt, None, None], free_opt.shape)[free_opt]
+
+    if names:
+        nameVar = ([variableNames('p', index['p']), variableNames('d', index['d']), variableNames('w', index['w']),
+                    variableNames('U', index['U']), variableNames('Umax', index['Umax']),
+                    variableNames('alpha', index['alpha'], alts_opt)])
+        nameVar = [name for block in nameVar for name in block]
+    else:
+        nameVar = None
+
+    model.variables.add(obj = obj.tolist(),
+                        lb = lb.tolist(),
+                        ub = ub.tolist(),
+                        types = ''.join(types),
+                        names = nameVar)
 
     print('CPLEX model: all decision variables added. N variables: %r. Time: %r'\
           %(model.variables.get_num(), round(time.time()-t_in,2)))
 
-    # Creating a dictionary that maps variable names to indices, to speed up constraints creation
-    # https://www.ibm.com/developerworks/community/forums/html/topic?id=2349f613-26b1-4c29-aa4d-b52c9505bf96
-    nameToIndex = { n : j for j, n in enumerate(model.variables.get_names()) }
-
 
     #########################################
     ##### -------- CONSTRAINTS -------- #####
     #########################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
+    # Each block: (name, indices, coefficients, sense, rhs), one row per constraint
+    # (columns with index -1 are given a zero coefficient and dropped)
+    constraints = []
 
     ###################################################
     ### ------ Instance-specific constraints ------ ###
@@ -170,196 +277,88 @@ def getModel(data):
     ##### Fixed price constraints
     # The price of the alternatives not managed by the current optimizer are fixed
     if data['p_fixed'] is not None:
-        for i in range(data['I_tot']):
-            if (i >= data['I_opt_out']) and (data['operator'][i] != data['optimizer']):
-                indicesConstr.append([nameToIndex['p[' + str(i) + ']']])
-                coefsConstr.append([1.0])
-                sensesConstr.append('E')
-                rhsConstr.append(data['p_fixed'][i])
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+        fixed = index['alts_fixed']
+        constraints.append(('price_fixed', index['p'][fixed], 1.0, 'E', np.asarray(data['p_fixed'], dtype=float)[fixed]))
 
     ###################################################
     ### ------------ Choice constraints ----------- ###
     ###################################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
-
-    # Each customer chooses one alternative
-    for n in range(data['N']):
-        for r in range(data['R']):
-            ind = []
-            co = []
-            for i in range(data['I_tot']):
-                ind.append(nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                co.append(1.0)
-            indicesConstr.append(ind)
-            coefsConstr.append(co)
-            sensesConstr.append('E')
-            rhsConstr.append(1.0)
-
-    # All captive customers are assigned
-    for i in range(data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] == 0 or data['w_pre'][i,n,r] == 1:
-                    indicesConstr.append([nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                    coefsConstr.append([1.0])
-                    sensesConstr.append('E')
-                    rhsConstr.append(data['w_pre'][i,n,r])
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    # Each customer that is not captive chooses one alternative
+    w = index['w'].reshape(I, N*R).T[notCaptive.ravel()]
+    constraints.append(('choice', np.maximum(w, 0), w >= 0, 'E', np.ones(len(w))))
 
     #######################################
     ##### ----- Price constraints ---- ####
     #######################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
-
     # Linearized price
-    for i in range(data['I_opt_out'], data['I_tot']):
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if (data['optimizer'] is None) or (data['operator'][i] == data['optimizer']):
-                    if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-
-                        # Alpha is equal to 0 if alternative is not chosen
-        
-                        # Lower bound constraint
-                        indicesConstr.append([nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        coefsConstr.append([data['lb_p'][i], -1.0])
-                        sensesConstr.append('L')
-                        rhsConstr.append(0.0)
-        
-                        # Upper bound constraint
-                        indicesConstr.append([nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        coefsConstr.append([data['ub_p'][i], -1.0])
-                        sensesConstr.append('G')
-                        rhsConstr.append(0.0)
-        
-                        # Alpha is equal to the price if alternative is chosen
-        
-                        # Alpha is greater than the price for the chosen alternative
-                        indicesConstr.append([nameToIndex['p[' + str(i) + ']'],
-                                              nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        coefsConstr.append([1.0, data['ub_p'][i], -1.0])
-                        sensesConstr.append('L')
-                        rhsConstr.append(data['ub_p'][i])
-    
-                        # Alpha is smaller than the price
-                        indicesConstr.append([nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                              nameToIndex['p[' + str(i) + ']']])
-                        coefsConstr.append([1.0, -1.0])
-                        sensesConstr.append('L')
-                        rhsConstr.append(0.0)
-
-                    else:
-                        indicesConstr.append([nameToIndex['p[' + str(i) + ']'],
-                                              nameToIndex['alpha[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                        coefsConstr.append([data['w_pre'][i,n,r], -1.0])
-                        sensesConstr.append('E')
-                        rhsConstr.append(0.0)
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    p = np.broadcast_to(index['p'][alts_opt, None, None], (len(alts_opt), N, R))
+    lb_p_alpha = np.broadcast_to(lb_p[alts_opt, None, None], (len(alts_opt), N, R))
+    ub_p_alpha = np.broadcast_to(ub_p[alts_opt, None, None], (len(alts_opt), N, R))
+    w = index['w'][alts_opt][free_opt]
+    alpha = index['alpha'][free_opt]
+    ones = np.ones(len(w))
+
+    # Alpha is equal to 0 if alternative is not chosen
+    constraints.append(('alpha_lb', np.stack([w, alpha], axis=1),
+                        np.stack([lb_p_alpha[free_opt], -ones], axis=1), 'L', np.zeros(len(w))))
+    constraints.append(('alpha_ub', np.stack([w, alpha], axis=1),
+                        np.stack([ub_p_alpha[free_opt], -ones], axis=1), 'G', np.zeros(len(w))))
+
+    # Alpha is greater than the price for the chosen alternative
+    constraints.append(('alpha_price', np.stack([p[free_opt], w, alpha], axis=1),
+                        np.stack([ones, ub_p_alpha[free_opt], -ones], axis=1), 'L', ub_p_alpha[free_opt]))
+
+    # Alpha is smaller than the price
+    constraints.append(('alpha_max', np.stack([alpha, p[free_opt]], axis=1), [1.0, -1.0], 'L', np.zeros(len(w))))
 
     #######################################
     #### ----- Utility constraints ---- ###
     #######################################
 
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
+    U = index['U'][free]
+    Umax = np.broadcast_to(index['Umax'], (I, N, R))[free]
+    w = index['w'][free]
+    M = np.broadcast_to(data['M_U'], (I, N, R))[free]
+    ones = np.ones(len(U))
 
-    for i in range(data['I_tot']):
-        
-        #### Utility constraints
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-                    indicesConstr.append([nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                          nameToIndex['p[' + str(i) + ']']])
-                    # Parking case study
-                    if data['DCM'] == 'MixedLogit':
-                        if data['RESIDENT'][n] == 1 and i == 2:
-                            coefsConstr.append([1.0, -(1-data['disc_residents_PUP'])*data['endo_coef'][i, n, r]])
-                            rhsConstr.append(data['exo_utility'][i, n, r] + data['xi'][i, n, r])
-                        else:
-                            coefsConstr.append([1.0, -data['endo_coef'][i, n, r]])
-                            rhsConstr.append(data['exo_utility'][i, n, r] + data['xi'][i, n, r])                    
-                    sensesConstr.append('E')
-        
-        #### Utility maximization: the selected alternative is the one with the highest utility
-        for n in range(data['N']):
-            for r in range(data['R']):
-                if data['w_pre'][i,n,r] != 0 and data['w_pre'][i,n,r] != 1:
-
-                    indicesConstr.append([nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                          nameToIndex['Umax[' + str(n) + ']' + '[' + str(r) + ']']])
-                    coefsConstr.append([1.0, -1.0])
-                    sensesConstr.append('L')
-                    rhsConstr.append(0.0)
-
-                    indicesConstr.append([nameToIndex['Umax[' + str(n) + ']' + '[' + str(r) + ']'],
-                                          nameToIndex['U[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'],
-                                          nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']']])
-                    coefsConstr.append([1.0, -1.0, data['M_U'][n, r]])
-                    sensesConstr.append('L')
-                    rhsConstr.append(data['M_U'][n, r])
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    #### Utility constraints
+    endo_coef, exo = utilityTerms(data)
+    constraints.append(('utility', np.stack([U, np.broadcast_to(index['p'][:, None, None], (I, N, R))[free]], axis=1),
+                        np.stack([ones, -endo_coef[free]], axis=1), 'E', exo[free]))
+
+    #### Utility maximization: the selected alternative is the one with the highest utility
+    constraints.append(('utility_max', np.stack([U, Umax], axis=1), [1.0, -1.0], 'L', np.zeros(len(U))))
+    constraints.append(('utility_choice', np.stack([Umax, U, w], axis=1), np.stack([ones, -ones, M], axis=1), 'L', M))
 
     #######################################
     #### ---- Auxiliary constraints --- ###
     #######################################
         
-    ### Calculating demands (not part of the model)
-    indicesConstr = []
-    coefsConstr = []
-    sensesConstr = []
-    rhsConstr = []
+    ### Calculating demands (not part of the model), captive customers are a constant term
+    w = index['w'].reshape(I, N*R)
+    constraints.append(('demand', np.concatenate([np.maximum(w, 0), index['d'][:, None]], axis=1),
+                        np.concatenate([np.where(w >= 0, -weights.reshape(1, N*R), 0.0), np.ones((I, 1))], axis=1),
+                        'E', np.sum(index['w_captive'] * weights, axis=(1, 2))))
 
-    for i in range(data['I_tot']):
-        ind = []
-        co = []
-        for n in range(data['N']):
-            for r in range(data['R']):
-                ind.append(nameToIndex['w[' + str(i) + ']' + '[' + str(n) + ']' + '[' + str(r) + ']'])
-                co.append(-data['popN'][n]/data['R'])
-        ind.append(nameToIndex['d[' + str(i) + ']'])
-        co.append(1.0)
-        indicesConstr.append(ind)
-        coefsConstr.append(co)
-        sensesConstr.append('E')
-        rhsConstr.append(0.0)
-
-    model.linear_constraints.add(lin_expr = [[indicesConstr[i], coefsConstr[i]] for i in range(len(indicesConstr))],
-                                 senses = [sensesConstr[i] for i in range(len(sensesConstr))],
-                                 rhs = [rhsConstr[i] for i in range(len(rhsConstr))])
+    index['rows'] = addConstraints(model, constraints)
+
+    # Size reduction from the precomputed choices
+    nRemoved = np.count_nonzero(~notCaptive) + 4*np.count_nonzero(~free_opt) + 3*np.count_nonzero(~free)
+    if nRemoved > 0:
+        print('CPLEX model: precomputed choices removed. N variables: %r. N constraints: %r'\
+              %(int(getIndices(data, fixedStructure=True)['nVar'] - index['nVar']), int(nRemoved)))
 
     print('CPLEX model: all constraints added. N constraints: %r. Time: %r\n'\
           %(model.linear_constraints.get_num(), round(time.time()-t_in,2)))
 
-    return model
+    timing.modelSize(model)
+
+    return model, index
 
 
+@timing.timed('solve')
 def solveModel(data, model):
 
     try:
@@ -367,31 +366,17 @@ def solveModel(data, model):
         #model.set_warning_stream(None)
 
         model.solve()
+        timing.solverStatus(model)
 
         ### PRINT OBJ FUNCTION
         if data['lb_profit'] is not None:
             print('Lower bound of optimizer profit              : {:10.4f}'.format(data['lb_profit']))
-            print('Lower bound of optimizer profit              : {:10.4f}'.format(data['lb_profit']), file=f)
         print('Objective function value of optimizer profit : {:10.4f}'.format(model.solution.get_objective_value()))
-        print('Objective function value of optimizer profit : {:10.4f}'.format(model.solution.get_objective_value()), file=f)
-
-        ### INITIALIZE DICTIONARY OF RESULTS
-        results = {}
-        results['prices'] = copy.deepcopy(data['p_fixed'])
-        results['demand'] = np.empty(data['I_tot'])
-        results['profits'] = np.full([data['K']+1], 0.0)
 
         ### SAVE RESULTS
-        for i in range(data['I_tot']):
-            results['prices'][i] = model.solution.get_values('p[' + str(i) + ']')
-            results['demand'][i] = model.solution.get_values('d[' + str(i) + ']')
-            results['profits'][data['operator'][i]] += results['demand'][i]*(results['prices'][i] - data['customer_cost'][i])
+        results = readSolution(data, model)
 
-        ### PRINT PRICES, DEMANDS, PROFITS
-        print('\nAlt  Supplier     Price    Demand  Market share      Profit')
-        for i in range(data['I_tot']):
-                print(' {:2d}       {:2d}     {:6.4f}    {:6.3f}        {:6.4f}     {:7.4f}'
-                        .format(i, data['operator'][i], results['prices'][i], results['demand'][i], results['demand'][i] / data['Pop'], results['profits'][i]))
+        printResults(data, results)
 
         return results
     
@@ -399,6 +384,471 @@ def solveModel(data, model):
         raise Exception('Exception raised during solve')
 
 
+@timing.timed('extract')
+def readSolution(data, model):
+    '''Prices, demands and profits of the solution of the model'''
+
+    ### INITIALIZE DICTIONARY OF RESULTS
+    results = {}
+    results['profits'] = np.full([data['K']+1], 0.0)
+
+    # Solution vector, extracted once and read by index
+    solution = np.array(model.solution.get_values())
+    index = getIndices(data)
+    results['prices'] = solution[index['p']]
+    results['demand'] = solution[index['d']]
+    np.add.at(results['profits'], data['operator'], results['demand']*(results['prices'] - np.asarray(data['customer_cost'], dtype=float)))
+
+    return results
+
+
+def simulateResults(data):
+    '''Prices, demands and profits at the current prices p_fixed, simulating the choices of the customers'''
+
+    p = np.array(data['p_fixed'], dtype=float)
+    endo_coef, exo = utilityTerms(data)
+    choice = np.argmax(endo_coef * p[:, None, None] + exo, axis=0)
+
+    results = {}
+    results['prices'] = p
+    results['demand'] = np.bincount(choice.ravel(), weights=data['weights'].ravel(), minlength=data['I_tot'])
+    results['profits'] = np.full([data['K']+1], 0.0)
+    np.add.at(results['profits'], data['operator'], results['demand']*(results['prices'] - np.asarray(data['customer_cost'], dtype=float)))
+
+    return results
+
+
+def deviationThreshold(data):
+    '''
+    Profit of the optimizer above which it has a profitable deviation from the subgame equilibrium:
+    lb_profit (its profit at the equilibrium) increased by the accepted profit increase eps_equilibrium_profit,
+    and at least by best_response_oracle_tolerance (strictly above lb_profit, also when lb_profit <= 0)
+    '''
+    return data['lb_profit'] + max(data['eps_equilibrium_profit'] * abs(data['lb_profit']), data['best_response_oracle_tolerance'])
+
+
+def isDeviation(data, profit):
+    '''Whether a profit of the optimizer is a profitable deviation (the acceptance test of every best-response path)'''
+    return bool(profit > deviationThreshold(data))
+
+
+def setOracle(data, model, oracle):
+    '''
+    Oracle mode of the best-response MIP: objective cutoff at the deviation threshold,
+    and stop at the first incumbent (a profitable deviation if its profit exceeds the threshold,
+    since CPLEX also accepts an incumbent at the cutoff).
+    MIP starts at the current prices are below the cutoff, so they are removed.
+    Without oracle mode the parameters are reset, since the models can be reused.
+    '''
+
+    if oracle:
+        model.MIP_starts.delete()
+        model.parameters.mip.tolerances.lowercutoff.set(deviationThreshold(data) + model.objective.get_offset())
+        model.parameters.mip.limits.solutions.set(1)
+    else:
+        model.parameters.mip.tolerances.lowercutoff.reset()
+        model.parameters.mip.limits.solutions.reset()
+
+
+@timing.timed('solve')
+def solveOracle(data, model):
+    '''
+    Decide whether the optimizer has a profitable deviation, with a model in oracle mode (setOracle).
+    Returns the first improving strategy found (results['deviation'] is True), or the results
+    at the current prices p_fixed if there is none (results['deviation'] is False, and
+    results['certified'] tells whether the MIP proved it). An incumbent at the cutoff whose profit
+    is not a deviation (isDeviation) decides nothing: the results are then not certified.
+    '''
+
+    try:
+        model.set_results_stream(None)
+        model.solve()
+        timing.solverStatus(model)
+    except CplexSolverError:
+        raise Exception('Exception raised during solve')
+
+    print('Lower bound of optimizer profit              : {:10.4f}'.format(data['lb_profit']))
+    print('Profit threshold of a deviation              : {:10.4f}'.format(deviationThreshold(data)))
+
+    if model.solution.is_primal_feasible():
+        results = readSolution(data, model)
+        profit = results['profits'][data['optimizer']]
+        results['deviation'] = isDeviation(data, profit)
+        results['certified'] = results['deviation']
+        if results['deviation']:
+            print('Profitable deviation found                   : {:10.4f}'.format(profit))
+        else:
+            print('Incumbent at the profit threshold, not a deviation: {:10.4f}'.format(profit))
+    else:
+        results = simulateResults(data)
+        results['deviation'] = False
+        results['certified'] = model.solution.get_status() == model.solution.status.MIP_infeasible
+        if results['certified']:
+            print('No profitable deviation (proved by the MIP)')
+        else:
+            print('No profitable deviation found, not proved: ' + model.solution.get_status_string())
+
+    printResults(data, results)
+
+    return results
+
+
+def printResults(data, results):
+    '''Print prices, demands and profits of a best response'''
+
+    print('\nAlt  Supplier     Price    Demand  Market share      Profit')
+    for i in range(data['I_tot']):
+            print(' {:2d}       {:2d}     {:6.4f}    {:6.3f}        {:6.4f}     {:7.4f}'
+                    .format(i, data['operator'][i], results['prices'][i], results['demand'][i], results['demand'][i] / data['Pop'], results['profits'][i]))
+
+
+def breakpointApplies(data):
+    '''
+    The exact breakpoint best response applies if the optimizer manages a single alternative,
+    the prices of all the other alternatives are fixed and its utility is non-increasing in its price
+    '''
+
+    if not data['breakpoint_best_response'] or data['optimizer'] is None or data['p_fixed'] is None:
+        return False
+
+    alts_opt = [i for i in range(data['I_opt_out'], data['I_tot']) if data['operator'][i] == data['optimizer']]
+    if len(alts_opt) != 1:
+        return False
+
+    endo_coef, exo = utilityTerms(data)
+
+    return bool(np.all(endo_coef[alts_opt[0]] <= 0))
+
+
+@timing.timed('solve')
+def breakpointBestResponse(data):
+    '''
+    Exact best response of an optimizer managing a single alternative i, with all the other prices fixed.
+    Customer (n, r) chooses i if and only if its price is not greater than the threshold
+        t[n, r] = (max_{j != i} U[j, n, r] - exo[i, n, r]) / endo_coef[i, n, r]
+    The demand is a step function of the price, and the profit is maximized at one of the
+    thresholds in [lb_p, ub_p] or at ub_p. Thresholds are sorted once: O(NR log NR).
+    Returns the same dictionary of results as solveModel.
+    '''
+
+    print('\nOPTIMIZER {:2d} (breakpoint best response)'.format(data['optimizer']))
+
+    I = data['I_tot']
+    i = [j for j in range(data['I_opt_out'], data['I_tot']) if data['operator'][j] == data['optimizer']][0]
+    weight = data['weights']
+    customer_cost = np.asarray(data['customer_cost'], dtype=float)
+
+    # Utilities at the fixed prices, and best alternative other than i
+    p = np.array(data['p_fixed'], dtype=float)
+    endo_coef, exo = utilityTerms(data)
+    U = endo_coef * p[:, None, None] + exo
+    U[i] = -np.inf
+    i_other = np.argmax(U, axis=0)
+    U_other = np.take_along_axis(U, i_other[None, :, :], axis=0)[0]
+
+    # Threshold price of each customer and draw (+inf/-inf if the utility does not depend on the price)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        threshold = np.where(endo_coef[i] < 0, (U_other - exo[i]) / endo_coef[i],
+                             np.where(exo[i] >= U_other, np.inf, -np.inf))
+
+    # Demand at each candidate price: weight of the thresholds not smaller than the price
+    order = np.argsort(threshold, axis=None)
+    sortedThreshold = threshold.ravel()[order]
+    cumWeight = np.concatenate([[0.0], np.cumsum(weight.ravel()[order])])
+    candidates = np.unique(np.append(sortedThreshold[(sortedThreshold >= data['lb_p'][i]) & (sortedThreshold <= data['ub_p'][i])],
+                                     data['ub_p'][i]))
+    demand = cumWeight[-1] - cumWeight[np.searchsorted(sortedThreshold, candidates, side='left')]
+    profit = (candidates - customer_cost[i]) * demand
+
+    # Best price, and choices of the customers at this price
+    best = np.argmax(profit)
+    p[i] = candidates[best]
+    choice = np.where(threshold >= p[i], i, i_other)
+
+    results = {}
+    results['prices'] = p
+    results['demand'] = np.bincount(choice.ravel(), weights=weight.ravel(), minlength=I)
+    results['profits'] = np.full([data['K']+1], 0.0)
+    np.add.at(results['profits'], data['operator'], results['demand']*(results['prices'] - customer_cost))
+
+    ### PRINT OBJ FUNCTION
+    if data['lb_profit'] is not None:
+        print('Lower bound of optimizer profit              : {:10.4f}'.format(data['lb_profit']))
+    print('Objective function value of optimizer profit : {:10.4f}'.format(profit[best] - data['fixed_cost'][i]))
+
+    printResults(data, results)
+
+    return results
+
+
+def checkBreakpoint(data, results):
+    '''Cross-check the breakpoint best response against the best-response MIP'''
+
+    print('\nCROSS-CHECK OF THE BREAKPOINT BEST RESPONSE (MIP):')
+    resultsMIP = solveModel(data, getModel(data))
+
+    k = data['optimizer']
+    if abs(results['profits'][k] - resultsMIP['profits'][k]) > 1e-4 * max(1.0, abs(resultsMIP['profits'][k])):
+        print('\nINCONSISTENCY! Supp {:2d}\n Breakpoint {:10.4f}  MIP {:10.4f}\n'
+              .format(k, results['profits'][k], resultsMIP['profits'][k]))
+    else:
+        print('\nBreakpoint best response and MIP are consistent. Supp {:2d}: {:10.4f}'.format(k, results['profits'][k]))
+
+
+@timing.timed('build')
+def updateModel(data, model, index):
+    '''
+    Update a model built by buildModel with fixedStructure=True for the same optimizer
+    to the current data: bounds of prices and utilities, precomputed choices,
+    fixed prices, big-M values and weights of the draws
+    '''
+
+    t_in = time.time()
+
+    lb_p = np.asarray(data['lb_p'], dtype=float)
+    ub_p = np.asarray(data['ub_p'], dtype=float)
+    alts_opt = index['alts_opt']
+    w_opt = index['w'][alts_opt].ravel()
+    lb_p_alpha = np.repeat(lb_p[alts_opt], data['N']*data['R'])
+    ub_p_alpha = np.repeat(ub_p[alts_opt], data['N']*data['R'])
+
+    # Bounds of prices, utilities, choices and linearized choice-price variables
+    model.variables.set_lower_bounds(list(zip(
+        np.concatenate([index['p'], index['U'].ravel(), index['w'].ravel()]).tolist(),
+        np.concatenate([lb_p, data['lb_U'].ravel(), (data['w_pre'] == 1).ravel()]).tolist())))
+    model.variables.set_upper_bounds(list(zip(
+        np.concatenate([index['p'], index['U'].ravel(), index['w'].ravel(), index['alpha'].ravel()]).tolist(),
+        np.concatenate([ub_p, data['ub_U'].ravel(), (data['w_pre'] != 0).ravel(), ub_p_alpha]).tolist())))
+
+    # Fixed prices
+    if 'price_fixed' in index['rows']:
+        model.linear_constraints.set_rhs(list(zip(index['rows']['price_fixed'].tolist(),
+                                                  np.asarray(data['p_fixed'], dtype=float)[index['alts_fixed']].tolist())))
+
+    # Linearized price and big-M values
+    M = np.broadcast_to(data['M_U'], (data['I_tot'], data['N'], data['R'])).ravel()
+    model.linear_constraints.set_rhs(list(zip(np.concatenate([index['rows']['alpha_price'], index['rows']['utility_choice']]).tolist(),
+                                              np.concatenate([ub_p_alpha, M]).tolist())))
+    model.linear_constraints.set_coefficients(list(zip(
+        np.concatenate([index['rows']['alpha_lb'], index['rows']['alpha_ub'], index['rows']['alpha_price'],
+                        index['rows']['utility_choice'], np.repeat(index['rows']['demand'], data['N']*data['R'])]).tolist(),
+        np.concatenate([w_opt, w_opt, w_opt, index['w'].ravel(), index['w'].ravel()]).tolist(),
+        np.concatenate([lb_p_alpha, ub_p_alpha, ub_p_alpha, M, -np.tile(data['weights'].ravel(), data['I_tot'])]).tolist())))
+
+    # Weights of the draws in the revenues
+    model.objective.set_linear(list(zip(index['alpha'].ravel().tolist(),
+                                        np.broadcast_to(data['weights'], index['alpha'].shape).ravel().tolist())))
+
+    print('CPLEX model: bounds and constraints updated. N variables: %r. Time: %r\n'\
+          %(model.variables.get_num(), round(time.time()-t_in,2)))
+
+    timing.modelSize(model)
+
+
+def setStartingSolution(data, model, index):
+    '''
+    MIP start at the current prices p_fixed, i.e. the previous best responses,
+    with the choices, utilities and demands simulated at these prices
+    '''
+
+    I = data['I_tot']
+    p = np.asarray(data['p_fixed'], dtype=float)
+
+    endo_coef, exo = utilityTerms(data)
+    U = endo_coef * p[:, None, None] + exo
+    w = (np.argmax(U, axis=0)[None, :, :] == np.arange(I)[:, None, None]).astype(float)
+
+    values = np.zeros(index['nVar'])
+    values[index['p']] = p
+    values[index['d']] = np.sum(w * data['weights'], axis=(1, 2))
+    values[index['w']] = w
+    values[index['U']] = np.clip(U, data['lb_U'], data['ub_U'])
+    values[index['Umax']] = np.max(values[index['U']], axis=0)
+    values[index['alpha']] = p[index['alts_opt'], None, None] * w[index['alts_opt']]
+
+    model.MIP_starts.delete()
+    model.MIP_starts.add(cplex.SparsePair(ind = list(range(index['nVar'])), val = values.tolist()),
+                         model.MIP_starts.effort_level.repair)
+
+
+def workerThreads(data, workers):
+    '''
+    CPLEX threads of each of the workers solving best-response problems in parallel:
+    cplex_threads, or the cores shared among the workers if it is 0 (automatic)
+    '''
+
+    if data['cplex_threads'] == 0:
+        return max(1, os.cpu_count() // workers)
+
+    return data['cplex_threads']
+
+
+def computeBestResponse(data, models=None, oracle=False):
+    '''
+    Best response of the current optimizer. The exact breakpoint method is used when it applies
+    (cross-checked against the MIP if check_breakpoint is True), otherwise the MIP is solved.
+    If models is given, one model per optimizer is kept in models across calls:
+    each model is built once, then updated and warm-started.
+    If oracle is True, the MIP only decides whether the optimizer can improve its profit lb_profit
+    by more than eps_equilibrium_profit (solveOracle) instead of being solved to optimality;
+    the exact breakpoint method decides it from the best response (always certified).
+    '''
+
+    if breakpointApplies(data):
+        results = breakpointBestResponse(data)
+        if data['check_breakpoint']:
+            checkBreakpoint(data, results)
+        if oracle:
+            # The exact best response decides whether there is a profitable deviation
+            results['deviation'] = isDeviation(data, results['profits'][data['optimizer']])
+            results['certified'] = True
+        return results
+
+    if models is None:
+        model = getModel(data)
+    else:
+        if data['optimizer'] in models:
+            print('\nOPTIMIZER {:2d}'.format(data['optimizer']))
+            updateModel(data, *models[data['optimizer']])
+        else:
+            models[data['optimizer']] = buildModel(data, fixedStructure=True)
+
+        model, index = models[data['optimizer']]
+        if data['p_fixed'] is not None and not oracle:
+            setStartingSolution(data, model, index)
+
+    setOracle(data, model, oracle)
+    if oracle:
+        return solveOracle(data, model)
+
+    return solveModel(data, model)
+
+
+#######################################################
+############ MEMOIZATION OF BEST RESPONSES ############
+#######################################################
+
+# Best responses already computed, in least recently used order (shared by all the calls of solveBestResponse)
+bestResponseCache = collections.OrderedDict()
+# Files of persisted best responses already loaded in bestResponseCache
+loadedCacheFiles = set()
+
+
+def instanceFingerprint(data):
+    '''
+    Hash of the data that define the choices and profits (utilities, weights, operators, costs),
+    computed once and kept in data['instance_fingerprint'] until the choice preprocessing changes the weights
+    '''
+
+    if data['instance_fingerprint'] is None:
+        endo_coef, exo = utilityTerms(data)
+        fingerprint = hashlib.sha1()
+        for array in [endo_coef, exo, data['weights'], data['operator'], data['customer_cost'], data['fixed_cost']]:
+            array = np.ascontiguousarray(array, dtype=float)
+            fingerprint.update(str(array.shape).encode())
+            fingerprint.update(array.tobytes())
+        data['instance_fingerprint'] = fingerprint.hexdigest()
+
+    return data['instance_fingerprint']
+
+
+def roundedPrices(data, prices):
+    '''Prices rounded to best_response_cache_decimals, as a tuple (part of the keys of bestResponseCache)'''
+    return tuple(np.round(np.asarray(prices, dtype=float), data['best_response_cache_decimals']).tolist())
+
+
+def bestResponseKey(data, oracle):
+    '''
+    Key of the best response of the current optimizer in bestResponseCache: instance fingerprint,
+    fixed prices of the competitors and price bounds (rounded to best_response_cache_decimals).
+    In oracle mode the results also depend on the prices of the optimizer and on the deviation threshold.
+    '''
+
+    prices = ()
+    if data['p_fixed'] is not None:
+        prices = np.asarray(data['p_fixed'], dtype=float)
+        if not oracle:
+            prices = prices[np.asarray(data['operator']) != data['optimizer']]
+        prices = roundedPrices(data, prices)
+
+    key = (instanceFingerprint(data), data['optimizer'], oracle, prices, roundedPrices(data, data['lb_p']), roundedPrices(data, data['ub_p']))
+    if oracle:
+        key += (round(deviationThreshold(data), data['best_response_cache_decimals']),)
+
+    return key
+
+
+def loadCache(data):
+    '''
+    Load the best responses persisted in best_response_cache_file (once per file). The file is a sequence
+    of pickled (key, results) entries in the order they were computed; an entry cut by an interrupted
+    write ends the sequence. Only the best_response_cache_size most recent entries are kept.
+    '''
+
+    path = data['best_response_cache_file']
+    if path is None or path in loadedCacheFiles:
+        return
+    loadedCacheFiles.add(path)
+
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    key, results = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    break
+                bestResponseCache[key] = results
+                bestResponseCache.move_to_end(key)
+        while len(bestResponseCache) > data['best_response_cache_size']:
+            bestResponseCache.popitem(last=False)
+        print('Best responses loaded from {:s}: {:d}'.format(path, len(bestResponseCache)))
+
+
+def saveCacheEntry(data, key):
+    '''
+    Append the best response key of bestResponseCache to best_response_cache_file
+    (one write per entry, so that the processes sharing the file do not overwrite each other)
+    '''
+
+    path = data['best_response_cache_file']
+    if path is None:
+        return
+
+    entry = pickle.dumps((key, bestResponseCache[key]))
+    with open(path, 'ab') as f:
+        f.write(entry)
+
+
+def solveBestResponse(data, models=None, oracle=False):
+    '''
+    Best response of the current optimizer (computeBestResponse). If best_response_cache_size > 0,
+    the best responses are memoized in bestResponseCache (LRU eviction beyond best_response_cache_size
+    entries), optionally appended to best_response_cache_file to be reused by later runs.
+    '''
+
+    if data['best_response_cache_size'] <= 0:
+        return computeBestResponse(data, models, oracle)
+
+    loadCache(data)
+    key = bestResponseKey(data, oracle)
+
+    if key in bestResponseCache:
+        bestResponseCache.move_to_end(key)
+        print('\nOPTIMIZER {:2d}: best response found in the cache'.format(data['optimizer']))
+        results = copy.deepcopy(bestResponseCache[key])
+        printResults(data, results)
+        return results
+
+    results = computeBestResponse(data, models, oracle)
+
+    bestResponseCache[key] = copy.deepcopy(results)
+    saveCacheEntry(data, key)
+    while len(bestResponseCache) > data['best_response_cache_size']:
+        bestResponseCache.popitem(last=False)
+
+    return results
+
+
 if __name__ == '__main__':
 
     t_0 = time.time()
@@ -418,7 +868,7 @@ if __name__ == '__main__':
     t_1 = time.time()
 
     #Solve choice-based optimization problem
-    model = getModel(data)
+    model = getModel(data, names=True)
     results = solveModel(data, model)
 
     t_2 = time.time()
@@ -7,11 +7,15 @@ import time
 import copy
 import numpy as np
 
+# Project
+import timing
+
 # Data
-import Data_Parking_MixedLogit as data_file
+import data_parking as data_file
 
 
 
+@timing.timed('bounds')
 def updateSubgamePriceBounds(data):
 
     lb_p = copy.deepcopy(data['initial_data']['ub_p'])
@@ -31,49 +35,73 @@ def updateSubgamePriceBounds(data):
     data['subgame_ub_p'] = copy.deepcopy(ub_p)
 
 
-def updateUtilityBounds(data):
-    
-    # Utility bounds
-    lb_U = np.empty([data['I_tot'], data['N'], data['R']])
-    ub_U = np.empty([data['I_tot'], data['N'], data['R']])
-    lb_Umin = np.full((data['N'], data['R']), np.inf)
-    ub_Umax = np.full((data['N'], data['R']), -np.inf)
-
-    M = np.empty([data['N'], data['R']])
-
-    for n in range(data['N']):
-        for r in range(data['R']):
-            for i in range(data['I_tot']):
-
-                # Parking case study
-                if data['DCM'] == 'MixedLogit':
-                    if data['RESIDENT'][n] == 1 and i == 2:
-                        if data['endo_coef'][i, n, r] > 0:
-                            lb_U[i, n, r] = data['endo_coef'][i, n, r] * (1-data['disc_residents_PUP']) * data['lb_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-                            ub_U[i, n, r] = data['endo_coef'][i, n, r] * (1-data['disc_residents_PUP']) * data['ub_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-                        elif data['endo_coef'][i, n, r] <= 0:
-                            lb_U[i, n, r] = data['endo_coef'][i, n, r] * (1-data['disc_residents_PUP']) * data['ub_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-                            ub_U[i, n, r] = data['endo_coef'][i, n, r] * (1-data['disc_residents_PUP']) * data['lb_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-                    else:
-                        if data['endo_coef'][i, n, r] > 0:
-                            lb_U[i, n, r] = data['endo_coef'][i, n, r] * data['lb_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-                            ub_U[i, n, r] = data['endo_coef'][i, n, r] * data['ub_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-                        elif data['endo_coef'][i, n, r] <= 0 :
-                            lb_U[i, n, r] = data['endo_coef'][i, n, r] * data['ub_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-                            ub_U[i, n, r] = data['endo_coef'][i, n, r] * data['lb_p'][i] + data['exo_utility'][i, n, r] + data['xi'][i, n, r]
-
-            # Bounds for each customer, for each draw
-            lb_Umin[n, r] = np.min(lb_U[:, n, r])
-            ub_Umax[n, r] = np.max(ub_U[:, n, r])
-
-            # Calcule the big-M values
-            M[n, r] = ub_Umax[n, r] - lb_Umin[n, r]
+def utilityBoundsAlternatives(data, alts):
+    '''Utility bounds of the alternatives in alts for all customers and draws'''
+
+    lb_U = np.empty([len(alts), data['N'], data['R']])
+    ub_U = np.empty([len(alts), data['N'], data['R']])
+
+    # Parking case study
+    if data['DCM'] == 'MixedLogit':
+        lb_p = np.asarray(data['lb_p'], dtype=float)[alts, None, None]
+        ub_p = np.asarray(data['ub_p'], dtype=float)[alts, None, None]
+        endo_coef = data['endo_coef'][alts]
+        exo = data['exo_utility'][alts] + data['xi'][alts]
+
+        # Discount for residents on the PUP alternative
+        discount = np.ones([len(alts), data['N'], 1])
+        discount[np.ix_(np.asarray(alts) == 2, np.asarray(data['RESIDENT']) == 1)] = 1 - data['disc_residents_PUP']
+        coef = endo_coef * discount
+
+        lb_U = np.where(endo_coef > 0, coef * lb_p, coef * ub_p) + exo
+        ub_U = np.where(endo_coef > 0, coef * ub_p, coef * lb_p) + exo
+
+    return lb_U, ub_U
+
+
+@timing.timed('bounds')
+def updateUtilityBounds(data, incremental=False):
+    '''
+    Utility bounds for all alternatives, customers and draws.
+    If incremental is True, only the alternatives whose price bounds
+    changed since the previous call are recomputed.
+    '''
+
+    shape = (data['I_tot'], data['N'], data['R'])
+    exo_terms = (data['exo_utility'], data['endo_coef'], data['xi'])
+    cache = data.get('utility_bounds_cache')
+
+    # The previous bounds can be reused only if the exogenous terms are unchanged
+    if (incremental and cache is not None and
+        all(a is b for a, b in zip(cache['exo_terms'], exo_terms)) and
+        data['lb_U'].shape == shape):
+        alts = np.flatnonzero((np.asarray(data['lb_p']) != cache['lb_p']) |
+                              (np.asarray(data['ub_p']) != cache['ub_p']))
+        lb_U = data['lb_U'].copy()
+        ub_U = data['ub_U'].copy()
+    else:
+        alts = np.arange(data['I_tot'])
+        lb_U = np.empty(shape)
+        ub_U = np.empty(shape)
+
+    if len(alts) > 0:
+        lb_U[alts], ub_U[alts] = utilityBoundsAlternatives(data, alts)
+
+    data['utility_bounds_cache'] = {
+        'lb_p': np.array(data['lb_p'], dtype=float),
+        'ub_p': np.array(data['ub_p'], dtype=float),
+        'exo_terms': exo_terms}
+
+    # Bounds for each customer, for each draw
+    lb_Umin = np.min(lb_U, axis=0)
+    ub_Umax = np.max(ub_U, axis=0)
 
     data['lb_U'] = lb_U
     data['ub_U'] = ub_U
     data['lb_Umin'] = lb_Umin
     data['ub_Umax'] = ub_Umax
-    data['M_U'] = M
+    # Calcule the big-M values
+    data['M_U'] = ub_Umax - lb_Umin
 
 
     # Profit bounds
@@ -93,14 +121,12 @@ def updateUtilityBounds(data):
 
 def updateMaxProfit(data):
 
+    # Captive customers of each alternative
+    captive = np.sum((data['w_pre'] == 1) * data['weights'], axis=(1, 2))
+    operator = np.asarray(data['operator'])
+
     for k in range(1, data['K'] + 1):
-        unreachableCustomers = 0
-        for i in range(data['I_tot']):
-            if data['operator'][i] != k:
-                for n in range(data['N']):
-                    for r in range(data['R']):
-                        if data['w_pre'][i,n,r] == 1:
-                            unreachableCustomers += data['popN'][n]/data['R']
+        unreachableCustomers = np.sum(captive[operator != k])
         data['M_Rev'][k] = np.amax(np.multiply(data['ub_p'], (data['Pop']-unreachableCustomers)) - data['fixed_cost'])
 
 